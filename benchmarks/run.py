@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the sc2ranks client against a local stub of the API.
+
+Every `Sc2Ranks` method and the construction of `Sc2RanksResponse` objects is
+run a number of times against a `stub_server.StubServer`. For each benchmark
+the throughput, the p50 and p99 latency of a call and the peak memory use are
+reported and written to a JSON file, so results of different releases can be
+compared:
+
+    python benchmarks/run.py --latency 5 --output results.json
+    python benchmarks/run.py --only mass --mass-size 500
+
+Each benchmark runs in a child process of its own, so its peak memory (the
+maximum resident set size reported by `resource`) is not inflated by the
+benchmarks before it or by the server.
+"""
+
+import os
+import sys
+import time
+import resource
+import traceback
+import platform
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sc2ranks import Sc2Ranks, Sc2RanksResponse
+from sc2ranks.decoders import json
+from sc2ranks.transport import ConnectionPool
+from stub_server import StubConfig, StubServer, character_with_teams
+
+API_URL = 'http://sc2ranks.com'
+
+
+class StubTransport(ConnectionPool):
+    """A connection pool sending the requests for sc2ranks.com to the stub."""
+
+    def __init__(self, url, maxsize=10):
+        ConnectionPool.__init__(self, maxsize)
+        self.url = url
+
+    def urlopen(self, url, body=None, headers=None):
+        if url.startswith(API_URL):
+            url = self.url + url[len(API_URL):]
+        return ConnectionPool.urlopen(self, url, body, headers)
+
+
+def characters(count, offset=0):
+    return [('eu', 'Player%d' % i, i) for i in range(offset, offset + count)]
+
+
+def benchmarks(options):
+    """
+    Returns the benchmarks as (name, function) pairs. Each function is called
+    with the client and the number of the call.
+    """
+    payload = character_with_teams('Player', 1, teams=options.teams)
+    return [
+        ('search_for_character',
+         lambda client, i: client.search_for_character('eu', 'Player%d' % i)),
+        ('search_for_profile',
+         lambda client, i: client.search_for_profile('eu', 'Player%d' % i)),
+        ('fetch_base_character',
+         lambda client, i: client.fetch_base_character('eu', 'Player%d' % i, i)),
+        ('fetch_base_character_teams',
+         lambda client, i: client.fetch_base_character_teams('eu', 'Player%d' % i, i)),
+        ('fetch_character_teams',
+         lambda client, i: client.fetch_character_teams('eu', 'Player%d' % i, i, '2v2')),
+        ('fetch_custom_division_characters',
+         lambda client, i: client.fetch_custom_division_characters(i, bracket=2)),
+        ('iter_custom_division_characters',
+         lambda client, i: list(client.iter_custom_division_characters(i, bracket=2))),
+        ('fetch_mass_base_characters',
+         lambda client, i: list(client.fetch_mass_base_characters(
+             characters(options.mass_size, i * options.mass_size)))),
+        ('fetch_mass_characters_team',
+         lambda client, i: list(client.fetch_mass_characters_team(
+             characters(options.mass_size, i * options.mass_size), '2v2'))),
+        ('response_construction',
+         lambda client, i: Sc2RanksResponse(payload).name),
+        ('response_full_access',
+         lambda client, i: [[m.name for m in t.members]
+                            for t in Sc2RanksResponse(payload).teams]),
+    ]
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def run_benchmark(fn, url, options, queue):
+    """Runs a benchmark in a child process and puts its result in `queue`."""
+    try:
+        queue.put(measure(fn, url, options))
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+
+
+def measure(fn, url, options):
+    client = Sc2Ranks('benchmark', mass_workers=options.mass_workers,
+                      transport=StubTransport(url))
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for i in range(options.warmup):
+        fn(client, options.iterations + i)
+    latencies = []
+    start = time.time()
+    for i in range(options.iterations):
+        call_start = time.time()
+        fn(client, i)
+        latencies.append(time.time() - call_start)
+    elapsed = time.time() - start
+    latencies.sort()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'calls': options.iterations,
+        'seconds': elapsed,
+        'throughput': options.iterations / elapsed if elapsed else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': latencies[-1] if latencies else None,
+        'peak_rss_kb': peak_rss,
+        'rss_growth_kb': peak_rss - start_rss,
+        'requests': client.pool.stats['requests'],
+    }
+
+
+def run(options):
+    config = StubConfig(options.latency / 1000.0, options.jitter / 1000.0,
+                        options.teams, options.division_size,
+                        options.search_results)
+    server = StubServer(config)
+    server.start()
+    results = {}
+    try:
+        for name, fn in benchmarks(options):
+            if options.only and not [part for part in options.only if part in name]:
+                continue
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_benchmark,
+                                              args=(fn, server.url, options, queue))
+            process.start()
+            results[name] = result = queue.get()
+            process.join()
+            if 'error' in result:
+                print "%-34s failed:\n%s" % (name, result['error'])
+                continue
+            print "%-34s %9.1f calls/s  p50 %8.2f ms  p99 %8.2f ms  peak %7d KB" % (
+                name, result['throughput'], result['latency_p50'] * 1000,
+                result['latency_p99'] * 1000, result['peak_rss_kb'])
+    finally:
+        server.stop()
+
+    options_dict = dict(options.__dict__)
+    options_dict.pop('output')
+    return {
+        'label': options.label,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': options_dict,
+        'stub': config.as_dict(),
+        'results': results,
+    }
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--iterations', type='int', default=200,
+                      help="calls per benchmark [%default]")
+    parser.add_option('--warmup', type='int', default=10,
+                      help="calls before measuring [%default]")
+    parser.add_option('--latency', type='float', default=0.0,
+                      help="server latency in milliseconds [%default]")
+    parser.add_option('--jitter', type='float', default=0.0,
+                      help="random extra server latency in milliseconds [%default]")
+    parser.add_option('--teams', type='int', default=4,
+                      help="teams per character [%default]")
+    parser.add_option('--division-size', type='int', default=100,
+                      help="teams per custom division [%default]")
+    parser.add_option('--search-results', type='int', default=10,
+                      help="characters found by a search [%default]")
+    parser.add_option('--mass-size', type='int', default=200,
+                      help="characters per mass call [%default]")
+    parser.add_option('--mass-workers', type='int', default=1,
+                      help="batches fetched in parallel by mass calls [%default]")
+    parser.add_option('--only', action='append', default=[],
+                      help="only run benchmarks whose name contains this, repeatable")
+    parser.add_option('--label', default=None,
+                      help="stored with the results, e.g. a release number")
+    parser.add_option('--output', default='benchmark-results.json',
+                      help="file to write the results to [%default]")
+    options, args = parser.parse_args()
+
+    report = run(options)
+    f = open(options.output, 'w')
+    try:
+        json.dump(report, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+    print "Results written to %s" % options.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+A local HTTP server imitating the sc2ranks.com API.
+
+The server answers the endpoints used by `sc2ranks.Sc2Ranks` (search,
+psearch, base/char, base/teams, char/teams, clist, mass/base/char and
+mass/base/teams) with synthetic payloads. How large the payloads are and how
+long the server waits before answering is set with a `StubConfig`.
+
+Run this module to start a server on its own:
+
+    python benchmarks/stub_server.py --port 8000 --latency 20
+"""
+
+import os
+import sys
+import gzip
+import time
+import random
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sc2ranks.decoders import json
+
+LEAGUES = ('bronze', 'silver', 'gold', 'platinum', 'diamond', 'master')
+RACES = ('terran', 'zerg', 'protoss', 'random')
+
+
+class StubConfig(object):
+    """
+    The payload sizes and latency of a `StubServer`.
+
+    **latency:** Seconds to wait before each response. **Default:** 0
+
+    **jitter:** Up to this many seconds are added to the latency at random.
+    **Default:** 0
+
+    **teams:** The number of teams of a character. **Default:** 4
+
+    **division_size:** The number of teams in a custom division.
+    **Default:** 100
+
+    **search_results:** The number of characters a search finds.
+    **Default:** 10
+
+    **gzip:** Compress responses if the client accepts it. **Default:** True
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, teams=4, division_size=100,
+                 search_results=10, gzip=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.teams = teams
+        self.division_size = division_size
+        self.search_results = search_results
+        self.gzip = gzip
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def character(name, bnet_id, region='eu'):
+    return {
+        'name': name,
+        'bnet_id': bnet_id,
+        'id': bnet_id * 10,
+        'region': region,
+        'character_code': bnet_id % 1000,
+        'achievement_points': (bnet_id * 37) % 5000,
+        'updated_at': '2011-01-01T12:00:00Z',
+        'portrait': {'icon_id': bnet_id % 5, 'row': bnet_id % 6, 'column': bnet_id % 4},
+    }
+
+
+def team(num, bracket=1, is_random=False, members=()):
+    return {
+        'bracket': bracket,
+        'is_random': is_random,
+        'league': LEAGUES[num % len(LEAGUES)],
+        'points': 1000 - num,
+        'wins': 100 + num,
+        'losses': 50 + num,
+        'division': 'Division %d' % num,
+        'division_rank': num + 1,
+        'world_rank': num * 7,
+        'region_rank': num * 3,
+        'fav_race': RACES[num % len(RACES)],
+        'updated_at': '2011-01-01T12:00:00Z',
+        'members': list(members),
+    }
+
+
+def character_with_teams(name, bnet_id, region='eu', teams=4, bracket=None,
+                         is_random=False):
+    data = character(name, bnet_id, region)
+    data['teams'] = []
+    for num in range(teams):
+        size = bracket or (num % 4) + 1
+        members = [{'name': 'Member%d' % i, 'bnet_id': bnet_id + i, 'region': region}
+                   for i in range(1, size)]
+        data['teams'].append(team(num, size, is_random, members))
+    return data
+
+
+class StubAPI(object):
+    """Builds the payloads of the API endpoints."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def get(self, path):
+        """Returns the payload of a GET request of an API path."""
+        parts = path.split('/')
+        config = self.config
+        if parts[0] == 'search':
+            name = parts[3]
+            return {'total': config.search_results,
+                    'characters': [{'name': '%s%d' % (name, i), 'bnet_id': i}
+                                   for i in range(config.search_results)]}
+        if parts[0] == 'psearch':
+            region, name = parts[1], parts[2]
+            return [dict(character('%s%d' % (name, i), i, region),
+                         team=team(i, 1))
+                    for i in range(config.search_results)]
+        if parts[0] in ('base', 'char'):
+            region = parts[2]
+            name, bnet_id = parts[3].split('!')
+            bnet_id = int(bnet_id)
+            if parts[:2] == ['base', 'char']:
+                return character(name, bnet_id, region)
+            if parts[:2] == ['base', 'teams']:
+                return character_with_teams(name, bnet_id, region, config.teams)
+            bracket = int(parts[4][0])
+            return character_with_teams(name, bnet_id, region, config.teams,
+                                        bracket, parts[5] in ('1', 'True'))
+        if parts[0] == 'clist':
+            bracket = int(parts[4])
+            return [team(num, bracket, parts[5] == '1',
+                         [character('Player%d' % (num * bracket + i), num * bracket + i)
+                          for i in range(bracket)])
+                    for num in range(config.division_size)]
+        return None
+
+    def post(self, path, form):
+        """Returns the payload of a mass request."""
+        if path not in ('mass/base/char', 'mass/base/teams'):
+            return None
+        fields = dict(urlparse.parse_qsl(form))
+        result = []
+        i = 0
+        while 'characters[%d][name]' % i in fields:
+            region = fields['characters[%d][region]' % i]
+            name = fields['characters[%d][name]' % i].decode('utf-8')
+            bnet_id = int(fields['characters[%d][bnet_id]' % i])
+            if path == 'mass/base/char':
+                result.append(character(name, bnet_id, region))
+            else:
+                result.append(character_with_teams(
+                    name, bnet_id, region, self.config.teams,
+                    int(fields.get('team[bracket]', 1)),
+                    fields.get('team[is_random]') == '1'))
+            i += 1
+        return result
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the headers and the body at once and do not hold back the last
+    # segment, otherwise keep-alive connections wait for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond(self.server.api.get(self.api_path()))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.respond(self.server.api.post(self.api_path(), self.rfile.read(length)))
+
+    def api_path(self):
+        path = urlparse.urlsplit(self.path)[2].strip('/')
+        if path.startswith('api/'):
+            path = path[len('api/'):]
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        return path
+
+    def respond(self, data):
+        config = self.server.api.config
+        delay = config.latency + random.random() * config.jitter
+        if delay:
+            time.sleep(delay)
+        if data is None:
+            data = {'error': 'no_route'}
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if config.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1)
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The stub API server, listening on `host`:`port` (a free port if 0).
+    `url` is the base URL to send API requests to.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), Handler)
+        self.api = StubAPI(config or StubConfig())
+        self.url = 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """Serves requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--port', type='int', default=8000)
+    parser.add_option('--latency', type='float', default=0.0,
+                      help="milliseconds to wait before each response")
+    parser.add_option('--jitter', type='float', default=0.0,
+                      help="up to this many milliseconds are added at random")
+    parser.add_option('--teams', type='int', default=4)
+    parser.add_option('--division-size', type='int', default=100)
+    parser.add_option('--search-results', type='int', default=10)
+    options, args = parser.parse_args()
+    config = StubConfig(options.latency / 1000.0, options.jitter / 1000.0,
+                        options.teams, options.division_size,
+                        options.search_results)
+    server = StubServer(config, port=options.port)
+    print "Serving the sc2ranks API stub on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
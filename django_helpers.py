@@ -1,7 +1,23 @@
+import urllib
+import threading
+
 from sc2ranks import Sc2Ranks
+from sc2ranks.core import character_key
+from sc2ranks.warmer import CacheWarmer
 from django.core.cache import cache
 
 CACHE_TIME = 60 * 60 * 4
+# how long characters which were not found are remembered
+NEGATIVE_CACHE_TIME = 60 * 5
+# instance attribute memoizing the data loaded for an instance, by cache key
+MEMO_ATTR = '_sc2ranks_memo'
+# bump to invalidate all cached data, e.g. when its format changes
+CACHE_KEY_VERSION = 1
+CACHE_KEY_PREFIX = 'sc2ranks'
+BASE_CHARACTER = 'base_character'
+# the brackets whose team stats can be loaded with the mass API. Its teams
+# come without members, which get_team_stats filters partners on.
+MASS_BRACKETS = (1,)
 
 try:
     from django.conf import settings
@@ -22,9 +38,195 @@ class Sc2RanksManager(object):
         self.bnet['bid'] = bid
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         # get instance values and pass data to api wrapper
         return Sc2RanksAPIWrapper(instance, **self.bnet)
 
+    def character(self, instance):
+        """Returns the (realm, name, bnet_id) of an instance."""
+        return (instance.__dict__[self.bnet['realm']],
+                instance.__dict__[self.bnet['name']],
+                instance.__dict__[self.bnet['bid']])
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the `Sc2Ranks` client shared by the whole process."""
+    global _client
+    _client_lock.acquire()
+    try:
+        if _client is None:
+            _client = Sc2Ranks(SC2RANKS_API_KEY, negative_ttl=NEGATIVE_CACHE_TIME)
+        return _client
+    finally:
+        _client_lock.release()
+
+
+def _cache_key(realm, bnet_id, name, kind):
+    # characters are only unique per region and bnet id, the name is quoted
+    # to keep the key valid for memcached
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return '%s:%d:%s:%s:%s:%s' % (CACHE_KEY_PREFIX, CACHE_KEY_VERSION,
+                                  str(realm).lower(), bnet_id,
+                                  urllib.quote(name, ''), kind)
+
+
+def base_character_cache_key(realm, bnet_id, name):
+    return _cache_key(realm, bnet_id, name, BASE_CHARACTER)
+
+
+def team_stats_cache_key(realm, bnet_id, name, bracket):
+    return _cache_key(realm, bnet_id, name, 'teams%s' % bracket)
+
+
+def prefetch_sc2ranks(instances, attr=None, brackets=(), base_character=True,
+                      client=None):
+    """
+    Loads the sc2ranks data of many model instances at once, for example
+    before rendering a list of players:
+
+        players = prefetch_sc2ranks(Player.objects.all(), brackets=(1,))
+
+    Data found in the cache is read with one `get_many`, everything else is
+    fetched with the mass API calls and stored with `set_many`. The data is
+    attached to the instances, so `base_character` and `get_team_stats` of
+    their `Sc2RanksManager` do not need the cache or the API anymore.
+
+    **attr:** The name of the `Sc2RanksManager` attribute of the model.
+    **Default:** the only one the model has
+
+    **brackets:** The team brackets to load for `get_team_stats`, only
+    those in `MASS_BRACKETS`, e.g. `(1,)`. **Default:** none
+
+    **base_character:** Whether to load `base_character`. **Default:** True
+
+    Returns the instances as a list.
+    """
+    _check_mass_brackets(brackets)
+    instances = list(instances)
+    if not instances:
+        return instances
+    manager = _find_manager(type(instances[0]), attr)
+    if client is None:
+        client = get_client()
+
+    # (memo, kind, cache key, character) of everything to load
+    wanted = []
+    for instance in instances:
+        realm, name, bnet_id = manager.character(instance)
+        memo = instance.__dict__.setdefault(MEMO_ATTR, {})
+        if not (realm and name and bnet_id):
+            continue
+        character = (realm, name, bnet_id)
+        if base_character:
+            wanted.append((memo, BASE_CHARACTER,
+                    base_character_cache_key(realm, bnet_id, name), character))
+        for bracket in brackets:
+            wanted.append((memo, bracket,
+                    team_stats_cache_key(realm, bnet_id, name, bracket), character))
+
+    cached = cache.get_many(list(set(key for _, _, key, _ in wanted)))
+    missing = {}
+    for memo, what, key, character in wanted:
+        if key in cached:
+            memo[key] = cached[key]
+        else:
+            missing.setdefault(what, []).append((memo, key, character))
+
+    fetched = {}
+    for what, loads in missing.items():
+        characters = [character for _, _, character in loads]
+        if what == BASE_CHARACTER:
+            responses = client.fetch_mass_base_characters(characters)
+        else:
+            responses = client.fetch_mass_characters_team(characters,
+                    '%sv%s' % (what, what))
+        found = {}
+        for response in responses:
+            try:
+                found[character_key(response)] = response
+            except (TypeError, ValueError):
+                # not one of the requested characters
+                continue
+        for memo, key, character in loads:
+            response = found.get(character_key(character))
+            memo[key] = response
+            if response is not None:
+                fetched[key] = response
+    if fetched:
+        cache.set_many(fetched, CACHE_TIME)
+    return instances
+
+
+def tracked_characters(instances, attr=None):
+    """
+    Returns the (realm, name, bnet_id) of every instance which has all of
+    them set. A queryset is evaluated anew on every call.
+    """
+    if hasattr(instances, 'all'):
+        instances = instances.all()
+    characters = []
+    manager = None
+    for instance in instances:
+        if manager is None:
+            manager = _find_manager(type(instance), attr)
+        realm, name, bnet_id = manager.character(instance)
+        if realm and name and bnet_id:
+            characters.append((realm, name, bnet_id))
+    return characters
+
+
+def warm_sc2ranks(instances, attr=None, brackets=(1,), base_character=True,
+                  once=False, period=None, client=None):
+    """
+    Keeps the cached sc2ranks data of `instances`, a queryset or a list of
+    model instances, fresh ahead of expiry. The refresh is spread over
+    `period` seconds, by default 3/4 of `CACHE_TIME`, and fills the same
+    keys `Sc2RanksManager` reads. Like `prefetch_sc2ranks`, it only takes
+    the `brackets` in `MASS_BRACKETS`.
+
+    Runs until interrupted, unless `once` is set, in which case every
+    character is refreshed once right away. Returns the `CacheWarmer`.
+    """
+    _check_mass_brackets(brackets)
+    warmer = CacheWarmer(client or get_client(), cache.set_many, ttl=CACHE_TIME,
+                         period=period, brackets=brackets,
+                         base_character=base_character,
+                         base_key=base_character_cache_key,
+                         team_key=team_stats_cache_key)
+    if once:
+        warmer.run_once(tracked_characters(instances, attr), spread=False)
+    else:
+        warmer.run(lambda: tracked_characters(instances, attr))
+    return warmer
+
+
+def _check_mass_brackets(brackets):
+    for bracket in brackets:
+        if int(bracket) not in MASS_BRACKETS:
+            raise ValueError("The team stats of bracket %s cannot be loaded "
+                             "with the mass API, it does not return the "
+                             "team members" % bracket)
+
+
+def _find_manager(model, attr=None):
+    """Returns the `Sc2RanksManager` of a model class."""
+    if attr is not None:
+        return model.__dict__[attr] if attr in model.__dict__ else getattr(model, attr)
+    managers = []
+    for cls in model.__mro__:
+        managers.extend(value for value in cls.__dict__.values()
+                        if isinstance(value, Sc2RanksManager))
+    if len(managers) != 1:
+        raise ValueError("%s has %d Sc2RanksManager attributes, pass attr" % (
+            model.__name__, len(managers)))
+    return managers[0]
+
 
 class Sc2RanksAPIWrapper(object):
 
@@ -32,7 +234,10 @@ class Sc2RanksAPIWrapper(object):
         self.bnet_name = instance.__dict__[name]
         self.bnet_realm = instance.__dict__[realm]
         self.bnet_id = instance.__dict__[bid]
-        self.client = Sc2Ranks(SC2RANKS_API_KEY)
+        # lives as long as the instance, usually one request, and holds what
+        # prefetch_sc2ranks loaded
+        self.memo = instance.__dict__.setdefault(MEMO_ATTR, {})
+        self.client = get_client()
 
     @property
     def profile_page(self):
@@ -50,17 +255,24 @@ class Sc2RanksAPIWrapper(object):
             partner = HandJudas, MrChance etc ...
         """
         data = None
-        cache_key = '%s%s' % (self.bnet_name, bracket)
-        cached_teams = cache.get(cache_key)
-
-        if cached_teams is not None:
-            data = cached_teams
+        cache_key = team_stats_cache_key(self.bnet_realm, self.bnet_id,
+                                         self.bnet_name, bracket)
+        if cache_key in self.memo:
+            # final, even if the character was not found
+            data = self.memo[cache_key]
         else:
-            data = self.client.fetch_character_teams(region=self.bnet_realm,
-                                                       name=self.bnet_name,
-                                                       bracket=bracket,
-                                                       bnet_id=self.bnet_id)
-            cache.set(cache_key, data, CACHE_TIME)
+            data = cache.get(cache_key)
+            if data is None:
+                data = self.client.fetch_character_teams(region=self.bnet_realm,
+                                                           name=self.bnet_name,
+                                                           bracket=bracket,
+                                                           bnet_id=self.bnet_id)
+                if data is not None:
+                    cache.set(cache_key, data, CACHE_TIME)
+            self.memo[cache_key] = data
+
+        if data is None:
+            return []
 
         teams = []
         for team in data.teams:
@@ -90,10 +302,14 @@ class Sc2RanksAPIWrapper(object):
     @property
     def base_character(self, cache_seconds=CACHE_TIME):
         character = None
-        cache_key = self.bnet_name
+        cache_key = base_character_cache_key(self.bnet_realm, self.bnet_id,
+                                             self.bnet_name)
+        if cache_key in self.memo:
+            return self.memo[cache_key]
         character = cache.get(cache_key)
 
         if character is not None:
+            self.memo[cache_key] = character
             return character
 
         character_data = self.client.fetch_base_character(name=self.bnet_name,
@@ -102,15 +318,17 @@ class Sc2RanksAPIWrapper(object):
         if character_data:
             character = character_data
             cache.set(cache_key, character, cache_seconds)
+        self.memo[cache_key] = character
         return character
 
 
     def get_portrait(self, size=75):
         """Returns the data needed to render the starcraft profile image."""
 
-        if self.base_character:
+        character = self.base_character
+        if character:
             try:
-                portrait = self.base_character.portrait
+                portrait = character.portrait
                 x = -(portrait.column * size)
                 y = -(portrait.row * size)
                 image = 'portraits-%d-%d.jpg' % (portrait.icon_id, size)
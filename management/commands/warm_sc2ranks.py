@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+
+from ...django_helpers import warm_sc2ranks, MASS_BRACKETS
+
+
+class Command(BaseCommand):
+    args = '<app_label.Model>'
+    help = ("Keeps the cached sc2ranks data of every instance of a model with "
+            "a Sc2RanksManager fresh.")
+    option_list = BaseCommand.option_list + (
+        make_option('--attr', dest='attr', default=None,
+            help='The Sc2RanksManager attribute, if the model has several'),
+        make_option('--brackets', dest='brackets', default='1',
+            help='Comma separated team brackets to refresh, only 1 is '
+                 'supported [default: 1]'),
+        make_option('--no-base', dest='base_character', action='store_false',
+            default=True, help='Do not refresh the base character data'),
+        make_option('--period', dest='period', type='float', default=None,
+            help='Seconds to spread the refresh over'),
+        make_option('--once', dest='once', action='store_true', default=False,
+            help='Refresh every character once right away and exit'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or '.' not in args[0]:
+            raise CommandError('Usage: warm_sc2ranks %s' % self.args)
+        model = get_model(*args[0].split('.', 1))
+        if model is None:
+            raise CommandError('Unknown model %s' % args[0])
+        try:
+            brackets = [int(b) for b in options['brackets'].split(',') if b]
+        except ValueError:
+            raise CommandError('Invalid brackets %r' % options['brackets'])
+        if [b for b in brackets if b not in MASS_BRACKETS]:
+            raise CommandError('Only the brackets %s can be refreshed' %
+                               ','.join(map(str, MASS_BRACKETS)))
+
+        warmer = warm_sc2ranks(model._default_manager.all(), attr=options['attr'],
+                               brackets=brackets,
+                               base_character=options['base_character'],
+                               once=options['once'], period=options['period'])
+        self.stdout.write('Refreshed %(refreshed)d entries, %(missing)d '
+                          'missing, %(errors)d failed batches\n' % warmer.stats)
@@ -1 +1 @@
-from core import Sc2Ranks, Sc2RanksResponse
+from core import Sc2Ranks, AsyncSc2Ranks, Sc2RanksResponse
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Automatic batching of single-character fetches.
+
+`BatchLoader` has the single-character methods of `Sc2Ranks`, but instead of
+sending one request per character it collects the characters asked for and
+fetches them with one call to a mass endpoint:
+
+* fetches from any thread within `window` seconds of each other are sent
+  together, each caller blocks until the batch has been fetched,
+* within a `batch()` block, `load_*` methods return futures and all of them
+  are fetched when the block ends:
+
+    loader = BatchLoader(client)
+    with loader.batch():
+        futures = [loader.load_base_character('eu', name, bnet_id)
+                   for name, bnet_id in characters]
+    characters = [future.result() for future in futures]
+
+Each caller gets its own `Sc2RanksResponse`, or `None` if the API did not
+return the character.
+"""
+
+import sys
+import logging
+import threading
+
+from core import MAX_CHARS, character_key
+from workers import Future
+
+LOG = logging.getLogger(__name__)
+
+BASE = 'base'
+
+
+class BatchLoader(object):
+    """
+    Batches the single-character fetches of `client`.
+
+    **window:** Seconds to wait for more fetches before a batch is sent.
+    **Default:** 0.005
+
+    **max_batch:** A batch is sent right away once it has this many
+    characters. **Default:** `MAX_CHARS`, the most one mass request takes
+
+    `stats` counts the characters asked for and the mass calls made.
+    """
+
+    def __init__(self, client, window=0.005, max_batch=MAX_CHARS):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = {'loads': 0, 'batches': 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def fetch_base_character(self, region, name, bnet_id):
+        return self._fetch(BASE, (region, name, bnet_id))
+
+    def fetch_character_teams(self, region, name, bnet_id, bracket, is_random=False):
+        return self._fetch(_teams_group(bracket, is_random), (region, name, bnet_id))
+
+    def load_base_character(self, region, name, bnet_id):
+        """Returns a `Future` of what `fetch_base_character` returns."""
+        return self._load(BASE, (region, name, bnet_id))
+
+    def load_character_teams(self, region, name, bnet_id, bracket, is_random=False):
+        """Returns a `Future` of what `fetch_character_teams` returns."""
+        return self._load(_teams_group(bracket, is_random), (region, name, bnet_id))
+
+    def batch(self):
+        """
+        Returns a context manager. Fetches of the current thread within it are
+        collected and sent when it is left, so the futures returned by the
+        `load_*` methods must not be waited for within the block. A `fetch_*`
+        call within the block sends the loads of its endpoint collected so
+        far right away, together with its own.
+        """
+        return _BatchScope(self)
+
+    def flush(self):
+        """Sends all batches collected so far."""
+        self._lock.acquire()
+        try:
+            pending, self._pending = self._pending, {}
+        finally:
+            self._lock.release()
+        for group, loads in pending.items():
+            self._dispatch(group, loads)
+
+    def _fetch(self, group, character):
+        future = self._load(group, character)
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None:
+            # the block would send it only when it ends, so send the loads of
+            # the group collected so far now instead of waiting forever
+            scope.flush(group)
+        return future.result()
+
+    def _load(self, group, character):
+        future = Future()
+        self._count('loads')
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None:
+            scope.add(group, character, future)
+            return future
+
+        full = False
+        timer = None
+        self._lock.acquire()
+        try:
+            loads = self._pending.setdefault(group, [])
+            loads.append((character, future))
+            if len(loads) >= self.max_batch:
+                del self._pending[group]
+                full = True
+            elif len(loads) == 1:
+                # the first fetch of a batch starts its window
+                timer = threading.Timer(self.window, self._flush_group,
+                        (group, loads))
+                timer.setDaemon(True)
+        finally:
+            self._lock.release()
+        if full:
+            self._dispatch(group, loads)
+        elif timer is not None:
+            timer.start()
+        return future
+
+    def _flush_group(self, group, loads):
+        self._lock.acquire()
+        try:
+            if self._pending.get(group) is not loads:
+                # sent already because it was full or flushed
+                return
+            del self._pending[group]
+        finally:
+            self._lock.release()
+        self._dispatch(group, loads)
+
+    def _dispatch(self, group, loads):
+        """Fetches the characters of `loads` and resolves their futures."""
+        characters = [character for character, future in loads]
+        self._count('batches')
+        LOG.debug("Fetching a batch of %d characters", len(characters))
+        try:
+            if group == BASE:
+                responses = self.client.fetch_mass_base_characters(characters)
+            else:
+                bracket, is_random = group
+                responses = self.client.fetch_mass_characters_team(characters,
+                        '%dv%d' % (bracket, bracket), is_random)
+            found = {}
+            for response in responses:
+                try:
+                    found[character_key(response)] = response
+                except (TypeError, ValueError):
+                    LOG.warning("Unexpected character in mass response: %r",
+                                response)
+        except Exception:
+            exc_info = sys.exc_info()
+            for character, future in loads:
+                future.set_exception(exc_info)
+            return
+        for character, future in loads:
+            future.set_result(found.get(character_key(character)))
+
+    def _count(self, name):
+        self._lock.acquire()
+        try:
+            self.stats[name] += 1
+        finally:
+            self._lock.release()
+
+
+def _teams_group(bracket, is_random):
+    # the brackets may be given as 1 or '1v1'
+    return (int(str(bracket)[0]), bool(is_random))
+
+
+class _BatchScope(object):
+    """The context manager returned by `BatchLoader.batch()`."""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._pending = {}
+        self._previous = None
+
+    def add(self, group, character, future):
+        self._pending.setdefault(group, []).append((character, future))
+
+    def flush(self, group):
+        """Sends the loads of `group` collected so far."""
+        loads = self._pending.pop(group, None)
+        if loads:
+            self._loader._dispatch(group, loads)
+
+    def __enter__(self):
+        local = self._loader._local
+        self._previous = getattr(local, 'scope', None)
+        local.scope = self
+        return self
+
+    def __exit__(self, *exc_info):
+        self._loader._local.scope = self._previous
+        pending, self._pending = self._pending, {}
+        for group, loads in pending.items():
+            if self._previous is not None:
+                # an outer block sends them
+                for character, future in loads:
+                    self._previous.add(group, character, future)
+            else:
+                self._loader._dispatch(group, loads)
+        return False
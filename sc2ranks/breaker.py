@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+A circuit breaker for requests to the API.
+
+When a large part of the recent requests failed, sc2ranks.com is most likely
+down or overloaded. Instead of letting every call wait for its own failure,
+the breaker opens and requests fail right away. After `reset_timeout` seconds
+a single request is let through to probe the API; if it succeeds, the breaker
+closes again.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the outcome of the last `window` requests.
+
+    **failure_ratio:** The breaker opens once this fraction of the tracked
+    requests failed. **Default:** 0.5
+
+    **min_requests:** No decision is made on fewer tracked requests.
+    **Default:** 10
+
+    **window:** How many of the most recent requests are tracked.
+    **Default:** 20
+
+    **reset_timeout:** Seconds the breaker stays open before a probe request
+    is let through. **Default:** 30
+
+    `stats` counts the requests rejected while the breaker was open and how
+    often it opened.
+    """
+
+    def __init__(self, failure_ratio=0.5, min_requests=10, window=20,
+                 reset_timeout=30):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.stats = {'rejected': 0, 'opened': 0}
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Tells whether a request may be sent. Every allowed request has to be
+        followed by a call to `record`, or to `cancel` if it was not sent.
+        """
+        self._lock.acquire()
+        try:
+            if self.state == OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    self.stats['rejected'] += 1
+                    return False
+                self.state = HALF_OPEN
+                LOG.info("Circuit half-open, probing the API")
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.stats['rejected'] += 1
+                    return False
+                self._probing = True
+            return True
+        finally:
+            self._lock.release()
+
+    def cancel(self):
+        """Gives back an allowed request which was not sent."""
+        self._lock.acquire()
+        try:
+            if self.state == HALF_OPEN:
+                self._probing = False
+        finally:
+            self._lock.release()
+
+    def record(self, success):
+        """Records the outcome of an allowed request."""
+        self._lock.acquire()
+        try:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    LOG.info("Circuit closed, the API is back")
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_requests:
+                failures = list(self._outcomes).count(False)
+                if failures >= self.failure_ratio * len(self._outcomes):
+                    LOG.warning("Circuit opened, %d of the last %d requests failed",
+                            failures, len(self._outcomes))
+                    self._open()
+        finally:
+            self._lock.release()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.time()
+        self.stats['opened'] += 1
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Caches for decoded API responses.
+
+Responses are keyed by their normalized API path (see `normalize_path`), so
+differences in region or name casing do not cause misses. Each endpoint can
+have its own time-to-live.
+
+`ResponseCache` keeps responses in memory and evicts the least recently used
+ones. `DiskCache` keeps them in an SQLite file together with their `ETag` and
+`Last-Modified` headers, so expired responses can be revalidated with a
+conditional request and survive restarts.
+"""
+
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from decoders import get_decoder, json
+
+DEFAULT_TTL = 60 * 5
+LOG = logging.getLogger(__name__)
+
+# endpoints are matched on the longest prefix of the API path
+ENDPOINTS = ('mass/base/char', 'mass/base/teams', 'base/char', 'base/teams',
+             'char/teams', 'search', 'psearch', 'clist')
+
+
+def normalize_path(path):
+    """Returns the cache key of an API path."""
+    return path.strip('/').lower()
+
+
+def endpoint(path):
+    """
+    Returns the endpoint an API path belongs to, for example 'base/char' for
+    'base/char/eu/Name!123'.
+    """
+    path = normalize_path(path)
+    for name in ENDPOINTS:
+        if path == name or path.startswith(name + '/'):
+            return name
+    return path.split('/', 1)[0]
+
+
+class CacheEntry(object):
+    """
+    A cached value with its expiry times and the validators of the response
+    it came from.
+    """
+
+    __slots__ = ('value', 'expires', 'stale_until', 'etag', 'last_modified')
+
+    def __init__(self, value, expires, stale_until, etag=None, last_modified=None):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, now=None):
+        """Returns `True` if the entry has not expired yet."""
+        if now is None:
+            now = time.time()
+        return now < self.expires
+
+    def is_usable(self, now=None):
+        """Returns `True` if the entry may still be served, maybe stale."""
+        if now is None:
+            now = time.time()
+        return now < self.stale_until
+
+
+class BaseCache(object):
+    """
+    Functionality shared by the cache backends.
+
+    A backend implements `get(key, include_expired=False)`, returning a
+    `CacheEntry` or `None`,
+    `set(key, value, ttl=None, etag=None, last_modified=None, body=None)`,
+    `touch(key)` to renew an entry after a successful revalidation, and
+    `delete(key)`.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, ttls=None, stale_ttl=0):
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.stale_ttl = stale_ttl
+        self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'evictions': 0,
+                      'revalidated': 0}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, key):
+        return self.ttls.get(endpoint(key), self.ttl)
+
+    def begin_refresh(self, key):
+        """
+        Marks `key` as being refreshed. Returns `False` if a refresh of `key`
+        is already running.
+        """
+        key = normalize_path(key)
+        self._lock.acquire()
+        try:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+        finally:
+            self._lock.release()
+
+    def end_refresh(self, key):
+        self._lock.acquire()
+        try:
+            self._refreshing.discard(normalize_path(key))
+        finally:
+            self._lock.release()
+
+    def _count(self, entry, now):
+        """Counts a lookup which found `entry`. The lock must be held."""
+        if entry is None or not entry.is_usable(now):
+            self.stats['misses'] += 1
+        elif entry.is_fresh(now):
+            self.stats['hits'] += 1
+        else:
+            self.stats['stale'] += 1
+
+
+class ResponseCache(BaseCache):
+    """
+    A TTL and LRU bounded cache of API responses.
+
+    **max_entries:** The maximum number of cached responses.
+
+    **ttl:** The default time-to-live in seconds.
+
+    **ttls:** A dict of per-endpoint time-to-live values, for example
+    `{'clist': 3600, 'search': 60}`.
+
+    **stale_ttl:** How many seconds an expired response may still be served
+    while it is refreshed in the background. **Default:** 0 (never)
+
+    `stats` counts hits, stale hits, misses and evictions.
+    """
+
+    def __init__(self, max_entries=1000, ttl=DEFAULT_TTL, ttls=None, stale_ttl=0):
+        BaseCache.__init__(self, ttl=ttl, ttls=ttls, stale_ttl=stale_ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key, include_expired=False):
+        """
+        Returns the `CacheEntry` for `key`, or `None` on a miss.
+
+        The entry may be stale, which `entry.is_fresh()` tells. Entries past
+        their stale window are dropped, unless `include_expired` is set, in
+        which case they are returned and kept until they are evicted. The
+        client does that to serve them while its circuit breaker is open.
+        """
+        key = normalize_path(key)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            self._count(entry, now)
+            if entry is None:
+                return None
+            if not entry.is_usable(now) and not include_expired:
+                return None
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            return entry
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None, etag=None, last_modified=None, body=None):
+        """
+        Caches `value` under `key` for `ttl` or the endpoint's TTL. The raw
+        `body` is not needed in memory and ignored.
+        """
+        key = normalize_path(key)
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        expires = time.time() + ttl
+        entry = CacheEntry(value, expires, expires + self.stale_ttl, etag,
+                last_modified)
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        finally:
+            self._lock.release()
+
+    def touch(self, key, ttl=None):
+        """Renews the expiry times of a revalidated entry."""
+        key = normalize_path(key)
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        expires = time.time() + ttl
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires = expires
+                entry.stale_until = expires + self.stale_ttl
+                self.stats['revalidated'] += 1
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._entries.pop(normalize_path(key), None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(BaseCache):
+    """
+    A cache of API responses stored in an SQLite database file.
+
+    Expired responses are kept for `keep` seconds, so they can be revalidated
+    with a conditional request instead of being downloaded again. A background
+    thread deletes responses past that time every `compact_interval` seconds.
+
+    **path:** The database file. It is created if it does not exist.
+
+    **ttl**, **ttls** and **stale_ttl** work like for `ResponseCache`.
+
+    **keep:** How long expired responses are kept. **Default:** one week
+
+    **compact_interval:** Seconds between two compactions, or `None` to
+    compact only when `compact()` is called. **Default:** one hour
+
+    **decoder:** The JSON decoder (see `sc2ranks.decoders`) used to read the
+    stored bodies. **Default:** the default decoder
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, ttls=None, stale_ttl=0,
+                 keep=60 * 60 * 24 * 7, compact_interval=60 * 60, decoder=None):
+        BaseCache.__init__(self, ttl=ttl, ttls=ttls, stale_ttl=stale_ttl)
+        self.path = path
+        self.keep = keep
+        self.decoder = get_decoder(decoder)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, "
+            "expires REAL, stale_until REAL, keep_until REAL)")
+        self._db.commit()
+        self._closed = threading.Event()
+        if compact_interval:
+            thread = threading.Thread(target=self._compact_periodically,
+                    args=(compact_interval,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def get(self, key, include_expired=False):
+        """
+        Returns the `CacheEntry` for `key`, or `None` on a miss.
+
+        Unlike `ResponseCache`, expired entries are always returned as long
+        as they are kept, so they can be revalidated. `entry.is_usable()` tells if
+        such an entry may still be served.
+        """
+        key = _db_key(key)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, expires, stale_until "
+                "FROM responses WHERE key = ? AND keep_until > ?",
+                (key, now)).fetchone()
+            entry = None
+            if row is not None:
+                body, etag, last_modified, expires, stale_until = row
+                if isinstance(body, buffer):
+                    body = str(body)
+                try:
+                    value = self.decoder.loads(body)
+                except ValueError:
+                    LOG.warning("Dropping unreadable cache entry %r", key)
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                else:
+                    entry = CacheEntry(value, expires, stale_until, etag,
+                            last_modified)
+            self._count(entry, now)
+            return entry
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None, etag=None, last_modified=None, body=None):
+        """
+        Stores `value` under `key`. If the raw JSON `body` the value was
+        decoded from is given, it is stored as is.
+        """
+        key = _db_key(key)
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        if body is None:
+            body = json.dumps(value)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        expires = time.time() + ttl
+        stale_until = expires + self.stale_ttl
+        self._lock.acquire()
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(body), _text(etag), _text(last_modified),
+                 expires, stale_until,
+                 max(stale_until, expires + self.keep)))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def touch(self, key, ttl=None):
+        """Renews the expiry times of a revalidated entry."""
+        key = _db_key(key)
+        if ttl is None:
+            ttl = self.ttl_for(key)
+        expires = time.time() + ttl
+        stale_until = expires + self.stale_ttl
+        self._lock.acquire()
+        try:
+            self._db.execute(
+                "UPDATE responses SET expires = ?, stale_until = ?, "
+                "keep_until = ? WHERE key = ?",
+                (expires, stale_until, max(stale_until, expires + self.keep), key))
+            self._db.commit()
+            self.stats['revalidated'] += 1
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._db.execute("DELETE FROM responses WHERE key = ?",
+                    (_db_key(key),))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def compact(self):
+        """Deletes the responses which are no longer kept."""
+        self._lock.acquire()
+        try:
+            deleted = self._db.execute("DELETE FROM responses WHERE keep_until <= ?",
+                    (time.time(),)).rowcount
+            self._db.commit()
+            if deleted:
+                self.stats['evictions'] += deleted
+                self._db.execute("VACUUM")
+        finally:
+            self._lock.release()
+        return deleted
+
+    def close(self):
+        """Stops the background compaction and closes the database."""
+        self._closed.set()
+        self._lock.acquire()
+        try:
+            self._db.close()
+        finally:
+            self._lock.release()
+
+    def _compact_periodically(self, interval):
+        while True:
+            self._closed.wait(interval)
+            if self._closed.isSet():
+                return
+            try:
+                self.compact()
+            except sqlite3.Error:
+                LOG.exception("Compacting the cache in %r failed", self.path)
+
+
+def _text(value):
+    """sqlite3 refuses byte strings which are not ASCII."""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _db_key(key):
+    return _text(normalize_path(key))
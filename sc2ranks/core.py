@@ -12,40 +12,496 @@ free to contact the authors of this module with a detailed description of the
 error.
 """
 
-import sys
+import time
+import Queue
 import urllib
 import logging
-
-# we assume simplejson is installed for pre Python2.6 platforms (as defined in
-# setup.py)
-if sys.hexversion < 0x02060000:
-    import simplejson as json
-else:
-    import json
+import threading
+from collections import deque
+from itertools import islice
+
+from transport import ConnectionPool, DEFAULT_POOL_SIZE
+from workers import WorkerPool, SingleFlight, TimeoutError
+from cache import normalize_path, endpoint, ResponseCache
+from metrics import Metrics, REQUEST, DECODE, WRAP, ERROR, CACHE, HEDGE
+from streaming import JSONStream
+from decoders import get_decoder
+from deadlines import Deadline, DeadlineScope
+from limits import is_throttled
 
 MAX_CHARS = 98
+# characters per page of a search
+SEARCH_PAGE_SIZE = 10
+# latencies an endpoint needs before its p95 is trusted for hedging
+HEDGE_MIN_SAMPLES = 20
 LOG = logging.getLogger(__name__)
+_POOL = ConnectionPool()
 
 class Sc2Ranks(object):
     """
     The API proxy
     """
 
-    def __init__(self, app_key):
+    def __init__(self, app_key, pool_size=DEFAULT_POOL_SIZE, mass_workers=1, cache=None,
+                 decoder=None, object_hook=None, metrics=None, transport=None,
+                 limiter=None, timeout=None, hedge=False, negative_ttl=None,
+                 breaker=None, names=None):
         """
         Creates a new proxy to the API using the given API key.
 
         For more information on the key, please visit
         http://www.sc2ranks.com/api
+
+        **pool_size:** The number of idle keep-alive connections kept open to
+        sc2ranks.com. The connection pool is available as `pool`, its
+        `stats` tell how often connections were reused.
+
+        **transport:** The transport all requests are sent through, for
+        example a `sc2ranks.transport.MemoryTransport` or
+        `RecordReplayTransport` to use the client without network access. See
+        `sc2ranks.transport` for the interface. **Default:** a
+        `ConnectionPool` of `pool_size` connections
+
+        **mass_workers:** The number of batches the mass methods fetch in
+        parallel. With more than one worker, up to twice as many batches are
+        requested ahead of the one currently being consumed. Results are
+        always yielded in input order. **Default:** 1 (sequential)
+
+        **cache:** A `sc2ranks.cache.ResponseCache` or `DiskCache` to answer
+        repeated API calls from. The mass methods cache each character
+        separately and only request the characters which are not cached.
+        **Default:** None (no caching)
+
+        Concurrent identical requests, for example from several threads asking
+        for the same character, are sent only once and share the response.
+        `flights.stats['coalesced']` counts the requests saved that way.
+
+        **decoder:** The name of a registered JSON decoder (see
+        `sc2ranks.decoders`) or a `Decoder`. **Default:** the fastest one
+        available
+
+        **object_hook:** Called with every JSON object while a response is
+        decoded, its result replaces the object. Passing `Sc2RanksResponse`
+        builds the response objects during decoding instead of afterwards in
+        `validate`. Note that this wraps all objects, including the plain
+        dicts in search results. The mass methods do not use the hook.
+        **Default:** None
+
+        **metrics:** The `sc2ranks.metrics.Metrics` to record latencies,
+        sizes, decode and wrap times, errors and cache lookups per endpoint
+        in. **Default:** a new instance, available as `metrics`
+
+        **limiter:** A `sc2ranks.limits.RateLimiter` all requests of the
+        client go through. It limits the request rate and the requests in
+        flight, and retries throttled and 5xx responses with backoff.
+        **Default:** None (no limits, no retries)
+
+        **timeout:** The seconds each request may take, including its
+        retries. The connect and read timeouts of the transport are derived
+        from the time left. Use `deadline()` to give a block of calls a budget
+        of their own. **Default:** None (no timeout)
+
+        **hedge:** Send a second request for a GET request which takes longer
+        than usual, and use whichever response arrives first. With `True`, a
+        request is hedged once it takes longer than the p95 latency of its
+        endpoint (known after `HEDGE_MIN_SAMPLES` requests), a number is the
+        delay in seconds. A request is only hedged if the `limiter` and the
+        `breaker` let a second one through right away. `hedges` counts the
+        hedged requests and how often the second one won. **Default:** False
+
+        **negative_ttl:** Seconds to remember error responses of the API, like
+        a character which does not exist, per path. Asking for the same path
+        again within that time returns the error without a request. Throttled
+        requests are not remembered. **Default:** None (not remembered)
+
+        **breaker:** A `sc2ranks.breaker.CircuitBreaker`. While it is open,
+        requests fail right away instead of waiting for the API, and expired
+        cached responses are served instead. For that, the cache keeps
+        expired responses until they are evicted. **Default:** None
+
+        **names:** A `sc2ranks.names.NameIndex` fed with the characters of
+        all responses. `search_for_character` answers from it and only asks
+        the API if it knows no matching name. **Default:** None
         """
-        LOG.debug("Initialised SC2Ranks with API key '%s'" % app_key)
+        LOG.debug("Initialised SC2Ranks with API key '%s'", app_key)
         self.app_key = app_key
+        if transport is None:
+            transport = ConnectionPool(maxsize=pool_size)
+        self.transport = transport
+        self.mass_workers = mass_workers
+        self._mass_pool = None
+        self._search_pool = None
+        self._pools_lock = threading.Lock()
+        self.cache = cache
+        self.flights = SingleFlight()
+        self.decoder = get_decoder(decoder)
+        self.object_hook = object_hook
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.limiter = limiter
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedges = {'sent': 0, 'won': 0}
+        self._hedges_lock = threading.Lock()
+        self._local = threading.local()
+        self.negative_cache = None
+        if negative_ttl:
+            self.negative_cache = ResponseCache(ttl=negative_ttl)
+        self.breaker = breaker
+        self.names = names
+
+    def _get_transport(self):
+        return self.transport
+
+    def _set_transport(self, transport):
+        self.transport = transport
+
+    pool = property(_get_transport, _set_transport,
+            doc="The transport of the client, by default its connection pool.")
 
     def api_fetch(self, path, params=''):
-        """Fetch some JSON from the API."""
-        url = "http://sc2ranks.com/api/%s.json?appKey=%s" % (path, self.app_key)
-        LOG.debug("Fetching %s" % url)
-        return fetch_json(url, params)
+        """
+        Fetch some JSON from the API.
+
+        If the client has a cache, requests without `params` are answered from
+        it. A stale cached response is returned as is while a background
+        thread fetches a fresh one. Expired responses are revalidated with a
+        conditional request if the API sent an `ETag` or `Last-Modified`
+        header for them.
+        """
+        if params:
+            return self._api_fetch(path, params)
+        if self.negative_cache is not None:
+            entry = self.negative_cache.get(path)
+            if entry is not None:
+                return entry.value
+        if self.cache is None:
+            return self._join_flight(path, self._api_fetch, path)
+
+        # with a breaker, expired responses are kept to serve while it is open
+        entry = self.cache.get(path, include_expired=self.breaker is not None)
+        self.metrics.record(endpoint(path), CACHE,
+                hit=entry is not None and entry.is_usable())
+        if entry is not None:
+            if entry.is_fresh():
+                return entry.value
+            if entry.is_usable():
+                if self.cache.begin_refresh(path):
+                    thread = threading.Thread(target=self._refresh,
+                            args=(path, entry))
+                    thread.setDaemon(True)
+                    thread.start()
+                return entry.value
+        return self._join_flight(path, self._revalidate, path, entry)
+
+    def _join_flight(self, path, fn, *args):
+        """
+        Returns `fn(*args)`, shared with the concurrent calls for `path`. A
+        call already running for it is waited for until the deadline of this
+        call only, after which `None` is returned.
+        """
+        try:
+            return self.flights.do(normalize_path(path), fn, *args,
+                    deadline=self._call_deadline())
+        except TimeoutError:
+            LOG.warning("Deadline passed waiting for a running request of %s",
+                    path)
+            self.metrics.record(endpoint(path), ERROR, reason='deadline')
+            return None
+
+    def _api_fetch(self, path, params=''):
+        LOG.debug("Fetching %s", path)
+        status, headers, body, data = self._request(path, self._api_url(path),
+                params, object_hook=self.object_hook)
+        if not params:
+            self._remember_error(path, status, data)
+        return data
+
+    def _remember_error(self, path, status, data):
+        """Keeps an error response in the negative cache."""
+        if (self.negative_cache is not None and is_error(data)
+                and not is_throttled(status, data)):
+            self.negative_cache.set(path, data)
+
+    def _api_url(self, path):
+        return "http://sc2ranks.com/api/%s.json?appKey=%s" % (path, self.app_key)
+
+    def _revalidate(self, path, entry=None):
+        """
+        Fetches `path` into the cache. If there is an expired `entry` for it,
+        the request is conditional and a `304 Not Modified` renews the entry.
+        """
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        LOG.debug("Fetching %s, conditional headers: %r", path, headers)
+        status, response_headers, body, data = self._request(path,
+                self._api_url(path), headers=headers,
+                object_hook=self.object_hook)
+        if status == 304 and entry is not None:
+            self.cache.touch(path)
+            return entry.value
+        if data is None and entry is not None and self.breaker is not None:
+            LOG.info("Serving the expired response of %s", path)
+            return entry.value
+        if data is not None and not is_error(data):
+            self.cache.set(path, data,
+                    etag=response_headers.get('etag'),
+                    last_modified=response_headers.get('last-modified'),
+                    body=body)
+        self._remember_error(path, status, data)
+        return data
+
+    def deadline(self, seconds):
+        """
+        Returns a context manager giving the calls of the current thread
+        within it `seconds` in total. Requests are cut short once the time is
+        up, and their calls return `None` like on a connection problem.
+
+            with client.deadline(2.0):
+                character = client.fetch_base_character('eu', 'Name', 123)
+                teams = client.fetch_character_teams('eu', 'Name', 123, '1v1')
+        """
+        return DeadlineScope(self._local, seconds)
+
+    def _current_deadline(self):
+        """The deadline of the `deadline` block the thread is in, if any."""
+        return getattr(self._local, 'deadline', None)
+
+    def _call_deadline(self):
+        """
+        The deadline of a call starting now: the one of the current
+        `deadline` block, or `timeout` from now.
+        """
+        deadline = self._current_deadline()
+        if deadline is None and self.timeout is not None:
+            deadline = Deadline(self.timeout)
+        return deadline
+
+    def _request(self, path, url, params='', headers=None, object_hook=None,
+                 deadline=None):
+        """
+        Sends a request for the API `path` and decodes the response, while
+        recording the metrics of its endpoint.
+
+        Returns a `(status, headers, body, data)` tuple. On a connection
+        problem or timeout, all of them are `None`. `data` is `None` as well
+        if the body could not be decoded or the status is 304 (Not Modified).
+
+        The request has to be done by `deadline`, by default the one of the
+        current `deadline` block or `timeout` from now. With a `limiter`, the
+        request waits for its turn, but not past the deadline, and throttled
+        or failed requests are retried while there is time left.
+        """
+        if deadline is None:
+            deadline = self._call_deadline()
+        attempt = 0
+        while True:
+            result = self._attempt(path, url, params, headers, object_hook,
+                    deadline)
+            if result is None:
+                return None, None, None, None
+            if self.limiter is None:
+                return result[:4]
+            status, response_headers, body, data, latency = result
+            delay = self.limiter.retry_delay(attempt, status, data,
+                    response_headers)
+            if delay is None or (deadline is not None and
+                                 delay >= deadline.remaining()):
+                return status, response_headers, body, data
+            LOG.info("Retrying %s in %.1f seconds (status %s)", path, delay,
+                    status)
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, path, url, params, headers, object_hook, deadline):
+        """
+        Sends a single request for `_request`. Returns the tuple of
+        `_request` followed by the latency in seconds, or `None` without
+        sending anything if the circuit breaker is open or the limiter gives
+        no turn before the deadline.
+
+        The breaker is asked first, so rejected requests take no turn of the
+        limiter and do not count as failures for its concurrency limit.
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            LOG.warning("Circuit open, not fetching %s", path)
+            self.metrics.record(endpoint(path), ERROR, reason='circuit_open')
+            return None
+        if self.limiter is not None and not self.limiter.acquire(deadline):
+            if self.breaker is not None:
+                self.breaker.cancel()
+            LOG.warning("Deadline passed waiting for the limiter, not "
+                    "fetching %s", path)
+            self.metrics.record(endpoint(path), ERROR, reason='deadline')
+            return None
+        result = None
+        try:
+            result = self._send(path, url, params, headers, object_hook,
+                    deadline)
+        finally:
+            status = response_headers = data = latency = None
+            if result is not None:
+                status, response_headers, data, latency = (result[0],
+                        result[1], result[3], result[4])
+            if self.limiter is not None:
+                self.limiter.release(latency, status, data, response_headers)
+            if self.breaker is not None:
+                self.breaker.record(status is not None and status < 500
+                        and (data is not None or status == 304)
+                        and not is_throttled(status, data))
+        return result
+
+    def _send(self, path, url, params, headers, object_hook, deadline):
+        """Sends a single request for `_attempt`."""
+        name = endpoint(path)
+        timeout = None
+        if deadline is not None:
+            if deadline.expired():
+                LOG.warning("Deadline passed, not fetching %s", path)
+                self.metrics.record(name, ERROR, reason='deadline')
+                return None, None, None, None, 0.0
+            timeout = deadline.remaining()
+        start = time.time()
+        delay = None
+        if not params:
+            delay = self._hedge_delay(name)
+        if delay is not None and (timeout is None or delay < timeout):
+            response = self._fetch_hedged(name, url, headers, deadline, delay)
+        else:
+            response = fetch(url, params, self.transport, headers, timeout)
+        latency = time.time() - start
+        if response is None:
+            self.metrics.record(name, ERROR, reason='connection')
+            return None, None, None, None, latency
+        status, response_headers, body = response
+        self.metrics.record(name, REQUEST, latency=latency, bytes=len(body),
+                status=status)
+        if status == 304:
+            return status, response_headers, body, None, latency
+
+        start = time.time()
+        data = decode_json(body, self.decoder, object_hook)
+        self.metrics.record(name, DECODE, seconds=time.time() - start)
+        if data is None:
+            self.metrics.record(name, ERROR, reason='decode')
+        elif is_error(data):
+            self.metrics.record(name, ERROR, reason='api')
+        return status, response_headers, body, data, latency
+
+    def _hedge_delay(self, name):
+        """
+        Returns the seconds after which a GET request to the endpoint `name`
+        is hedged, or `None`.
+        """
+        if self.hedge is False or self.hedge is None:
+            return None
+        if self.hedge is not True:
+            return self.hedge
+        metrics = self.metrics.endpoint(name)
+        if metrics.requests < HEDGE_MIN_SAMPLES:
+            return None
+        return metrics.latency_percentile(95)
+
+    def _fetch_hedged(self, name, url, headers, deadline, delay):
+        """
+        Fetches `url` like `fetch` does. If there is no response after
+        `delay` seconds, a second request is sent and the first successful
+        response of both is returned.
+
+        The second request takes a turn of the limiter and is recorded by
+        the breaker like any other. It is not sent if either would make it
+        wait.
+        """
+        responses = Queue.Queue()
+
+        def attempt(number):
+            timeout = None
+            if deadline is not None:
+                timeout = deadline.remaining()
+            response = None
+            start = time.time()
+            try:
+                response = fetch(url, None, self.transport, headers, timeout)
+            finally:
+                if number == 1:
+                    self._end_hedge(response, time.time() - start)
+                responses.put((number, response))
+
+        def start(number):
+            thread = threading.Thread(target=attempt, args=(number,))
+            thread.setDaemon(True)
+            thread.start()
+
+        start(0)
+        try:
+            return responses.get(timeout=delay)[1]
+        except Queue.Empty:
+            pass
+        if not self._begin_hedge():
+            LOG.debug("No response for %s after %.3f seconds, not hedging "
+                    "without a free turn", url, delay)
+            return responses.get()[1]
+        LOG.debug("No response for %s after %.3f seconds, hedging", url, delay)
+        self._count_hedge('sent')
+        start(1)
+        number, response = responses.get()
+        if response is None:
+            # the other request may still succeed
+            number, response = responses.get()
+        won = response is not None and number == 1
+        if won:
+            self._count_hedge('won')
+        self.metrics.record(name, HEDGE, won=won)
+        return response
+
+    def _begin_hedge(self):
+        """Takes a turn of the breaker and the limiter without waiting."""
+        if self.breaker is not None and not self.breaker.allow():
+            return False
+        if self.limiter is not None and not self.limiter.acquire(blocking=False):
+            if self.breaker is not None:
+                self.breaker.cancel()
+            return False
+        return True
+
+    def _end_hedge(self, response, latency):
+        """Reports the outcome of a hedge to the limiter and the breaker."""
+        status = headers = None
+        if response is not None:
+            status, headers = response[0], response[1]
+        if self.limiter is not None:
+            self.limiter.release(latency, status, None, headers)
+        if self.breaker is not None:
+            self.breaker.record(status is not None and status < 500
+                    and not is_throttled(status, None))
+
+    def _count_hedge(self, name):
+        self._hedges_lock.acquire()
+        try:
+            self.hedges[name] += 1
+        finally:
+            self._hedges_lock.release()
+
+    def _fetch_validated(self, path):
+        """Fetches `path` and returns the validated response."""
+        data = self.api_fetch(path)
+        start = time.time()
+        result = self.validate(data=data)
+        self.metrics.record(endpoint(path), WRAP, seconds=time.time() - start)
+        if self.names is not None and result is not None:
+            self.names.add_data(data)
+        return result
+
+    def _refresh(self, path, entry):
+        try:
+            self.flights.do(normalize_path(path), self._revalidate, path, entry)
+        finally:
+            self.cache.end_refresh(path)
 
     def validate(self, data):
         """
@@ -56,14 +512,17 @@ class Sc2Ranks(object):
         instance and returned. Either as list or signle object according to the
         response type.
         """
-        if type(data).__name__ == 'dict' and 'error' in data:
-            LOG.error("SC2Ranks ERROR: %r" % data)
+        if is_error(data):
+            LOG.error("SC2Ranks ERROR: %r", data)
             return None
         else:
-            if type(data).__name__ == 'dict':
+            if isinstance(data, Sc2RanksResponse):
+                # built while decoding by the object hook
+                return data
+            elif type(data).__name__ == 'dict':
                 return Sc2RanksResponse(data)
             elif type(data).__name__ == 'list':
-                return [Sc2RanksResponse(datum) for datum in data]
+                return [_wrap(datum) for datum in data]
 
     def search_for_character(self, region, name, search_type='exact', offset=0):
         """
@@ -79,11 +538,84 @@ class Sc2Ranks(object):
         **search_type** can be 'exact', 'contains', 'starts', 'ends'.
         Default='exact'
         """
-        return self.validate(
-            data=self.api_fetch('search/%s/%s/%s/%i' % (search_type,
+        if self.names is not None:
+            result = self.names.search(region, name, search_type, offset)
+            if result is not None:
+                return result
+        return self._fetch_search(region, name, search_type, offset)
+
+    def _fetch_search(self, region, name, search_type, offset):
+        """A search page from the API, feeding the name index."""
+        result = self._fetch_validated('search/%s/%s/%s/%i' % (search_type,
                 region.lower(),
                 name,
-                offset)))
+                offset))
+        if self.names is not None and result is not None:
+            self.names.add_search_results(region, result)
+        return result
+
+    def iter_search_for_character(self, region, name, search_type='exact',
+                                  limit=None, prefetch=2):
+        """
+        Yields the characters of all pages of a `search_for_character`
+        search.
+
+        The first page tells the total number of characters. While a page is
+        consumed, the next ones are already fetched in the background, so
+        the whole search takes about as long as its slowest page.
+
+        **limit:** The most characters to yield. **Default:** None (all)
+
+        **prefetch:** Pages fetched ahead of the current one. 0 fetches the
+        pages one after another. **Default:** 2
+
+        The pages always come from the API, as the totals a name index
+        answers with only count the names it knows. Stops at the first page
+        which fails or is empty.
+        """
+        # the pool threads do not see the deadline block of the caller
+        deadline = self._current_deadline()
+
+        def get_page(offset):
+            previous = self._current_deadline()
+            self._local.deadline = deadline
+            try:
+                return self._fetch_search(region, name, search_type, offset)
+            finally:
+                self._local.deadline = previous
+
+        page = get_page(0)
+        if page is None:
+            return
+        total = getattr(page, 'total', 0) or 0
+        if limit is not None:
+            total = min(total, limit)
+        offsets = iter(xrange(SEARCH_PAGE_SIZE, total, SEARCH_PAGE_SIZE))
+        pending = deque()
+        if prefetch > 0:
+            pool = self._worker_pool('_search_pool', prefetch)
+            for offset in islice(offsets, prefetch):
+                pending.append(pool.submit(get_page, offset))
+
+        count = 0
+        while page is not None:
+            characters = getattr(page, 'characters', None)
+            if not characters:
+                return
+            for character in characters:
+                if count >= total:
+                    return
+                yield character
+                count += 1
+            if pending:
+                future = pending.popleft()
+                for offset in islice(offsets, 1):
+                    pending.append(pool.submit(get_page, offset))
+                page = future.result()
+            else:
+                page = None
+                for offset in islice(offsets, 1):
+                    page = get_page(offset)
 
     def search_for_profile(self, region, name, search_type='1t', search_subtype='division', value='Division'):
         """
@@ -107,13 +639,12 @@ class Sc2Ranks(object):
         **Default:** `division`
         """
 
-        return self.validate(
-            data=self.api_fetch('psearch/%s/%s/%s/%s/%s' % (
+        return self._fetch_validated('psearch/%s/%s/%s/%s/%s' % (
                 region.lower(),
                 name,
                 search_type.lower(),
                 search_subtype.lower(),
-                value)))
+                value))
 
     def fetch_base_character(self, region, name, bnet_id):
         """
@@ -127,9 +658,8 @@ class Sc2Ranks(object):
         **bnet_id:** The Battle.NET id
         """
 
-        return self.validate(
-            data=self.api_fetch("base/char/%s/%s!%s" % (region.lower(), name,
-                bnet_id)))
+        return self._fetch_validated("base/char/%s/%s!%s" % (region.lower(),
+                name, bnet_id))
 
     def fetch_base_character_teams(self, region, name, bnet_id):
         """
@@ -142,9 +672,8 @@ class Sc2Ranks(object):
         **bnet_id:** The Battle.NET id
         """
 
-        return self.validate(
-            data=self.api_fetch("base/teams/%s/%s!%s" % (region.lower(), name,
-                bnet_id)))
+        return self._fetch_validated("base/teams/%s/%s!%s" % (region.lower(),
+                name, bnet_id))
 
     def fetch_character_teams(self, region, name, bnet_id, bracket, is_random=False):
         """
@@ -165,9 +694,8 @@ class Sc2Ranks(object):
         except:
             pass
         is_random = 1 if is_random else 0
-        return self.validate(
-            data=self.api_fetch("char/teams/%s/%s!%s/%s/%s" % (region.lower(),
-                name, bnet_id, bracket, is_random)))
+        return self._fetch_validated("char/teams/%s/%s!%s/%s/%s" % (
+                region.lower(), name, bnet_id, bracket, is_random))
 
     def fetch_mass_base_characters(self, characters):
         """
@@ -175,18 +703,103 @@ class Sc2Ranks(object):
 
         Characters format: ((region1, name1, bnet_id1), (region2, name2, bnet_id2)..)"""
 
-        def get_batch(characters):
-            def single_char_data(num, character):
-                return "characters[%s][region]=%s&characters[%s][name]=%s&characters[%s][bnet_id]=%s" % (num, character[0].lower(), num, character[1], num, character[2])
+        return self._fetch_mass('mass/base/char', characters)
 
-            params = '&'.join(map(lambda c: single_char_data(characters.index(c), c), characters))
-            url = 'http://sc2ranks.com/api/mass/base/char/?appKey=%s' % self.app_key
-            return fetch_json(url, params)
+    def _fetch_mass(self, path, characters, params=()):
+        """
+        Fetches `characters` from a mass endpoint in batches of `MAX_CHARS`
+        and yields one response per character, in input order.
+        """
+        plan = MassRequestPlan(characters)
+        url = 'http://sc2ranks.com/api/%s/?appKey=%s' % (path, self.app_key)
+        # batches fetched by the workers share the deadline of the caller
+        deadline = self._current_deadline()
+        store = None
+        if self.cache is not None:
+            prefix = '/'.join([path] + [str(value) for name, value in params])
+
+            def cache_key(key):
+                return u'%s/%s/%s!%s' % ((prefix,) + key)
+
+            def lookup(key):
+                entry = self.cache.get(cache_key(key))
+                hit = entry is not None and entry.is_fresh()
+                self.metrics.record(path, CACHE, hit=hit)
+                if hit:
+                    return entry.value
+
+            def store(key, data):
+                self.cache.set(cache_key(key), data)
+
+            plan.use_cached(lookup)
+
+        def get_batch(batch):
+            return self._request(path, url, plan.encode(batch, params),
+                    deadline=deadline)[3]
+
+        results = self._map_batches(get_batch, plan.batches())
+        for response in plan.responses(results, Sc2RanksResponse, store):
+            if self.names is not None:
+                self.names.add_data(response)
+            yield response
+
+    def _map_batches(self, get_batch, batches):
+        """
+        Yields `get_batch(batch)` for every batch, in order.
 
-        for i in range(0, (len(characters) / MAX_CHARS) + 1):
-            result = get_batch(characters[i * MAX_CHARS:(i + 1) * MAX_CHARS])
-            for r in result:
-                yield Sc2RanksResponse(r)
+        With more than one mass worker, the batches are fetched on a thread
+        pool while keeping at most `2 * mass_workers` batches in flight.
+        """
+        if self.mass_workers <= 1:
+            for batch in batches:
+                yield get_batch(batch)
+            return
+
+        pool = self._worker_pool('_mass_pool', self.mass_workers)
+        batches = iter(batches)
+        pending = deque()
+        for batch in islice(batches, 2 * self.mass_workers):
+            pending.append(pool.submit(get_batch, batch))
+        while pending:
+            future = pending.popleft()
+            for batch in islice(batches, 1):
+                pending.append(pool.submit(get_batch, batch))
+            yield future.result()
+
+    def _worker_pool(self, name, workers):
+        """
+        Returns the `WorkerPool` kept in the attribute `name`, created on
+        first use and grown to at least `workers` threads.
+        """
+        self._pools_lock.acquire()
+        try:
+            pool = getattr(self, name)
+            if pool is None:
+                pool = WorkerPool(workers=workers)
+                setattr(self, name, pool)
+            elif pool.workers < workers:
+                # the threads are started on the next submit
+                pool.workers = workers
+            return pool
+        finally:
+            self._pools_lock.release()
+
+    def close(self):
+        """
+        Stops the worker threads of the mass and search methods and closes
+        the idle connections of the transport. The client may still be used
+        afterwards, it starts new threads and connections as needed.
+        """
+        self._pools_lock.acquire()
+        try:
+            pools = [self._mass_pool, self._search_pool]
+            self._mass_pool = self._search_pool = None
+        finally:
+            self._pools_lock.release()
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown()
+        self.transport.close()
 
     def fetch_custom_division_characters(self, division_id, region='all', league='all', bracket=1, is_random=False):
         """
@@ -209,10 +822,99 @@ class Sc2Ranks(object):
 
         is_random = int(is_random)
 
-        result = self.validate(
-            data=self.api_fetch("clist/%d/%s/%s/%d/%d" % (division_id, region.lower(), league, bracket, is_random)))
+        result = self._fetch_validated("clist/%d/%s/%s/%d/%d" % (division_id,
+                region.lower(), league, bracket, is_random))
         return result
 
+    def iter_custom_division_characters(self, division_id, region='all', league='all', bracket=1, is_random=False):
+        """
+        The streaming variant of `fetch_custom_division_characters`.
+
+        Teams are yielded one by one while the response is still being
+        downloaded, so memory use does not grow with the size of the
+        division. The response is not cached. On an error nothing is yielded.
+        """
+        is_random = int(is_random)
+        path = "clist/%d/%s/%s/%d/%d" % (division_id, region.lower(), league, bracket, is_random)
+        for team in self.api_stream(path):
+            if self.names is not None:
+                self.names.add_data(team)
+            yield _wrap(team)
+
+    def api_stream(self, path, params=''):
+        """
+        Fetch a JSON array from the API and yield its elements as soon as
+        they have been received.
+
+        Connection and JSON errors are logged and end the iteration, just
+        like an error response from the API does.
+        """
+        LOG.debug("Streaming %s", path)
+        name = endpoint(path)
+        if self.breaker is not None and not self.breaker.allow():
+            LOG.warning("Circuit open, not streaming %s", path)
+            self.metrics.record(name, ERROR, reason='circuit_open')
+            return
+        deadline = self._current_deadline()
+        if deadline is None and self.timeout is not None:
+            deadline = Deadline(self.timeout)
+        if (deadline is not None and deadline.expired()) or (
+                self.limiter is not None and not self.limiter.acquire(deadline)):
+            LOG.warning("Deadline passed, not streaming %s", path)
+            self.metrics.record(name, ERROR, reason='deadline')
+            if self.breaker is not None:
+                self.breaker.record(False)
+            return
+        start = time.time()
+        try:
+            if deadline is None:
+                f = self.transport.urlopen(self._api_url(path), params)
+            else:
+                f = self.transport.urlopen(self._api_url(path), params,
+                        timeout=deadline.remaining())
+        except IOError:
+            LOG.exception("Unable to connect to remote host!")
+            self.metrics.record(name, ERROR, reason='connection')
+            if self.limiter is not None:
+                self.limiter.release()
+            if self.breaker is not None:
+                self.breaker.record(False)
+            return
+        failed = False
+        try:
+            try:
+                stream = JSONStream(f, object_hook=self.object_hook)
+                if stream.is_array:
+                    for item in stream:
+                        yield item
+                else:
+                    data = stream.document()
+                    if is_error(data):
+                        LOG.error("SC2Ranks ERROR: %r", data)
+                        self.metrics.record(name, ERROR, reason='api')
+                    else:
+                        yield data
+            except IOError:
+                LOG.exception("Connection lost while streaming %s", path)
+                self.metrics.record(name, ERROR, reason='connection')
+                failed = True
+            except ValueError:
+                LOG.exception("Unable to parse the streamed response of %s", path)
+                self.metrics.record(name, ERROR, reason='decode')
+                failed = True
+        finally:
+            f.close()
+            # the time includes decoding, which overlaps with the download
+            latency = time.time() - start
+            status = getattr(f, 'status', None)
+            self.metrics.record(name, REQUEST, latency=latency,
+                    bytes=getattr(f, 'bytes_read', 0), status=status)
+            if self.limiter is not None:
+                self.limiter.release(latency, status)
+            if self.breaker is not None:
+                self.breaker.record(not failed and status is not None
+                        and status < 500)
+
     def fetch_mass_characters_team(self, characters, bracket='1v1', is_random=False):
         """
         This is the same as `fetch_character_teams` except it fetches the data
@@ -224,19 +926,92 @@ class Sc2Ranks(object):
         bracket = int(bracket[0])
         is_random = 1 if is_random else 0
 
-        def get_batch(characters):
-            def single_char_data(num, character):
-                return "characters[%s][region]=%s&characters[%s][name]=%s&characters[%s][bnet_id]=%s" % (num, character[0].lower(), num, character[1], num, character[2])
+        return self._fetch_mass('mass/base/teams', characters,
+                (('team[bracket]', bracket), ('team[is_random]', is_random)))
+
+
+class AsyncSc2Ranks(object):
+    """
+    Non-blocking variant of `Sc2Ranks`.
+
+    Every API method of `Sc2Ranks` is available with the same arguments, but
+    returns a `Future` right away. The call itself runs on a shared pool of
+    `concurrency` worker threads, which caps the number of requests in flight.
+    `future.result()` returns the same `Sc2RanksResponse` objects `Sc2Ranks`
+    returns. The mass methods resolve to a list instead of a generator.
+
+    All workers share the connection pool of the underlying `Sc2Ranks`
+    instance, available as `client`.
+    """
+
+    def __init__(self, app_key, concurrency=8, pool_size=None, client=None):
+        """
+        **concurrency:** The maximum number of concurrent API calls.
+
+        **pool_size:** The number of idle connections kept open.
+        **Default:** `concurrency`
+
+        **client:** An existing `Sc2Ranks` instance to run the calls on. It
+        stays open on `close`.
+        """
+        # only a client created here is closed with this instance
+        self._owns_client = client is None
+        if client is None:
+            if pool_size is None:
+                pool_size = concurrency
+            client = Sc2Ranks(app_key, pool_size=pool_size)
+        self.client = client
+        self.workers = WorkerPool(workers=concurrency)
+
+    def _submit(self, method, *args, **kwargs):
+        return self.workers.submit(getattr(self.client, method), *args, **kwargs)
+
+    def _submit_list(self, method, *args, **kwargs):
+        def call():
+            return list(getattr(self.client, method)(*args, **kwargs))
+        return self.workers.submit(call)
+
+    def api_fetch(self, path, params=''):
+        return self._submit('api_fetch', path, params)
+
+    def search_for_character(self, region, name, search_type='exact', offset=0):
+        return self._submit('search_for_character', region, name,
+                search_type, offset)
+
+    def search_for_profile(self, region, name, search_type='1t', search_subtype='division', value='Division'):
+        return self._submit('search_for_profile', region, name, search_type,
+                search_subtype, value)
+
+    def fetch_base_character(self, region, name, bnet_id):
+        return self._submit('fetch_base_character', region, name, bnet_id)
+
+    def fetch_base_character_teams(self, region, name, bnet_id):
+        return self._submit('fetch_base_character_teams', region, name,
+                bnet_id)
+
+    def fetch_character_teams(self, region, name, bnet_id, bracket, is_random=False):
+        return self._submit('fetch_character_teams', region, name, bnet_id,
+                bracket, is_random)
+
+    def fetch_mass_base_characters(self, characters):
+        return self._submit_list('fetch_mass_base_characters', characters)
+
+    def fetch_custom_division_characters(self, division_id, region='all', league='all', bracket=1, is_random=False):
+        return self._submit('fetch_custom_division_characters', division_id,
+                region, league, bracket, is_random)
 
-            char_data = '&'.join(map(lambda c: single_char_data(characters.index(c), c), characters))
-            params = 'team[bracket]=%s&team[is_random]=%s&%s' % (bracket, is_random, char_data)
-            url = 'http://sc2ranks.com/api/mass/base/teams/?appKey=%s' % self.app_key
-            return fetch_json(url, params)
+    def fetch_mass_characters_team(self, characters, bracket='1v1', is_random=False):
+        return self._submit_list('fetch_mass_characters_team', characters,
+                bracket, is_random)
 
-        for i in range(0, (len(characters) / MAX_CHARS) + 1):
-            result = get_batch(characters[i * MAX_CHARS:(i + 1) * MAX_CHARS])
-            for r in result:
-                yield Sc2RanksResponse(r)
+    def close(self):
+        """
+        Stops the worker threads, and closes the client if it was created by
+        this instance.
+        """
+        self.workers.shutdown()
+        if self._owns_client:
+            self.client.close()
 
 
 def character_url(region, name, bnet_id=None, code=None):
@@ -252,60 +1027,304 @@ def character_url(region, name, bnet_id=None, code=None):
         raise ParameterException("Either bnet_id or code must be supplied")
 
 
-def fetch_json(url, params=None):
+def fetch_json(url, params=None, pool=None, decoder=None, object_hook=None):
     """
     Tries to load a JSON object from an URL. If there is a connection problem,
     of JSON error, this method wil return None and the errors are logged.
+
+    The request is sent through the given transport (see
+    `sc2ranks.transport`), or through a module-wide `ConnectionPool` if none
+    is given. See `decode_json` for `decoder` and
+    `object_hook`.
+    """
+    response = fetch(url, params, pool)
+    if response is None:
+        return None
+    return decode_json(response[2], decoder, object_hook)
+
+
+def fetch(url, params=None, pool=None, headers=None, timeout=None):
+    """
+    Sends a request and returns a `(status, headers, body)` tuple, where the
+    header names are lowercase. If there is a connection problem or the
+    request takes longer than `timeout` seconds, the error is logged and
+    `None` is returned.
     """
-    LOG.debug("Fetching JSON data from '%s'. Params: %r" % (
-        url, params))
+    LOG.debug("Fetching JSON data from '%s'. Params: %r", url, params)
+    if pool is None:
+        pool = _POOL
     try:
-        f = urllib.urlopen(url, params)
+        if timeout is None:
+            f = pool.urlopen(url, params, headers)
+        else:
+            f = pool.urlopen(url, params, headers, timeout=timeout)
+        response_data = f.read()
+        f.close()
     except IOError, exc:
         LOG.exception("Unable to connect to remote host!")
         return None
-    response_data = f.read()
-    f.close()
+    return f.status, f.headers, response_data
+
+
+def decode_json(response_data, decoder=None, object_hook=None):
+    """
+    Decodes a JSON response body. If it is not valid JSON, the error is
+    logged and `None` is returned.
+
+    **decoder:** The name of a registered decoder or a `Decoder` instance.
+    **Default:** the default decoder of `sc2ranks.decoders`
+
+    **object_hook:** Called with each decoded JSON object, its result
+    replaces the object.
+    """
     try:
-        data = json.loads(response_data)
-        LOG.debug("Response %r" % data)
+        data = get_decoder(decoder).loads(response_data, object_hook)
+        LOG.debug("Response %r", data)
         return data
     except Exception, exc:
-        LOG.exception("Unable to parse respose as JSON. Response was: %r" %
+        LOG.exception("Unable to parse respose as JSON. Response was: %r",
                 response_data)
         return None
 
 
+def is_error(data):
+    """Returns `True` if `data` is an error response of the API."""
+    if isinstance(data, dict):
+        return 'error' in data
+    if isinstance(data, Sc2RanksResponse):
+        return hasattr(data, 'error')
+    return False
+
+
+def character_key(character):
+    """
+    Returns the normalized `(region, name, bnet_id)` key of a character tuple
+    or of a character returned by the API, as a dict or an `Sc2RanksResponse`.
+    Region and name are compared case-insensitively. Raises `TypeError` or
+    `ValueError` if the bnet id is missing or not a number.
+    """
+    if isinstance(character, Sc2RanksResponse):
+        character = object.__getattribute__(character, '_data')
+    if isinstance(character, dict):
+        character = (character.get('region'), character.get('name'),
+                character.get('bnet_id'))
+    region, name, bnet_id = character
+    return (_text(region).lower(), _text(name).lower(), int(bnet_id))
+
+
+class MassRequestPlan(object):
+    """
+    Splits the characters of a mass request into batches and maps the results
+    back to the requested characters.
+
+    Characters are deduplicated on their normalized key, so each character is
+    requested only once. The responses still come out once per requested
+    character, duplicates included.
+    """
+
+    def __init__(self, characters):
+        self.keys = []
+        self.unique = []
+        self.cached = {}
+        self._positions = {}
+        self._remaining = {}
+        for character in characters:
+            key = character_key(character)
+            self.keys.append(key)
+            if key not in self._positions:
+                self._positions[key] = len(self.unique)
+                self._remaining[key] = 0
+                self.unique.append(character)
+            self._remaining[key] += 1
+
+    def use_cached(self, lookup):
+        """
+        Takes the characters for which `lookup(key)` returns data out of the
+        request. Their responses are built from that data instead.
+        """
+        unique = []
+        self._positions = {}
+        for character in self.unique:
+            key = character_key(character)
+            data = lookup(key)
+            if data is None:
+                self._positions[key] = len(unique)
+                unique.append(character)
+            else:
+                self.cached[key] = data
+        self.unique = unique
+
+    def batches(self):
+        """Returns the unique characters in batches of at most `MAX_CHARS`."""
+        return [self.unique[i:i + MAX_CHARS]
+                for i in range(0, len(self.unique), MAX_CHARS)]
+
+    def encode(self, batch, params=()):
+        """
+        Returns the URL encoded form body for a batch, preceded by the
+        (name, value) pairs in `params`.
+        """
+        pairs = list(params)
+        for num, (region, name, bnet_id) in enumerate(batch):
+            pairs.append(('characters[%d][region]' % num, region.lower()))
+            pairs.append(('characters[%d][name]' % num, name))
+            pairs.append(('characters[%d][bnet_id]' % num, bnet_id))
+        return urllib.urlencode([(key, _utf8(value)) for key, value in pairs])
+
+    def responses(self, results, wrap, store=None):
+        """
+        Yields `wrap(data)` for each requested character, in input order.
+
+        `results` are the decoded responses of the batches, in the order of
+        `batches()`. Characters the API returned nothing for are skipped.
+        If given, `store(key, data)` is called for every returned character.
+        """
+        results = iter(results)
+        fetched = 0
+        found = {}
+        for key in self.keys:
+            if key in self.cached:
+                found[key] = wrap(self.cached.pop(key))
+            while key in self._positions and fetched <= self._positions[key]:
+                batch = self.unique[fetched:fetched + MAX_CHARS]
+                fetched += len(batch)
+                for k, data in self._match(batch, results.next()).iteritems():
+                    if store is not None:
+                        store(k, data)
+                    found[k] = wrap(data)
+            response = found.get(key)
+            self._remaining[key] -= 1
+            if not self._remaining[key]:
+                found.pop(key, None)
+            if response is not None:
+                yield response
+
+    def _match(self, batch, result):
+        if result is None:
+            return {}
+        if isinstance(result, dict):
+            LOG.error("SC2Ranks ERROR: %r", result)
+            return {}
+        requested = set(character_key(c) for c in batch)
+        matched = {}
+        for data in result:
+            try:
+                key = character_key(data)
+            except (TypeError, ValueError):
+                key = None
+            if key in requested:
+                matched[key] = data
+            else:
+                LOG.warning("Unexpected character in mass response: %r", data)
+        return matched
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
 class ParameterException(Exception):
     pass
 
 
 class Sc2RanksResponse(object):
-    """JSON-Response containing the queried information from sc2ranks.com."""
-
-    def __init__(self, d={}):
-        LOG.debug("Constructing an Sc2RanksResponse instance from %r" % d)
-        if 'portrait' in d:
-            d['portrait'] = Sc2RanksResponse(d['portrait'])
+    """
+    JSON-Response containing the queried information from sc2ranks.com.
 
-        if 'teams' in d:
-            d['teams'] = [Sc2RanksResponse(team) for team in d['teams'] if team]
+    The decoded JSON object is kept as is and read on attribute access.
+    Nested objects (`portrait`, `teams` and `members`) are wrapped in
+    `Sc2RanksResponse` instances on first access only. Assigned attributes
+    are kept apart, so the JSON object, which may be cached, is never changed.
+    """
 
-        if 'members' in d:
-            d['members'] = [Sc2RanksResponse(member) for member in d['members'] if member]
+    __slots__ = ('_data', '_attrs')
 
-        self.__dict__.update(d)
+    def __init__(self, d={}):
+        LOG.debug("Constructing an Sc2RanksResponse instance from %r", d)
+        object.__setattr__(self, '_data', d)
+        object.__setattr__(self, '_attrs', None)
+
+    def __getattr__(self, name):
+        if name in Sc2RanksResponse.__slots__:
+            # not initialised yet, e.g. while unpickling
+            raise AttributeError(name)
+        attrs = self._attrs
+        if attrs is not None and name in attrs:
+            return attrs[name]
+        try:
+            value = self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+        if name in NESTED_KEYS:
+            value = _wrap_nested(value)
+            self.__setattr__(name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        if self._attrs is None:
+            object.__setattr__(self, '_attrs', {})
+        self._attrs[name] = value
+
+    def __delattr__(self, name):
+        raise AttributeError("Sc2RanksResponse attributes cannot be deleted")
+
+    def __getstate__(self):
+        return self._data, self._attrs
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_data', state[0])
+        object.__setattr__(self, '_attrs', state[1])
+
+    def _keys(self):
+        keys = list(self._data)
+        if self._attrs:
+            keys.extend(key for key in self._attrs if key not in self._data)
+        return keys
+
+    @property
+    def __dict__(self):
+        """The attributes as a dict, with the nested objects wrapped."""
+        return dict((key, getattr(self, key)) for key in self._keys())
 
     def __repr__(self):
         return "<Sc2RanksResponse(%s)>" % ', '.join(map(lambda t: "%s=%s" % t, self.__dict__.iteritems()))
 
 
     def __eq__(self, other):
-        for key, value in self.__dict__.iteritems():
-            if getattr(other, key, None) != value:
+        for key in self._keys():
+            if getattr(other, key, None) != getattr(self, key):
                 return False
         return True
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+# keys of the objects which are wrapped in an Sc2RanksResponse as well
+NESTED_KEYS = frozenset(['portrait', 'teams', 'members'])
+
+
+def _wrap(value):
+    if isinstance(value, Sc2RanksResponse):
+        return value
+    return Sc2RanksResponse(value)
+
+
+def _wrap_nested(value):
+    if isinstance(value, dict):
+        return Sc2RanksResponse(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value if item]
+    return value
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Time budgets of API calls.
+
+A `Deadline` is the point in time by which a call has to be done. The client
+derives the timeouts of its requests from the time remaining, so a stalled
+connection cannot hold a call for longer than its budget.
+"""
+
+import time
+
+
+class Deadline(object):
+    """A deadline `seconds` from now."""
+
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        """Returns the seconds left, zero once the deadline has passed."""
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        return time.time() >= self.expires
+
+    def __repr__(self):
+        return "<Deadline(%.3fs left)>" % self.remaining()
+
+
+class DeadlineScope(object):
+    """
+    Sets a deadline for the calls of a client in the current thread while
+    used as a context manager. Within another scope, the earlier of both
+    deadlines applies.
+    """
+
+    def __init__(self, local, seconds):
+        self._local = local
+        self._seconds = seconds
+        self._previous = None
+
+    def __enter__(self):
+        deadline = Deadline(self._seconds)
+        self._previous = getattr(self._local, 'deadline', None)
+        if self._previous is not None and self._previous.expires < deadline.expires:
+            deadline = self._previous
+        self._local.deadline = deadline
+        return deadline
+
+    def __exit__(self, *exc_info):
+        self._local.deadline = self._previous
+        return False
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable JSON decoders.
+
+Decoding API responses is the biggest CPU cost of the client, so the decoder
+can be chosen. Decoders for orjson, ujson, simplejson and the standard
+library json module are registered if the module can be imported; the first
+available one in `PREFERENCE` is used by default. Other decoders can be added
+with `register_decoder`.
+
+All decoders take the raw response body as is, there is no intermediate
+unicode copy of it.
+"""
+
+import sys
+import logging
+
+# the json module of the package, the other modules import it from here. We
+# assume simplejson is installed for pre Python2.6 platforms (as defined in
+# setup.py)
+if sys.hexversion < 0x02060000:
+    import simplejson as json
+else:
+    import json
+
+LOG = logging.getLogger(__name__)
+
+PREFERENCE = ('orjson', 'ujson', 'simplejson', 'json')
+
+_DECODERS = {}
+_default = None
+
+
+class Decoder(object):
+    """
+    A named JSON decoder.
+
+    **loads:** A function decoding a JSON document. If `supports_object_hook`
+    is set, it is called as `loads(data, object_hook=hook)` when a hook is
+    used. Otherwise the hook is applied to the decoded objects afterwards.
+    """
+
+    def __init__(self, name, loads, supports_object_hook=False):
+        self.name = name
+        self._loads = loads
+        self.supports_object_hook = supports_object_hook
+
+    def loads(self, data, object_hook=None):
+        """
+        Decodes `data`. If given, `object_hook` is called with every decoded
+        JSON object, innermost first, and its result replaces that object.
+        """
+        if object_hook is None:
+            return self._loads(data)
+        if self.supports_object_hook:
+            return self._loads(data, object_hook=object_hook)
+        return apply_object_hook(self._loads(data), object_hook)
+
+    def __repr__(self):
+        return "<Decoder(%s)>" % self.name
+
+
+def apply_object_hook(value, object_hook):
+    """Applies `object_hook` to every dict in `value`, innermost first."""
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            if isinstance(item, (dict, list)):
+                value[key] = apply_object_hook(item, object_hook)
+        return object_hook(value)
+    if isinstance(value, list):
+        return [apply_object_hook(item, object_hook) for item in value]
+    return value
+
+
+def register_decoder(name, loads, supports_object_hook=False):
+    """
+    Registers a decoder under `name` and returns it. An existing decoder of
+    the same name is replaced.
+    """
+    decoder = Decoder(name, loads, supports_object_hook)
+    _DECODERS[name] = decoder
+    return decoder
+
+
+def available_decoders():
+    """Returns the names of the registered decoders."""
+    return sorted(_DECODERS)
+
+
+def get_decoder(name=None):
+    """
+    Returns the decoder registered under `name`, or the default decoder if
+    `name` is `None`. A `Decoder` instance is returned as is.
+    """
+    if isinstance(name, Decoder):
+        return name
+    if name is None:
+        return _default
+    try:
+        return _DECODERS[name]
+    except KeyError:
+        raise ValueError("Unknown JSON decoder %r, available: %s" % (
+            name, ', '.join(available_decoders())))
+
+
+def set_default_decoder(name):
+    """Makes the decoder registered under `name` the default one."""
+    global _default
+    _default = get_decoder(name)
+
+
+def _register_builtin():
+    global _default
+    if sys.hexversion >= 0x02060000:
+        register_decoder('json', json.loads, supports_object_hook=True)
+    try:
+        import simplejson
+    except ImportError:
+        pass
+    else:
+        register_decoder('simplejson', simplejson.loads, supports_object_hook=True)
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        register_decoder('ujson', ujson.loads)
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        register_decoder('orjson', orjson.loads)
+
+    for name in PREFERENCE:
+        if name in _DECODERS:
+            _default = _DECODERS[name]
+            break
+    LOG.debug("Using the %s JSON decoder", _default.name)
+
+_register_builtin()
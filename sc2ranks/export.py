@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar export of team data.
+
+`TeamExporter` streams the responses of `fetch_mass_characters_team` and
+`fetch_custom_division_characters` into one typed buffer per column, with
+one row per team member, and turns them into a NumPy structured array, an
+Arrow record batch or a Parquet file:
+
+    exporter = TeamExporter()
+    exporter.add_all(client.fetch_mass_characters_team(characters, '2v2'))
+    table = exporter.to_numpy()
+    table['points'][table['league'] == 'master'].mean()
+
+Numbers missing in a response are masked in NumPy and null in Arrow, so they
+do not distort aggregations. The responses are not kept, so memory grows
+with the rows only. NumPy and pyarrow are optional, they are imported by the
+methods needing them.
+"""
+
+from array import array
+
+from core import Sc2RanksResponse
+
+# (name, array typecode or None for text), in column order. `team` numbers
+# the teams of an export, so rows of the members of a team share it.
+COLUMNS = (
+    ('team', 'l'),
+    ('region', None),
+    ('name', None),
+    ('bnet_id', 'l'),
+    ('league', None),
+    ('bracket', 'b'),
+    ('is_random', 'b'),
+    ('points', 'l'),
+    ('wins', 'l'),
+    ('losses', 'l'),
+    ('division_rank', 'l'),
+)
+
+# numeric columns which may be missing in a response
+NULLABLE = frozenset(['bnet_id', 'bracket', 'points', 'wins', 'losses',
+                      'division_rank'])
+
+
+class TeamExporter(object):
+    """
+    Collects team data column by column.
+
+    Teams with `members`, as in custom divisions, give one row per member.
+    Characters with `teams`, as returned by the mass methods, give one row
+    per team, for the character. Text columns are unicode. For the columns
+    in `NULLABLE`, `valid` holds whether each value was in the response;
+    missing values are stored as 0.
+    """
+
+    def __init__(self):
+        self.teams = 0
+        self.buffers = {}
+        self.valid = {}
+        for name, typecode in COLUMNS:
+            self.buffers[name] = typecode and array(typecode) or []
+            if name in NULLABLE:
+                self.valid[name] = array('b')
+
+    def __len__(self):
+        return len(self.buffers['team'])
+
+    def add(self, response):
+        """Adds the rows of a character or team response."""
+        data = _data(response)
+        if not isinstance(data, dict):
+            return
+        if data.get('members'):
+            for member in data['members']:
+                self._append(data, _data(member))
+            self.teams += 1
+        elif 'teams' in data:
+            for team in data['teams'] or ():
+                self._append(_data(team), data)
+                self.teams += 1
+
+    def add_all(self, responses):
+        """Adds a list or stream of responses. Returns the exporter."""
+        for response in responses:
+            self.add(response)
+        return self
+
+    def columns(self):
+        """
+        Returns the columns as `(name, buffer, valid)` tuples, in order.
+        `valid` is `None` for columns which are never missing.
+        """
+        return [(name, self.buffers[name], self.valid.get(name))
+                for name, typecode in COLUMNS]
+
+    def to_numpy(self):
+        """
+        Returns the rows as a NumPy masked structured array, with missing
+        numbers masked.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("TeamExporter.to_numpy needs numpy")
+        dtype = []
+        for name, buffer, valid in self.columns():
+            if isinstance(buffer, array):
+                dtype.append((name, numpy.dtype(buffer.typecode)))
+            else:
+                width = max([len(value) for value in buffer] or [1])
+                dtype.append((name, 'U%d' % width))
+        table = numpy.zeros(len(self), dtype=dtype)
+        mask = numpy.zeros(len(self), dtype=[(name, bool) for name, _ in dtype])
+        for name, buffer, valid in self.columns():
+            table[name] = buffer
+            if valid is not None:
+                mask[name] = numpy.logical_not(valid)
+        return numpy.ma.array(table, mask=mask)
+
+    def to_arrow(self):
+        """
+        Returns the rows as a `pyarrow.RecordBatch`. Missing numbers are
+        null, the league is dictionary encoded, `is_random` is boolean.
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("TeamExporter.to_arrow needs pyarrow")
+        types = {'l': pyarrow.int64(), 'b': pyarrow.int8()}
+        arrays = []
+        for name, buffer, valid in self.columns():
+            if name == 'is_random':
+                column = pyarrow.array([bool(value) for value in buffer],
+                                       type=pyarrow.bool_())
+            elif valid is not None:
+                column = pyarrow.array([value if ok else None
+                                        for value, ok in zip(buffer, valid)],
+                                       type=types[buffer.typecode])
+            elif isinstance(buffer, array):
+                column = pyarrow.array(buffer, type=types[buffer.typecode])
+            else:
+                column = pyarrow.array(buffer, type=pyarrow.string())
+                if name == 'league':
+                    column = column.dictionary_encode()
+            arrays.append(column)
+        return pyarrow.RecordBatch.from_arrays(arrays,
+                [name for name, typecode in COLUMNS])
+
+    def write_parquet(self, path, **kwargs):
+        """
+        Writes the rows to a Parquet file. Keyword arguments are passed to
+        `pyarrow.parquet.write_table`, e.g. `compression`.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("TeamExporter.write_parquet needs pyarrow")
+        table = pyarrow.Table.from_batches([self.to_arrow()])
+        pyarrow.parquet.write_table(table, path, **kwargs)
+
+    def _append(self, team, member):
+        buffers = self.buffers
+        buffers['team'].append(self.teams)
+        buffers['region'].append(_text(member.get('region')).lower())
+        buffers['name'].append(_text(member.get('name')))
+        self._number('bnet_id', member.get('bnet_id'))
+        buffers['league'].append(_text(team.get('league')).lower())
+        self._number('bracket', team.get('bracket'))
+        buffers['is_random'].append(team.get('is_random') and 1 or 0)
+        for name in ('points', 'wins', 'losses', 'division_rank'):
+            self._number(name, team.get(name))
+
+    def _number(self, name, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            self.buffers[name].append(0)
+            self.valid[name].append(0)
+        else:
+            self.buffers[name].append(value)
+            self.valid[name].append(1)
+
+
+def _data(response):
+    if isinstance(response, Sc2RanksResponse):
+        return object.__getattribute__(response, '_data')
+    return response
+
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
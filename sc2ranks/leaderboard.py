@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+A local leaderboard built from custom division data.
+
+`LeaderboardIndex` loads custom divisions and keeps their teams sorted by
+points, one `Leaderboard` per region, league and bracket. Rank, percentile
+and top-N queries are answered with a binary search instead of re-sorting
+the divisions:
+
+    index = LeaderboardIndex(client)
+    index.load_divisions([5404, 5405], bracket=1)
+    board = index.board('eu', 'master', 1)
+    best = board.top(10)
+    rank = board.rank_of(team)
+
+Loading a division again updates the index in place: teams which left it
+are removed, changed teams are moved to their new position.
+"""
+
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+from core import character_key
+
+LOG = logging.getLogger(__name__)
+
+
+def team_id(team):
+    """
+    Returns the key identifying a team, made of the keys of its members.
+    Teams have no ID of their own in the API.
+    """
+    return tuple(sorted(character_key((member.region, member.name, member.bnet_id))
+                        for member in team.members))
+
+
+class Leaderboard(object):
+    """
+    The teams of one region, league and bracket, sorted by points.
+
+    Ranks start at 1, teams with equal points share a rank.
+    """
+
+    def __init__(self):
+        # negated points, so the list is sorted from the best team down
+        self._scores = []
+        self._ids = []
+        self._teams = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, team_or_id):
+        return _id(team_or_id) in self._teams
+
+    def add(self, team):
+        """Adds a team, or moves it if it is on the board already."""
+        key = team_id(team)
+        if key in self._teams:
+            self.remove(key)
+        score = -team.points
+        index = bisect_right(self._scores, score)
+        self._scores.insert(index, score)
+        self._ids.insert(index, key)
+        self._teams[key] = team
+
+    def remove(self, team_or_id):
+        """Removes a team. Returns whether it was on the board."""
+        key = _id(team_or_id)
+        team = self._teams.pop(key, None)
+        if team is None:
+            return False
+        score = -team.points
+        index = bisect_left(self._scores, score)
+        end = bisect_right(self._scores, score)
+        index += self._ids[index:end].index(key)
+        del self._scores[index]
+        del self._ids[index]
+        return True
+
+    def get(self, team_or_id):
+        """Returns the team on the board, or `None`."""
+        return self._teams.get(_id(team_or_id))
+
+    def rank(self, points):
+        """Returns the rank a team with `points` has on the board."""
+        return bisect_left(self._scores, -points) + 1
+
+    def rank_of(self, team_or_id):
+        """Returns the rank of a team on the board, or `None`."""
+        team = self.get(team_or_id)
+        if team is None:
+            return None
+        return self.rank(team.points)
+
+    def percentile(self, points):
+        """
+        Returns the percentage of teams with at most `points`, so the best
+        team is at 100.
+        """
+        if not self._ids:
+            return None
+        beaten = len(self._ids) - bisect_left(self._scores, -points)
+        return 100.0 * beaten / len(self._ids)
+
+    def top(self, n=10):
+        """Returns the best `n` teams, best first."""
+        return [self._teams[key] for key in self._ids[:n]]
+
+    def teams(self):
+        """Returns all teams, best first."""
+        return self.top(len(self._ids))
+
+
+class LeaderboardIndex(object):
+    """
+    Leaderboards of all loaded custom divisions, by region, league and
+    bracket.
+
+    A team in several loaded divisions is on its leaderboard once, with the
+    data of the division loaded last. It leaves the leaderboard when no
+    loaded division contains it anymore.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self.boards = {}
+        # team ids per division and the divisions containing each team
+        self._divisions = {}
+        self._owners = {}
+        # the leaderboard each team is on
+        self._placed = {}
+        self._lock = threading.Lock()
+
+    def load_division(self, division_id, region='all', league='all', bracket=1,
+                      is_random=False):
+        """
+        Fetches a custom division with the client and updates the index.
+        Returns the number of teams, or `None` if the fetch failed, in which
+        case the index keeps the data loaded before.
+        """
+        teams = self.client.fetch_custom_division_characters(division_id,
+                region, league, bracket, is_random)
+        if teams is None:
+            LOG.warning("Division %s could not be fetched", division_id)
+            return None
+        self.update_division(division_id, teams, bracket)
+        return len(teams)
+
+    def load_divisions(self, division_ids, **kwargs):
+        """Loads several divisions, see `load_division`."""
+        for division_id in division_ids:
+            self.load_division(division_id, **kwargs)
+
+    def update_division(self, division_id, teams, bracket=1):
+        """
+        Replaces the teams of a division with `teams`, as returned by
+        `fetch_custom_division_characters`.
+        """
+        placed = {}
+        for team in teams:
+            if not getattr(team, 'members', None) or getattr(team, 'points', None) is None:
+                continue
+            placed[team_id(team)] = (self.board_key(team, bracket), team)
+
+        self._lock.acquire()
+        try:
+            previous = self._divisions.get(division_id, set())
+            for key in previous.difference(placed):
+                owners = self._owners[key]
+                owners.discard(division_id)
+                if not owners:
+                    del self._owners[key]
+                    self._unplace(key)
+            for key, (board_key, team) in placed.iteritems():
+                self._owners.setdefault(key, set()).add(division_id)
+                if self._placed.get(key, board_key) != board_key:
+                    # moved to another league
+                    self._unplace(key)
+                self.boards.setdefault(board_key, Leaderboard()).add(team)
+                self._placed[key] = board_key
+            self._divisions[division_id] = set(placed)
+        finally:
+            self._lock.release()
+
+    def remove_division(self, division_id):
+        """Removes the teams which are in no other loaded division."""
+        self.update_division(division_id, [])
+        self._lock.acquire()
+        try:
+            del self._divisions[division_id]
+        finally:
+            self._lock.release()
+
+    def board(self, region, league, bracket=1):
+        """Returns the leaderboard of a region, league and bracket."""
+        return self.boards.get((region.lower(), league.lower(), int(bracket)),
+                               Leaderboard())
+
+    def find(self, team_or_id):
+        """Returns the leaderboard a team is on, or `None`."""
+        board_key = self._placed.get(_id(team_or_id))
+        if board_key is None:
+            return None
+        return self.boards[board_key]
+
+    def board_key(self, team, bracket=1):
+        """Returns the (region, league, bracket) of a team."""
+        region = getattr(team, 'region', None) or team.members[0].region
+        bracket = getattr(team, 'bracket', None) or bracket
+        return (region.lower(), unicode(team.league).lower(), int(bracket))
+
+    def _unplace(self, key):
+        board_key = self._placed.pop(key, None)
+        if board_key is not None:
+            board = self.boards[board_key]
+            board.remove(key)
+            if not len(board):
+                del self.boards[board_key]
+
+
+def _id(team_or_id):
+    if isinstance(team_or_id, tuple):
+        return team_or_id
+    return team_id(team_or_id)
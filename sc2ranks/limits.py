@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side rate limiting.
+
+sc2ranks.com limits the requests per API key. A `RateLimiter` shared by all
+calls of a client keeps it below that limit:
+
+* a token bucket caps the request rate, with bursts of up to `burst` requests,
+* the number of requests in flight adapts AIMD-style: it grows by one per
+  window of successful requests and is halved when the API throttles, fails
+  or gets slower than `latency_target`,
+* throttled and 5xx responses are retried after a jittered exponential
+  backoff, or after the time the server asks for with a Retry-After header.
+"""
+
+import time
+import random
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+# statuses sent when the API key is over its limit
+THROTTLED_STATUSES = frozenset([429, 503])
+
+
+def is_throttled(status, data=None):
+    """
+    Tells whether a response means the API key is over its limit. Besides the
+    status, error responses of the API mentioning a limit count as well.
+    """
+    if status in THROTTLED_STATUSES:
+        return True
+    if isinstance(data, dict) and 'error' in data:
+        error = unicode(data['error']).lower()
+        return 'limit' in error or 'throttl' in error
+    return False
+
+
+def should_retry(status, data=None):
+    """Tells whether a request with this response should be retried."""
+    return status is not None and (status >= 500 or is_throttled(status, data))
+
+
+def retry_after(headers):
+    """Returns the seconds of a Retry-After header, or `None`."""
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get('retry-after')))
+    except (TypeError, ValueError):
+        # the HTTP date form is not worth parsing for this
+        return None
+
+
+class TokenBucket(object):
+    """
+    Hands out `rate` tokens per second, at most `burst` at once.
+
+    `pause(seconds)` stops handing out tokens for a while, for example when
+    the server asked to retry later.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst or rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None, blocking=True):
+        """
+        Takes a token, waiting for it if necessary. Returns the wait, or
+        `None` if no token would be available before `deadline`, a
+        `sc2ranks.deadlines.Deadline`, or right away if not `blocking`.
+        """
+        waited = 0.0
+        while True:
+            self._lock.acquire()
+            try:
+                now = time.time()
+                self._tokens = min(self.burst,
+                        self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._resume_at and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(self._resume_at - now,
+                            (1 - self._tokens) / self.rate)
+            finally:
+                self._lock.release()
+            if not blocking or (deadline is not None
+                                and delay >= deadline.remaining()):
+                return None
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        self._lock.acquire()
+        try:
+            self._resume_at = max(self._resume_at, time.time() + seconds)
+        finally:
+            self._lock.release()
+
+
+class AdaptiveConcurrency(object):
+    """
+    A limit on the requests in flight, adapted by additive increase and
+    multiplicative decrease (AIMD).
+
+    Every successful request adds `1 / limit`, so the limit grows by one per
+    window of requests. A failed, throttled or slow request multiplies it by
+    `decrease`, at most once per window so a burst of failures of requests
+    sent together counts once.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, decrease=0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = maximum
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        # requests finished since the last decrease, the first congestion
+        # always counts
+        self._since_decrease = self.limit
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline=None, blocking=True):
+        """
+        Takes a slot, waiting for one if necessary. Returns whether it got
+        one before `deadline`, or right away if not `blocking`.
+        """
+        self._condition.acquire()
+        try:
+            while self.in_flight >= int(self.limit):
+                if not blocking:
+                    return False
+                if deadline is None:
+                    self._condition.wait()
+                elif deadline.expired():
+                    return False
+                else:
+                    self._condition.wait(deadline.remaining())
+            self.in_flight += 1
+            return True
+        finally:
+            self._condition.release()
+
+    def cancel(self):
+        """Gives back a slot without a request having been sent."""
+        self._condition.acquire()
+        try:
+            self.in_flight -= 1
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def release(self, congested=False):
+        """Gives back a slot and adapts the limit to how the request went."""
+        self._condition.acquire()
+        try:
+            self.in_flight -= 1
+            self._since_decrease += 1
+            if congested:
+                if self._since_decrease >= self.limit:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._since_decrease = 0
+                    LOG.debug("Concurrency limit decreased to %d", self.limit)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+
+class RateLimiter(object):
+    """
+    Limits the request rate and concurrency of a client and decides on
+    retries.
+
+    **rate:** Requests per second. **Default:** None (unlimited)
+
+    **burst:** Requests which may be sent at once when the rate allows.
+    **Default:** `rate`
+
+    **concurrency:** The initial limit of requests in flight, which adapts
+    between `min_concurrency` and `max_concurrency`. **Default:** 4, 1 and 32
+
+    **latency_target:** Responses slower than this many seconds lower the
+    concurrency, like errors do. **Default:** None (latency is ignored)
+
+    **retries:** How often a throttled or failed (5xx) request is retried.
+    **Default:** 3
+
+    **backoff:** The base delay in seconds before a retry, doubled for every
+    further attempt, up to `max_backoff`. The actual delay is random between
+    zero and that ("full jitter"), so clients do not retry in lockstep.
+    **Default:** 0.5 and 30
+
+    `stats` counts the requests, how many were throttled and retried, how
+    many gave up waiting because of their deadline and how long requests
+    waited for a token in total.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=4, min_concurrency=1,
+                 max_concurrency=32, latency_target=None, retries=3,
+                 backoff=0.5, max_backoff=30.0):
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(concurrency, min_concurrency,
+                                               max_concurrency)
+        self.latency_target = latency_target
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'waited': 0.0,
+                      'expired': 0}
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None, blocking=True):
+        """
+        Waits until a request may be sent. Returns `False` without waiting
+        any longer if that is not before `deadline`, in which case `release`
+        must not be called. If not `blocking`, it does not wait at all and
+        returns whether a request may be sent right away.
+        """
+        if not self.concurrency.acquire(deadline, blocking):
+            if blocking:
+                self._count('expired', 1)
+            return False
+        if self.bucket is not None:
+            waited = self.bucket.acquire(deadline, blocking)
+            if waited is None:
+                self.concurrency.cancel()
+                if blocking:
+                    self._count('expired', 1)
+                return False
+        else:
+            waited = 0.0
+        self._count('requests', 1)
+        self._count('waited', waited)
+        return True
+
+    def release(self, latency=None, status=None, data=None, headers=None):
+        """
+        Reports the outcome of a request. `status` is `None` for a connection
+        problem.
+        """
+        throttled = is_throttled(status, data)
+        congested = throttled or status is None or status >= 500
+        if self.latency_target is not None and latency is not None:
+            congested = congested or latency > self.latency_target
+        if throttled:
+            self._count('throttled', 1)
+            delay = retry_after(headers)
+            if delay and self.bucket is not None:
+                self.bucket.pause(delay)
+        self.concurrency.release(congested)
+
+    def retry_delay(self, attempt, status=None, data=None, headers=None):
+        """
+        Returns the seconds to wait before retrying a request which got this
+        response on its `attempt` (0 for the first one), or `None` if it
+        should not be retried.
+        """
+        if attempt >= self.retries or not should_retry(status, data):
+            return None
+        self._count('retries', 1)
+        delay = retry_after(headers)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return delay
+
+    def _count(self, name, value):
+        self._lock.acquire()
+        try:
+            self.stats[name] += value
+        finally:
+            self._lock.release()
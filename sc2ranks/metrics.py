@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Per-endpoint metrics of the API client.
+
+A `Metrics` instance collects what the client records for each endpoint:
+request latencies (as a histogram), bytes received, time spent decoding JSON
+and wrapping it into responses, errors and cache lookups. `snapshot()`
+returns all of it as a plain dict, and hooks are called for every recorded
+event, so the numbers can be forwarded to any metrics system.
+"""
+
+import bisect
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+# upper bounds in seconds of the latency histogram buckets, the last bucket
+# counts everything slower
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST = 'request'
+DECODE = 'decode'
+WRAP = 'wrap'
+ERROR = 'error'
+CACHE = 'cache'
+HEDGE = 'hedge'
+
+
+class EndpointMetrics(object):
+    """The counters of a single endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.decode_time = 0.0
+        self.wrap_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def latency_percentile(self, percentile):
+        """
+        Returns the upper bound of the histogram bucket holding the given
+        percentile (0-100) of the latencies, `None` for the last bucket.
+        """
+        if not self.requests:
+            return None
+        rank = self.requests * percentile / 100.0
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'latency_sum': self.latency_sum,
+            'latency_histogram': dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                self.latency_buckets)),
+            'latency_p50': self.latency_percentile(50),
+            'latency_p95': self.latency_percentile(95),
+            'latency_p99': self.latency_percentile(99),
+            'decode_time': self.decode_time,
+            'wrap_time': self.wrap_time,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'hedges': self.hedges,
+            'hedges_won': self.hedges_won,
+        }
+
+
+class Metrics(object):
+    """
+    Collects the metrics of one or more clients.
+
+    Hooks added with `add_hook` are called as `hook(endpoint, event, values)`
+    for every recorded event. `event` is one of 'request' (values `latency`,
+    `bytes` and `status`), 'decode' and 'wrap' (value `seconds`), 'error'
+    (value `reason`), 'cache' (value `hit`) and 'hedge' (value `won`, whether
+    the second request answered first). Exceptions raised by hooks are
+    logged and otherwise ignored.
+    """
+
+    def __init__(self):
+        self._endpoints = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def endpoint(self, name):
+        """Returns the `EndpointMetrics` of an endpoint."""
+        self._lock.acquire()
+        try:
+            metrics = self._endpoints.get(name)
+            if metrics is None:
+                metrics = self._endpoints[name] = EndpointMetrics()
+            return metrics
+        finally:
+            self._lock.release()
+
+    def record(self, endpoint, event, **values):
+        """Records an event of `endpoint` and calls the hooks."""
+        metrics = self.endpoint(endpoint)
+        self._lock.acquire()
+        try:
+            if event == REQUEST:
+                latency = values['latency']
+                metrics.requests += 1
+                metrics.bytes += values.get('bytes', 0)
+                metrics.latency_sum += latency
+                metrics.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            elif event == DECODE:
+                metrics.decode_time += values['seconds']
+            elif event == WRAP:
+                metrics.wrap_time += values['seconds']
+            elif event == ERROR:
+                metrics.errors += 1
+            elif event == CACHE:
+                if values['hit']:
+                    metrics.cache_hits += 1
+                else:
+                    metrics.cache_misses += 1
+            elif event == HEDGE:
+                metrics.hedges += 1
+                if values['won']:
+                    metrics.hedges_won += 1
+        finally:
+            self._lock.release()
+        for hook in self._hooks:
+            try:
+                hook(endpoint, event, values)
+            except Exception:
+                LOG.exception("Metrics hook %r failed", hook)
+
+    def snapshot(self):
+        """Returns the metrics of all endpoints as a dict of dicts."""
+        self._lock.acquire()
+        try:
+            return dict((name, metrics.as_dict())
+                        for name, metrics in self._endpoints.iteritems())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._endpoints.clear()
+        finally:
+            self._lock.release()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+A local index of character names.
+
+`NameIndex` remembers every character it is fed and answers the searches of
+`Sc2Ranks.search_for_character` without a request:
+
+* `starts` walks a trie of the names,
+* `ends` walks a trie of the reversed names,
+* `contains` looks up the rarest n-gram of the search string, then checks
+  the names containing it,
+* `exact` is a dict lookup.
+
+All searches are case-insensitive. Passed as `names` to `Sc2Ranks`, the
+index is fed with the characters of all responses, and `search_for_character`
+only asks the API when the index knows no matching name.
+"""
+
+import threading
+
+from core import Sc2RanksResponse, SEARCH_PAGE_SIZE, character_key
+
+# the longest n-grams indexed for `contains`, shorter ones are indexed too
+# so short search strings are a single lookup
+NGRAM = 3
+SEARCH_TYPES = ('exact', 'contains', 'starts', 'ends')
+
+# the keys of a trie node holding the names ending at it
+_NAMES = None
+
+
+class NameIndex(object):
+    """
+    Indexes the names of characters and searches them.
+
+    `stats` counts the searches answered locally and the misses.
+    """
+
+    def __init__(self):
+        self.stats = {'hits': 0, 'misses': 0}
+        # name as searched (lower case) -> {character key: character}
+        self._characters = {}
+        self._prefixes = {}
+        self._suffixes = {}
+        # n-gram -> lower case names containing it
+        self._ngrams = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(characters) for characters in self._characters.values())
+
+    def add(self, region, name, bnet_id):
+        """Adds a character. Returns whether it was new."""
+        try:
+            key = character_key((region, name, bnet_id))
+        except (TypeError, ValueError, AttributeError):
+            return False
+        lower = key[1]
+        self._lock.acquire()
+        try:
+            characters = self._characters.get(lower)
+            if characters is None:
+                characters = self._characters[lower] = {}
+                _insert(self._prefixes, lower, lower)
+                _insert(self._suffixes, lower[::-1], lower)
+                for gram in _ngrams(lower):
+                    self._ngrams.setdefault(gram, set()).add(lower)
+            new = key not in characters
+            characters[key] = {'region': region, 'name': name, 'bnet_id': bnet_id}
+            return new
+        finally:
+            self._lock.release()
+
+    def add_data(self, data):
+        """
+        Adds the characters found in an API response, like search results,
+        characters, teams and their members. Returns how many were new.
+        """
+        if isinstance(data, Sc2RanksResponse):
+            data = object.__getattribute__(data, '_data')
+        added = 0
+        if isinstance(data, list):
+            for item in data:
+                added += self.add_data(item)
+        elif isinstance(data, dict):
+            if 'name' in data and 'region' in data and 'bnet_id' in data:
+                added += self.add(data['region'], data['name'], data['bnet_id'])
+            for nested in ('characters', 'members', 'teams'):
+                if nested in data:
+                    added += self.add_data(data[nested])
+        return added
+
+    def add_search_results(self, region, result):
+        """
+        Adds the characters of a `search_for_character` result. The API
+        leaves out their region, which is the one searched in, so nothing is
+        added for a search in 'all' regions. Returns how many were new.
+        """
+        added = 0
+        for character in getattr(result, 'characters', None) or ():
+            if isinstance(character, Sc2RanksResponse):
+                character = object.__getattribute__(character, '_data')
+            character_region = character.get('region') or region
+            if character_region.lower() != 'all':
+                added += self.add(character_region, character.get('name'),
+                                  character.get('bnet_id'))
+        return added
+
+    def find(self, name, search_type='exact', region='all'):
+        """
+        Returns the characters whose name matches, sorted by name. `region`
+        'all' matches every region.
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError("Unknown search type %r" % search_type)
+        query = unicode(name).lower()
+        self._lock.acquire()
+        try:
+            if search_type == 'exact':
+                names = query in self._characters and [query] or []
+            elif search_type == 'starts':
+                names = _collect(self._prefixes, query)
+            elif search_type == 'ends':
+                names = _collect(self._suffixes, query[::-1])
+            else:
+                names = self._containing(query)
+            found = []
+            for lower in sorted(names):
+                for key, character in sorted(self._characters[lower].items()):
+                    if region == 'all' or key[0] == region.lower():
+                        found.append(dict(character))
+            return found
+        finally:
+            self._lock.release()
+
+    def search(self, region, name, search_type='exact', offset=0):
+        """
+        Answers a search like `Sc2Ranks.search_for_character`, with a page of
+        `SEARCH_PAGE_SIZE` characters and their total. Returns `None` if no known
+        character matches.
+        """
+        found = self.find(name, search_type, region)
+        self._lock.acquire()
+        try:
+            self.stats[found and 'hits' or 'misses'] += 1
+        finally:
+            self._lock.release()
+        if not found:
+            return None
+        return Sc2RanksResponse({'total': len(found),
+                                 'characters': found[offset:offset + SEARCH_PAGE_SIZE]})
+
+    def _containing(self, query):
+        if not query:
+            return list(self._characters)
+        if len(query) <= NGRAM:
+            return list(self._ngrams.get(query, ()))
+        smallest = None
+        for gram in _ngrams(query, NGRAM):
+            names = self._ngrams.get(gram)
+            if not names:
+                return []
+            if smallest is None or len(names) < len(smallest):
+                smallest = names
+        return [lower for lower in smallest if query in lower]
+
+
+def _ngrams(text, length=None):
+    """Returns the n-grams of `text` of `length`, or of 1 to `NGRAM`."""
+    grams = set()
+    for n in length and (length,) or range(1, NGRAM + 1):
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+def _insert(trie, text, name):
+    node = trie
+    for char in text:
+        node = node.setdefault(char, {})
+    node.setdefault(_NAMES, set()).add(name)
+
+
+def _collect(trie, prefix):
+    """Returns the names stored below `prefix`."""
+    node = trie
+    for char in prefix:
+        node = node.get(char)
+        if node is None:
+            return []
+    names = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for char, child in node.iteritems():
+            if char is _NAMES:
+                names.extend(child)
+            else:
+                stack.append(child)
+    return names
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental parsing of JSON arrays.
+
+Large API responses, like the teams of a custom division, are JSON arrays.
+`JSONStream` reads such an array from a file-like object and yields its
+elements one by one as soon as they have been received, so the whole body
+never has to be held in memory.
+"""
+
+from decoders import json
+
+CHUNK_SIZE = 16 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class JSONStream(object):
+    """
+    Reads a JSON document from the file-like object `f`.
+
+    If the document is an array (`is_array`), iterating over the stream
+    yields its decoded elements. Otherwise `document()` returns the decoded
+    document. Invalid JSON raises a `ValueError`.
+
+    Elements are decoded with the standard library decoder, which can decode
+    a value at any offset of the buffer. `object_hook` is passed on to it.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE, object_hook=None):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder(object_hook=object_hook)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        first = self._peek()
+        self.is_array = first == '['
+        if self.is_array:
+            self._pos += 1
+
+    def document(self):
+        """Reads and decodes the rest of a document which is not an array."""
+        chunks = [self._buffer[self._pos:]]
+        chunk = self._f.read()
+        while chunk:
+            chunks.append(chunk)
+            chunk = self._f.read()
+        self._buffer, self._pos, self._eof = '', 0, True
+        return self._decoder.decode(''.join(chunks))
+
+    def __iter__(self):
+        if not self.is_array:
+            raise ValueError("The JSON document is not an array")
+        expect_element = True
+        while True:
+            char = self._peek()
+            if char == ']':
+                self._pos += 1
+                return
+            if char == ',' and not expect_element:
+                self._pos += 1
+                expect_element = True
+                continue
+            if char is None or not expect_element:
+                raise ValueError("Malformed JSON array at byte %d" % self._pos)
+            yield self._element()
+            expect_element = False
+
+    def _element(self):
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # the element may just be incomplete
+                if not self._read():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._read():
+                continue
+            self._pos = end
+            return value
+
+    def _peek(self):
+        """Skips whitespace and returns the next character, or None at EOF."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return None
+
+    def _read(self):
+        """Appends the next chunk to the buffer. Returns False at EOF."""
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # drop what has been parsed already
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
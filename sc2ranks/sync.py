@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Change tracking for a set of characters.
+
+`SyncEngine` remembers the `updated_at` and a hash of the content of every
+character it synced. Each call to `sync` fetches the characters with the mass
+endpoint and yields an event only for those which were added, changed or are
+gone, so downstream writes only touch what changed:
+
+    engine = SyncEngine(client)
+    for event in engine.sync(tracked_characters):
+        if event.kind == REMOVED:
+            delete_row(event.key)
+        else:
+            save_row(event.key, event.response)
+
+The state of a character is updated once its event has been consumed, so an
+event the consumer failed on is emitted again by the next sync. `state` may
+be any dict-like object, e.g. a `shelve`, to keep it between runs.
+"""
+
+import hashlib
+import logging
+
+from core import MAX_CHARS, Sc2RanksResponse, character_key
+from decoders import json
+
+LOG = logging.getLogger(__name__)
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+# fields which change without the character changing
+VOLATILE_FIELDS = frozenset(['updated_at'])
+
+
+def content_hash(data):
+    """
+    Returns a hash of the decoded JSON of a character, without the fields in
+    `VOLATILE_FIELDS`.
+    """
+    if isinstance(data, Sc2RanksResponse):
+        data = object.__getattribute__(data, '_data')
+    if isinstance(data, dict):
+        data = dict((k, v) for k, v in data.iteritems() if k not in VOLATILE_FIELDS)
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+class ChangeEvent(object):
+    """
+    A change of a character found by `SyncEngine.sync`.
+
+    `kind` is `ADDED`, `CHANGED` or `REMOVED`, `key` the normalized
+    `(region, name, bnet_id)`, `character` the tracked character and
+    `response` its new data, which is `None` for a removed character.
+    """
+
+    def __init__(self, kind, key, character, response=None, updated_at=None,
+                 digest=None):
+        self.kind = kind
+        self.key = key
+        self.character = character
+        self.response = response
+        self.updated_at = updated_at
+        self.digest = digest
+
+    def __repr__(self):
+        return '<ChangeEvent %s %r>' % (self.kind, self.key)
+
+
+class SyncEngine(object):
+    """
+    Finds the tracked characters which changed since the last sync.
+
+    **state:** A dict-like object mapping character keys, as strings, to
+    their last seen `(updated_at, content hash)`. **Default:** a new dict
+
+    **batch_size:** Characters per mass request. **Default:** `MAX_CHARS`
+
+    A character is compared by its hash only if its `updated_at` changed. A
+    character the API did not return is removed, unless its whole batch came
+    back empty, which is taken for a failed request.
+
+    `stats` counts the characters fetched, the unchanged ones, the events of
+    each kind and the failed batches.
+    """
+
+    def __init__(self, client, state=None, batch_size=MAX_CHARS):
+        self.client = client
+        if state is None:
+            state = {}
+        self.state = state
+        self.batch_size = batch_size
+        self.stats = {'fetched': 0, 'unchanged': 0, ADDED: 0, CHANGED: 0,
+                      REMOVED: 0, 'failed': 0}
+
+    def sync(self, characters):
+        """Yields a `ChangeEvent` for every changed character."""
+        unique = {}
+        for character in characters:
+            unique.setdefault(character_key(character), tuple(character))
+        keys = unique.keys()
+        for i in range(0, len(keys), self.batch_size):
+            batch = [unique[key] for key in keys[i:i + self.batch_size]]
+            for event in self._sync_batch(batch):
+                yield event
+                self._commit(event)
+
+    def forget(self, character):
+        """Drops the state of a character no longer tracked."""
+        self.state.pop(_state_key(character_key(character)), None)
+
+    def _sync_batch(self, batch):
+        found = {}
+        for response in self.client.fetch_mass_base_characters(batch):
+            try:
+                found[character_key(response)] = response
+            except (TypeError, ValueError):
+                LOG.warning("Unexpected character in mass response: %r",
+                            response)
+        if not found:
+            LOG.warning("No characters returned for a batch of %d", len(batch))
+            self.stats['failed'] += 1
+            return
+        self.stats['fetched'] += len(found)
+        for character in batch:
+            key = character_key(character)
+            previous = self.state.get(_state_key(key))
+            response = found.get(key)
+            if response is None:
+                if previous is not None:
+                    yield ChangeEvent(REMOVED, key, character)
+                continue
+            updated_at = getattr(response, 'updated_at', None)
+            if previous is not None and updated_at is not None \
+                    and previous[0] == updated_at:
+                self.stats['unchanged'] += 1
+                continue
+            digest = content_hash(response)
+            if previous is None:
+                yield ChangeEvent(ADDED, key, character, response, updated_at, digest)
+            elif previous[1] != digest:
+                yield ChangeEvent(CHANGED, key, character, response, updated_at, digest)
+            else:
+                # touched but not changed, remember the new updated_at
+                self.state[_state_key(key)] = (updated_at, digest)
+                self.stats['unchanged'] += 1
+
+    def _commit(self, event):
+        self.stats[event.kind] += 1
+        if event.kind == REMOVED:
+            self.state.pop(_state_key(event.key), None)
+        else:
+            self.state[_state_key(event.key)] = (event.updated_at, event.digest)
+
+
+def _state_key(key):
+    # shelve and most stores only take strings
+    return (u'%s/%s!%s' % key).encode('utf-8')
@@ -0,0 +1,100 @@
+"""
+Fakes of the sc2ranks.com API shared by the tests.
+
+The fakes replace `core.fetch`, which all requests of `Sc2Ranks` go
+through; tests doing so derive from `FetchTestCase`, which puts the real
+one back.
+"""
+import json
+import random
+import threading
+import time
+import unittest
+import urlparse
+
+from sc2ranks import core
+
+
+class FetchTestCase(unittest.TestCase):
+    """Restores `core.fetch` after every test."""
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.fetch = core.fetch
+
+    def tearDown(self):
+        core.fetch = self.fetch
+        unittest.TestCase.tearDown(self)
+
+
+class FakeFetch(object):
+    """
+    Replaces `core.fetch`, answering with the given responses in turn. A
+    response is a `(status, headers, body)` tuple, or None for a failed
+    request. The keyword argument `delays` gives the seconds to wait before
+    each answer. `calls` counts the requests, `timeouts` lists their
+    timeouts.
+    """
+
+    def __init__(self, *responses, **kwargs):
+        self.responses = list(responses)
+        self.delays = list(kwargs.get('delays', ()))
+        self.calls = 0
+        self.timeouts = []
+
+    def __call__(self, url, params=None, pool=None, headers=None, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        return self.responses.pop(0)
+
+
+class FakeMassAPI(object):
+    """
+    Replaces `core.fetch` and answers mass requests like sc2ranks.com,
+    after a short random delay.
+
+    **missing:** Names of characters which are not found. **Default:** none
+
+    **characters:** The data of the known characters by bnet id, answered
+    instead of the requested region and name. **Default:** None (all
+    characters are known)
+    """
+
+    def __init__(self, delay=0.0, missing=(), characters=None):
+        self.delay = delay
+        self.missing = set(missing)
+        self.characters = characters
+        self.requests = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, params=None, pool=None, headers=None, timeout=None):
+        self.lock.acquire()
+        self.requests.append(params)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.lock.release()
+        if self.delay:
+            time.sleep(random.random() * self.delay)
+        fields = dict(urlparse.parse_qsl(params))
+        result = []
+        i = 0
+        while 'characters[%d][name]' % i in fields:
+            bnet_id = int(fields['characters[%d][bnet_id]' % i])
+            if self.characters is not None:
+                if bnet_id in self.characters:
+                    result.append(self.characters[bnet_id])
+            elif fields['characters[%d][name]' % i] not in self.missing:
+                result.append({
+                    'region': fields['characters[%d][region]' % i],
+                    'name': fields['characters[%d][name]' % i].decode('utf-8'),
+                    'bnet_id': bnet_id,
+                })
+            i += 1
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+        return 200, {}, json.dumps(result)
@@ -0,0 +1,95 @@
+import logging
+import threading
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.core import Sc2RanksResponse
+from sc2ranks.batching import BatchLoader
+from sc2ranks.test.fakes import FakeMassAPI, FetchTestCase
+
+
+class BatchLoaderTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        core.fetch = self.api = FakeMassAPI(missing=['Missing'])
+        self.loader = BatchLoader(Sc2Ranks('key'), window=0.05)
+
+    def testWindow(self):
+        """Fetches from several threads within the window share a request."""
+        results = {}
+
+        def fetch(i):
+            results[i] = self.loader.fetch_base_character('eu', 'Player%d' % i, i)
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.api.requests), 1)
+        self.assertEqual(dict((i, r.bnet_id) for i, r in results.items()),
+                         dict((i, i) for i in range(20)))
+
+    def testBatchBlock(self):
+        """Loads in a batch block are sent when it ends, per endpoint."""
+        with self.loader.batch():
+            base = [self.loader.load_base_character('eu', 'Player%d' % i, i)
+                    for i in range(5)]
+            missing = self.loader.load_base_character('eu', 'Missing', 99)
+            teams = self.loader.load_character_teams('EU', 'player1', 1, '2v2')
+            self.assertFalse(base[0].done())
+        self.assertEqual([f.result().name for f in base],
+                         ['Player%d' % i for i in range(5)])
+        self.assertEqual(missing.result(), None)
+        self.assertEqual(teams.result().bnet_id, 1)
+        self.assertEqual(len(self.api.requests), 2)
+        self.assertEqual(len([r for r in self.api.requests
+                              if 'team%5Bbracket%5D=2' in r]), 1)
+        self.assertEqual(self.loader.stats, {'loads': 7, 'batches': 2})
+
+    def testFetchInBatchBlock(self):
+        """fetch_* within a batch block send their group instead of hanging."""
+        with self.loader.batch():
+            pending = self.loader.load_base_character('eu', 'Player1', 1)
+            teams = self.loader.load_character_teams('eu', 'Player2', 2, 1)
+            response = self.loader.fetch_base_character('eu', 'Player0', 0)
+            self.assertEqual(response.bnet_id, 0)
+            self.assertEqual(pending.result(timeout=1).bnet_id, 1)
+            self.assertFalse(teams.done())
+        self.assertEqual(teams.result(timeout=1).bnet_id, 2)
+        self.assertEqual(len(self.api.requests), 2)
+
+    def testFullBatch(self):
+        """A full batch is sent without waiting for the window."""
+        loader = BatchLoader(Sc2Ranks('key'), window=60, max_batch=3)
+        futures = [loader.load_base_character('eu', 'Player%d' % i, i)
+                   for i in range(3)]
+        self.assertEqual([f.result(timeout=1).bnet_id for f in futures], [0, 1, 2])
+
+    def testErrors(self):
+        """Exceptions of the mass call reach every caller."""
+        def fail(*args, **kwargs):
+            raise ValueError()
+        self.loader.client.fetch_mass_base_characters = fail
+        future = self.loader.load_base_character('eu', 'Player1', 1)
+        self.loader.flush()
+        self.assertRaises(ValueError, future.result)
+
+    def testResponseWithoutId(self):
+        """Responses which match no character are skipped."""
+        self.loader.client.fetch_mass_base_characters = lambda characters: [
+            Sc2RanksResponse({'region': 'eu', 'name': 'Player1'}),
+            Sc2RanksResponse({'region': 'EU', 'name': 'player2', 'bnet_id': 2})]
+        first = self.loader.load_base_character('eu', 'Player1', 1)
+        second = self.loader.load_base_character('eu', 'Player2', 2)
+        logging.disable(logging.WARNING)
+        try:
+            self.loader.flush()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(first.result(timeout=1), None)
+        self.assertEqual(second.result(timeout=1).bnet_id, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from sc2ranks.cache import ResponseCache
+from sc2ranks.limits import RateLimiter
+from sc2ranks.test.fakes import FakeFetch, FetchTestCase
+
+BODY = json.dumps({'name': 'Kapitulation', 'bnet_id': 316741})
+NOT_FOUND = '{"error": "no_characters"}'
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def testOpenAndProbe(self):
+        """The breaker opens on failures and closes after a good probe."""
+        breaker = CircuitBreaker(min_requests=4, window=4, reset_timeout=0.05)
+        for success in (True, False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(success)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # only one probe at a time
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats, {'rejected': 2, 'opened': 1})
+
+    def testCancelProbe(self):
+        """A probe which was not sent lets the next request probe."""
+        breaker = CircuitBreaker(min_requests=1, window=1, reset_timeout=0)
+        breaker.allow()
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.cancel()
+        self.assertTrue(breaker.allow())
+
+
+class ClientTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        FetchTestCase.tearDown(self)
+
+    def testNegativeCaching(self):
+        """Not-found responses are remembered, throttling is not."""
+        core.fetch = fetch = FakeFetch((200, {}, NOT_FOUND),
+                                       (429, {}, '{"error": "rate limit"}'),
+                                       (429, {}, '{"error": "rate limit"}'))
+        client = Sc2Ranks('key', negative_ttl=60)
+        for i in range(3):
+            self.assertEqual(client.search_for_character('eu', 'Nobody'), None)
+        self.assertEqual(fetch.calls, 1)
+        for i in range(2):
+            client.search_for_character('eu', 'Throttled')
+        self.assertEqual(fetch.calls, 3)
+
+    def testFailFast(self):
+        """An open breaker stops requests."""
+        core.fetch = fetch = FakeFetch(*[None] * 10)
+        client = Sc2Ranks('key', breaker=CircuitBreaker(min_requests=5))
+        for i in range(10):
+            self.assertEqual(client.fetch_base_character('eu', 'Player%d' % i, i), None)
+        self.assertEqual(fetch.calls, 5)
+        self.assertEqual(client.metrics.snapshot()['base/char']['errors'], 10)
+
+    def testOpenTakesNoLimiterTurn(self):
+        """Rejected requests neither wait for nor slow down the limiter."""
+        core.fetch = fetch = FakeFetch(None)
+        client = Sc2Ranks('key', breaker=CircuitBreaker(min_requests=1),
+                          limiter=RateLimiter(concurrency=8, retries=0))
+        for i in range(6):
+            self.assertEqual(client.fetch_base_character('eu', 'Player%d' % i, i), None)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(client.limiter.stats['requests'], 1)
+        self.assertEqual(client.limiter.concurrency.limit, 4)
+        self.assertEqual(client.limiter.concurrency.in_flight, 0)
+
+    def testServeExpired(self):
+        """Expired cached responses are served while the API is failing."""
+        core.fetch = fetch = FakeFetch((200, {}, BODY),
+                                       *[(503, {}, 'Unavailable')] * 3)
+        client = Sc2Ranks('key', cache=ResponseCache(ttl=0),
+                          breaker=CircuitBreaker(min_requests=2, window=2))
+        for i in range(4):
+            response = client.fetch_base_character('eu', 'Kapitulation', 316741)
+            self.assertEqual(response.bnet_id, 316741)
+        self.assertEqual(client.breaker.state, OPEN)
+        # half of the window failed after the first failure
+        self.assertEqual(fetch.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
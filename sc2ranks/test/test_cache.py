@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sc2ranks import core
+from sc2ranks.core import Sc2Ranks
+from sc2ranks.cache import ResponseCache, DiskCache, endpoint
+from sc2ranks.transport import MemoryTransport
+from sc2ranks.test.fakes import FetchTestCase
+
+CHARACTER = {'name': 'Kapitulation', 'bnet_id': 316741, 'region': 'eu',
+             'portrait': {'icon_id': 1, 'row': 2, 'column': 3}}
+
+
+class FakeAPI(object):
+    """
+    Replaces `core.fetch` and counts the requests. If an `etag` is set, it is
+    sent with every response and conditional requests for it get a 304.
+    """
+
+    def __init__(self, data=CHARACTER, etag=None):
+        self.data = data
+        self.etag = etag
+        self.urls = []
+        self.conditional = 0
+
+    def __call__(self, url, params=None, pool=None, headers=None, timeout=None):
+        self.urls.append(url)
+        response_headers = {}
+        if self.etag:
+            response_headers['etag'] = self.etag
+            if (headers or {}).get('If-None-Match') == self.etag:
+                self.conditional += 1
+                return 304, response_headers, ''
+        return 200, response_headers, json.dumps(self.data)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def testEndpoint(self):
+        """Paths are mapped to their endpoint."""
+        self.assertEqual(endpoint('base/char/eu/Name!1'), 'base/char')
+        self.assertEqual(endpoint('search/exact/eu/Name/0'), 'search')
+        self.assertEqual(endpoint('clist/5404/all/all/3/0'), 'clist')
+
+    def testNormalizedKeys(self):
+        """Keys differing only in casing hit the same entry."""
+        cache = ResponseCache()
+        cache.set('base/char/EU/Kapitulation!1', 'value')
+        self.assertEqual(cache.get('base/char/eu/kapitulation!1').value, 'value')
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def testLRUEviction(self):
+        """The least recently used entry is evicted first."""
+        cache = ResponseCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a').value, 1)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def testEndpointTTL(self):
+        """Entries expire after the TTL of their endpoint."""
+        cache = ResponseCache(ttl=60, ttls={'search': 0})
+        cache.set('search/exact/eu/name/0', 1)
+        cache.set('base/char/eu/name!1', 2)
+        self.assertEqual(cache.get('search/exact/eu/name/0'), None)
+        self.assertTrue(cache.get('base/char/eu/name!1').is_fresh())
+
+
+class CachingClientTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        core.fetch = self.api = FakeAPI()
+
+    def testCachedCalls(self):
+        """Repeated calls are answered from the cache."""
+        client = Sc2Ranks('key', cache=ResponseCache())
+        first = client.fetch_base_character('eu', 'Kapitulation', 316741)
+        second = client.fetch_base_character('EU', 'kapitulation', 316741)
+        self.assertEqual(len(self.api.urls), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second.portrait.icon_id, 1)
+
+    def testErrorsAreNotCached(self):
+        """Error responses always go to the API."""
+        core.fetch = api = FakeAPI({'error': 'no_characters'})
+        client = Sc2Ranks('key', cache=ResponseCache())
+        client.fetch_base_character('eu', 'Nobody', 1)
+        client.fetch_base_character('eu', 'Nobody', 1)
+        self.assertEqual(len(api.urls), 2)
+
+    def testStaleWhileRevalidate(self):
+        """Stale responses are served while they are refreshed."""
+        cache = ResponseCache(ttl=0, stale_ttl=60)
+        client = Sc2Ranks('key', cache=cache)
+        client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.api.data = dict(CHARACTER, achievement_points=10)
+        stale = client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertFalse(hasattr(stale, 'achievement_points'))
+        for i in range(100):
+            if len(self.api.urls) == 2 and not cache._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.api.urls), 2)
+        self.assertEqual(cache.get('base/char/eu/kapitulation!316741').value['achievement_points'], 10)
+
+
+class DiskCacheTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.sqlite')
+        core.fetch = self.api = FakeAPI(etag='"v1"')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        FetchTestCase.tearDown(self)
+
+    def testSurvivesRestart(self):
+        """Responses are read back by a new cache on the same file."""
+        cache = DiskCache(self.path, compact_interval=None)
+        Sc2Ranks('key', cache=cache).fetch_base_character('eu', 'Kapitulation', 316741)
+        cache.close()
+        cache = DiskCache(self.path, compact_interval=None)
+        response = Sc2Ranks('key', cache=cache).fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertEqual(response.portrait.row, 2)
+        self.assertEqual(len(self.api.urls), 1)
+        cache.close()
+
+    def testConditionalRevalidation(self):
+        """Expired responses are revalidated instead of downloaded again."""
+        cache = DiskCache(self.path, ttl=0, compact_interval=None)
+        client = Sc2Ranks('key', cache=cache)
+        client.fetch_base_character('eu', 'Kapitulation', 316741)
+        response = client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertEqual(response.name, 'Kapitulation')
+        self.assertEqual(self.api.conditional, 1)
+        self.assertEqual(cache.stats['revalidated'], 1)
+        cache.close()
+
+    def testNonAsciiName(self):
+        """Non-ASCII keys and raw UTF-8 bodies are stored and read back."""
+        core.fetch = self.fetch
+        transport = MemoryTransport()
+        transport.add('base/char/kr/Fl\xc3\xa5sh!5',
+                '{"region": "kr", "name": "Fl\xc3\xa5sh", "bnet_id": 5}')
+        cache = DiskCache(self.path, compact_interval=None)
+        client = Sc2Ranks('key', cache=cache, transport=transport)
+        client.fetch_base_character('kr', 'Fl\xc3\xa5sh', 5)
+        response = client.fetch_base_character('kr', u'Flåsh', 5)
+        self.assertEqual(response.name, u'Flåsh')
+        self.assertEqual(len(transport.requests), 1)
+        cache.close()
+
+    def testCompact(self):
+        """Compaction deletes responses which are no longer kept."""
+        cache = DiskCache(self.path, keep=0, compact_interval=None)
+        cache.set('a', 1, ttl=0)
+        cache.set('b', 2, ttl=60)
+        self.assertEqual(cache.compact(), 1)
+        self.assertEqual(len(cache), 1)
+        cache.close()
+
+    def testMassCharactersAreCached(self):
+        """Mass requests only ask for characters which are not cached."""
+        cache = DiskCache(self.path, compact_interval=None)
+        client = Sc2Ranks('key', cache=cache)
+        requests = []
+
+        def fetch(url, params=None, pool=None, headers=None, timeout=None):
+            requests.append(params)
+            return 200, {}, '[{"region": "eu", "name": "A", "bnet_id": 1}]'
+        fetch_orig, core.fetch = core.fetch, fetch
+        try:
+            list(client.fetch_mass_base_characters([('eu', 'A', 1)]))
+            result = list(client.fetch_mass_base_characters([('eu', 'A', 1)]))
+        finally:
+            core.fetch = fetch_orig
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(result[0].name, 'A')
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import pickle
 import unittest
 
 from sc2ranks import Sc2Ranks, Sc2RanksResponse
@@ -100,5 +101,52 @@ class BaseTest(unittest.TestCase):
         self.assertEqual(expected, result)
 
 
+class ResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.data = {'name': PLAYER_NAME, 'bnet_id': BNET_ID,
+                     'portrait': {'icon_id': 1, 'row': 2, 'column': 3},
+                     'teams': [{'bracket': 3, 'members': [{'name': 'A'}, None]}]}
+
+    def testNestedWrapping(self):
+        """Nested objects are wrapped on access."""
+        response = Sc2RanksResponse(self.data)
+        self.assertEqual(type(response.portrait), Sc2RanksResponse)
+        self.assertEqual(response.portrait.row, 2)
+        self.assertTrue(response.teams is response.teams)
+        self.assertEqual([m.name for m in response.teams[0].members], ['A'])
+        self.assertFalse(hasattr(response, 'achievement_points'))
+
+    def testDataIsNotChanged(self):
+        """Wrapping and assigning attributes leave the JSON object alone."""
+        response = Sc2RanksResponse(self.data)
+        response.portrait
+        response.name = 'Other'
+        self.assertEqual(response.name, 'Other')
+        self.assertEqual(self.data['name'], PLAYER_NAME)
+        self.assertEqual(type(self.data['portrait']), dict)
+
+    def testEqualityAndRepr(self):
+        """Responses compare and print by their attributes."""
+        expected = Sc2RanksResponse()
+        expected.name = PLAYER_NAME
+        expected.bnet_id = BNET_ID
+        response = Sc2RanksResponse({'name': PLAYER_NAME, 'bnet_id': BNET_ID})
+        self.assertEqual(response, expected)
+        self.assertNotEqual(response, Sc2RanksResponse({'name': 'Other', 'bnet_id': BNET_ID}))
+        self.assertEqual(repr(Sc2RanksResponse({'name': PLAYER_NAME})),
+                         '<Sc2RanksResponse(name=%s)>' % PLAYER_NAME)
+
+    def testPickle(self):
+        """Responses survive pickling, e.g. in the Django cache."""
+        response = Sc2RanksResponse(self.data)
+        response.portrait
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(response, protocol))
+            self.assertEqual(copy, response)
+            self.assertEqual(copy.teams[0].bracket, 3)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,145 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.limits import RateLimiter
+from sc2ranks.transport import ConnectionPool
+from sc2ranks.test.fakes import FakeFetch, FetchTestCase
+
+BODY = json.dumps({'name': 'Kapitulation', 'bnet_id': 316741})
+
+
+def answers(*delays):
+    """A `FakeFetch` answering with `BODY` after the given delays in turn."""
+    return FakeFetch(*[(200, {}, BODY)] * len(delays), delays=delays)
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def testReadTimeout(self):
+        """A server which does not answer times out."""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        url = 'http://127.0.0.1:%d/api/search.json' % server.getsockname()[1]
+        pool = ConnectionPool(read_timeout=5)
+        start = time.time()
+        try:
+            self.assertRaises(IOError, pool.urlopen, url, timeout=0.1)
+        finally:
+            server.close()
+        self.assertTrue(time.time() - start < 1)
+
+
+class DeadlineTest(FetchTestCase):
+
+    def testClientTimeout(self):
+        """Requests get the timeout of the client."""
+        core.fetch = fetch = answers(0)
+        client = Sc2Ranks('key', timeout=0.5)
+        client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertTrue(0.4 < fetch.timeouts[0] <= 0.5)
+
+    def testDeadlineBlock(self):
+        """Calls in a deadline block share its budget."""
+        core.fetch = fetch = answers(0.05, 0)
+        client = Sc2Ranks('key', timeout=10)
+        with client.deadline(1.0):
+            client.fetch_base_character('eu', 'Kapitulation', 316741)
+            client.fetch_base_character_teams('eu', 'Kapitulation', 316741)
+            # nested blocks cannot extend the deadline
+            with client.deadline(5.0) as deadline:
+                self.assertTrue(deadline.remaining() < 1.0)
+        self.assertTrue(fetch.timeouts[1] <= 0.95)
+
+    def testExpired(self):
+        """Nothing is sent once the deadline has passed."""
+        core.fetch = fetch = answers()
+        client = Sc2Ranks('key')
+        with client.deadline(0):
+            self.assertEqual(client.fetch_base_character('eu', 'Kapitulation', 316741), None)
+        self.assertEqual(fetch.timeouts, [])
+
+
+    def testLimiterWait(self):
+        """Waiting for the rate limiter ends with the deadline."""
+        core.fetch = fetch = answers(0)
+        client = Sc2Ranks('key', limiter=RateLimiter(rate=0.5))
+        client.fetch_base_character('eu', 'Kapitulation', 316741)
+        start = time.time()
+        with client.deadline(0.2):
+            self.assertEqual(client.fetch_base_character('eu', 'Other', 1), None)
+            self.assertEqual(list(client.iter_custom_division_characters(1)), [])
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(len(fetch.timeouts), 1)
+        self.assertEqual(client.limiter.stats['expired'], 2)
+
+    def testCoalescedDeadline(self):
+        """A call joining a running request waits until its own deadline."""
+        core.fetch = answers(0.5)
+        client = Sc2Ranks('key')
+        leader = threading.Thread(target=client.fetch_base_character,
+                                  args=('eu', 'Kapitulation', 316741))
+        leader.start()
+        time.sleep(0.05)
+        start = time.time()
+        with client.deadline(0.1):
+            self.assertEqual(client.fetch_base_character('eu', 'Kapitulation', 316741), None)
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(client.flights.stats['coalesced'], 1)
+        self.assertEqual(client.metrics.snapshot()['base/char']['errors'], 1)
+        leader.join()
+
+    def testStreamExpired(self):
+        """Nothing is streamed once the deadline has passed."""
+        client = Sc2Ranks('key')
+        client.transport = None
+        with client.deadline(0):
+            self.assertEqual(list(client.iter_custom_division_characters(1)), [])
+
+
+class HedgingTest(FetchTestCase):
+
+    def testHedged(self):
+        """A slow request is overtaken by its hedge."""
+        core.fetch = answers(0.5, 0)
+        client = Sc2Ranks('key', hedge=0.05)
+        start = time.time()
+        response = client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(response.bnet_id, 316741)
+        self.assertEqual(client.hedges, {'sent': 1, 'won': 1})
+        self.assertEqual(client.metrics.snapshot()['base/char']['hedges_won'], 1)
+
+    def testHedgeTakesLimiterTurn(self):
+        """A hedge is only sent with a free limiter turn, and gives it back."""
+        core.fetch = answers(0.3, 0)
+        client = Sc2Ranks('key', hedge=0.05, limiter=RateLimiter(concurrency=2))
+        self.assertEqual(client.fetch_base_character('eu', 'Kapitulation', 316741).bnet_id, 316741)
+        time.sleep(0.35)
+        self.assertEqual(client.limiter.stats['requests'], 2)
+        self.assertEqual(client.limiter.concurrency.in_flight, 0)
+
+        core.fetch = answers(0.2)
+        client = Sc2Ranks('key', hedge=0.05, limiter=RateLimiter(concurrency=1))
+        self.assertEqual(client.fetch_base_character('eu', 'Kapitulation', 316741).bnet_id, 316741)
+        self.assertEqual(client.hedges['sent'], 0)
+        self.assertEqual(client.limiter.stats['requests'], 1)
+        self.assertEqual(client.limiter.stats['expired'], 0)
+
+    def testPercentile(self):
+        """With hedge=True, the p95 latency is used once it is known."""
+        core.fetch = answers(*[0] * 30)
+        client = Sc2Ranks('key', hedge=True)
+        for i in range(core.HEDGE_MIN_SAMPLES):
+            self.assertEqual(client._hedge_delay('base/char'), None)
+            client.fetch_base_character('eu', 'Player%d' % i, i)
+        self.assertEqual(client._hedge_delay('base/char'), 0.01)
+        self.assertEqual(client.hedges['sent'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
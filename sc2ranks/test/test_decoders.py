@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from sc2ranks import core, decoders, Sc2Ranks, Sc2RanksResponse
+from sc2ranks.decoders import get_decoder, register_decoder, set_default_decoder
+
+BODY = '{"name": "Kapitulation", "portrait": {"row": 2}, "teams": [{"bracket": 1}]}'
+
+
+class DecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.default = get_decoder()
+
+    def tearDown(self):
+        set_default_decoder(self.default)
+        decoders._DECODERS.pop('test', None)
+        unittest.TestCase.tearDown(self)
+
+    def testDefault(self):
+        """The default decoder is the first available one."""
+        available = [name for name in decoders.PREFERENCE
+                     if name in decoders.available_decoders()]
+        self.assertEqual(get_decoder().name, available[0])
+        self.assertRaises(ValueError, get_decoder, 'nonexistent')
+
+    def testRegister(self):
+        """Registered decoders can be selected by name."""
+        calls = []
+
+        def loads(data):
+            calls.append(data)
+            return json.loads(data)
+        register_decoder('test', loads)
+        set_default_decoder('test')
+        self.assertEqual(core.decode_json('[1]'), [1])
+        self.assertEqual(calls, ['[1]'])
+
+    def testObjectHook(self):
+        """Hooks run innermost first, with and without native support."""
+        def hook(d):
+            return tuple(sorted(d))
+        native = register_decoder('native', json.loads, supports_object_hook=True)
+        emulated = register_decoder('test', json.loads)
+        expected = ('name', 'portrait', 'teams')
+        self.assertEqual(native.loads(BODY, hook), expected)
+        self.assertEqual(emulated.loads(BODY, hook), expected)
+        decoders._DECODERS.pop('native')
+
+    def testResponsesBuiltWhileDecoding(self):
+        """Sc2RanksResponse can be used as the object hook of a client."""
+        def fetch(url, params=None, pool=None, headers=None, timeout=None):
+            return 200, {}, BODY
+        fetch_orig, core.fetch = core.fetch, fetch
+        try:
+            client = Sc2Ranks('key', object_hook=Sc2RanksResponse)
+            response = client.fetch_base_character('eu', 'Kapitulation', 1)
+        finally:
+            core.fetch = fetch_orig
+        self.assertEqual(type(response), Sc2RanksResponse)
+        self.assertEqual(response.portrait.row, 2)
+        self.assertEqual(response.teams[0].bracket, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of django_helpers.py, which lives next to the sc2ranks package. Django
+itself is replaced by stub modules holding a dict based cache and the
+settings, so neither an installed Django nor a configured project is needed.
+"""
+import sys
+import types
+import unittest
+
+from sc2ranks.core import Sc2RanksResponse
+
+
+class FakeCache(object):
+    """The part of the Django cache API django_helpers uses, counting calls."""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(('get', key))
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.calls.append(('set', key))
+        self.data[key] = value
+
+    def get_many(self, keys):
+        self.calls.append(('get_many', sorted(keys)))
+        return dict((key, self.data[key]) for key in keys if key in self.data)
+
+    def set_many(self, mapping, timeout=None):
+        self.calls.append(('set_many', sorted(mapping)))
+        self.data.update(mapping)
+
+
+def _import_django_helpers():
+    stubs = {}
+    for name in ('django', 'django.conf', 'django.core', 'django.core.cache'):
+        stubs[name] = types.ModuleType(name)
+    stubs['django.conf'].settings = types.ModuleType('settings')
+    stubs['django.conf'].settings.SC2RANKS_API_KEY = 'key'
+    stubs['django.core.cache'].cache = FakeCache()
+    saved = dict((name, sys.modules.get(name)) for name in stubs)
+    sys.modules.update(stubs)
+    try:
+        import django_helpers
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+    return django_helpers
+
+django_helpers = _import_django_helpers()
+
+
+class FakeClient(object):
+    """Answers like `Sc2Ranks` for the characters in `known`, counting calls."""
+
+    def __init__(self, known):
+        self.known = known
+        self.calls = []
+
+    def _character(self, region, name, bnet_id, members=False):
+        if name not in self.known:
+            return None
+        teams = [{'points': 100}]
+        if members:
+            # char/teams of a partner bracket, one team per partner
+            teams = [{'points': 100, 'members': [{'name': name}, {'name': 'Partner'}]},
+                     {'points': 50, 'members': [{'name': name}, {'name': 'Other'}]}]
+        return Sc2RanksResponse({'region': region, 'name': name,
+            'bnet_id': bnet_id, 'portrait': {'icon_id': 1, 'row': 2, 'column': 3},
+            'teams': teams})
+
+    def fetch_base_character(self, region, name, bnet_id):
+        self.calls.append(('base', name))
+        return self._character(region, name, bnet_id)
+
+    def fetch_character_teams(self, region, name, bnet_id, bracket, is_random=False):
+        self.calls.append(('teams', name))
+        return self._character(region, name, bnet_id, members=bracket > 1)
+
+    def fetch_mass_base_characters(self, characters):
+        self.calls.append(('mass', sorted(c[1] for c in characters)))
+        return [c for c in [self._character(*c) for c in characters] if c]
+
+    def fetch_mass_characters_team(self, characters, bracket='1v1', is_random=False):
+        self.calls.append(('mass teams', sorted(c[1] for c in characters)))
+        return [c for c in [self._character(*c) for c in characters] if c]
+
+
+class Player(object):
+    sc2 = django_helpers.Sc2RanksManager('name', 'realm', 'bid')
+
+    def __init__(self, realm, name, bid):
+        self.realm = realm
+        self.name = name
+        self.bid = bid
+
+
+class DjangoHelpersTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.cache = django_helpers.cache = FakeCache()
+        self.client = django_helpers._client = FakeClient(['Known', 'Cached'])
+
+    def tearDown(self):
+        django_helpers._client = None
+        unittest.TestCase.tearDown(self)
+
+    def testPrefetch(self):
+        """Cached data is read at once, the rest fetched with mass calls."""
+        key = django_helpers.base_character_cache_key('eu', 1, 'Cached')
+        self.cache.data[key] = 'cached data'
+        players = django_helpers.prefetch_sc2ranks(
+            [Player('eu', 'Cached', 1), Player('eu', 'Known', 2),
+             Player('eu', 'Gone', 3), Player('eu', None, 4)], brackets=(1,))
+        self.assertEqual([call[0] for call in self.cache.calls],
+                         ['get_many', 'set_many'])
+        self.assertEqual(len(self.cache.calls[0][1]), 6)
+        self.assertEqual(len(self.cache.calls[1][1]), 3)
+        self.assertEqual(sorted(self.client.calls),
+                         [('mass', ['Gone', 'Known']),
+                          ('mass teams', ['Cached', 'Gone', 'Known'])])
+
+        # later accesses neither read the cache nor fetch
+        del self.cache.calls[:], self.client.calls[:]
+        self.assertEqual(players[0].sc2.base_character, 'cached data')
+        self.assertEqual(players[1].sc2.base_character.bnet_id, 2)
+        self.assertEqual(players[1].sc2.get_portrait()['image'], 'portraits-1-75.jpg')
+        self.assertEqual(len(players[1].sc2.get_team_stats(1)), 1)
+        self.assertEqual(players[2].sc2.base_character, None)
+        self.assertEqual(players[2].sc2.get_team_stats(1), [])
+        self.assertEqual(self.cache.calls, [])
+        self.assertEqual(self.client.calls, [])
+
+    def testPartnerBrackets(self):
+        """Partner brackets are not prefetched, the mass API has no members."""
+        self.assertRaises(ValueError, django_helpers.prefetch_sc2ranks,
+                          [Player('eu', 'Known', 2)], brackets=(1, 2))
+        self.assertEqual(self.client.calls, [])
+        player, = django_helpers.prefetch_sc2ranks([Player('eu', 'Known', 2)],
+                                                   brackets=(1,))
+        teams = player.sc2.get_team_stats(2, 'Known', 'Partner')
+        self.assertEqual([team.points for team in teams], [100])
+        self.assertEqual(self.client.calls[-1], ('teams', 'Known'))
+
+    def testWarmPartnerBrackets(self):
+        """The warmer does not store mass teams where char/teams are read."""
+        self.assertRaises(ValueError, django_helpers.warm_sc2ranks,
+                          [Player('eu', 'Known', 2)], brackets=(2,), once=True)
+        self.assertEqual(self.client.calls, [])
+        django_helpers.warm_sc2ranks([Player('eu', 'Known', 2)], once=True)
+        key = django_helpers.team_stats_cache_key('eu', 2, 'Known', 1)
+        self.assertEqual(self.cache.data[key].teams[0].points, 100)
+
+    def testMemoized(self):
+        """Without prefetching, each lookup hits the cache once per instance."""
+        player = Player('eu', 'Known', 2)
+        player.sc2.get_portrait()
+        player.sc2.get_portrait()
+        self.assertEqual([call[0] for call in self.cache.calls], ['get', 'set'])
+        self.assertEqual(self.client.calls, [('base', 'Known')])
+        # a new instance, as in the next request, reads the cache again
+        Player('eu', 'Known', 2).sc2.get_portrait()
+        self.assertEqual(len(self.client.calls), 1)
+
+    def testCacheKeys(self):
+        """Keys tell regions apart and stay valid for memcached."""
+        key = django_helpers.base_character_cache_key
+        self.assertNotEqual(key('eu', 1, 'Name'), key('us', 1, 'Name'))
+        self.assertEqual(key('EU', 1, 'Name'), key('eu', 1, 'Name'))
+        self.assertNotEqual(key('eu', 1, 'Name'),
+                            django_helpers.team_stats_cache_key('eu', 1, 'Name', 1))
+        self.assertEqual(key('kr', 5, u'Flåsh'), 'sc2ranks:%d:kr:5:Fl%%C3%%A5sh:%s' % (
+            django_helpers.CACHE_KEY_VERSION, django_helpers.BASE_CHARACTER))
+
+    def testTrackedCharacters(self):
+        """Instances without all bnet fields are skipped."""
+        class QuerySet(list):
+            def all(self):
+                return self
+        players = QuerySet([Player('eu', 'A', 1), Player('eu', '', 2)])
+        self.assertEqual(django_helpers.tracked_characters(players),
+                         [('eu', 'A', 1)])
+
+    def testFindManager(self):
+        class TwoManagers(Player):
+            other = django_helpers.Sc2RanksManager('name', 'realm', 'bid')
+        self.assertTrue(django_helpers._find_manager(Player) is Player.__dict__['sc2'])
+        self.assertRaises(ValueError, django_helpers._find_manager, TwoManagers)
+        self.assertTrue(django_helpers._find_manager(TwoManagers, 'other')
+                        is TwoManagers.__dict__['other'])
+
+
+if __name__ == '__main__':
+    unittest.main()
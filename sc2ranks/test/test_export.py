@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from sc2ranks.core import Sc2RanksResponse
+from sc2ranks.export import TeamExporter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DIVISION = [
+    {'points': 900, 'wins': 30, 'losses': 10, 'league': 'Master',
+     'division_rank': 1, 'bracket': 2, 'members': [
+         {'region': 'EU', 'name': 'HuK', 'bnet_id': 1},
+         {'region': 'eu', 'name': u'Flåsh', 'bnet_id': 2}]},
+    {'points': 'n/a', 'league': 'diamond', 'members': [
+         {'region': 'us', 'name': 'Idra', 'bnet_id': 3}]},
+]
+
+CHARACTER = {'region': 'kr', 'name': 'Mvp', 'bnet_id': 4, 'teams': [
+    {'points': 100, 'wins': 5, 'losses': 1, 'league': 'grandmaster',
+     'bracket': 1, 'is_random': False},
+    {'points': 50, 'league': 'master', 'bracket': 1, 'is_random': True}]}
+
+
+class TeamExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.exporter = TeamExporter().add_all(
+            [Sc2RanksResponse(team) for team in DIVISION] +
+            [Sc2RanksResponse(CHARACTER), None])
+
+    def column(self, name):
+        for column, buffer, valid in self.exporter.columns():
+            if column == name:
+                if valid is None:
+                    return list(buffer)
+                return [value if ok else None for value, ok in zip(buffer, valid)]
+
+    def testRows(self):
+        """Division teams give a row per member, characters one per team."""
+        self.assertEqual(len(self.exporter), 5)
+        self.assertEqual(self.exporter.teams, 4)
+        self.assertEqual(self.column('team'), [0, 0, 1, 2, 3])
+        self.assertEqual(self.column('name'),
+                         [u'HuK', u'Flåsh', u'Idra', u'Mvp', u'Mvp'])
+        self.assertEqual(self.column('region'), [u'eu', u'eu', u'us', u'kr', u'kr'])
+        self.assertEqual(self.column('league'),
+                         [u'master', u'master', u'diamond', u'grandmaster', u'master'])
+        self.assertEqual(self.column('is_random'), [0, 0, 0, 0, 1])
+
+    def testMissingNumbers(self):
+        """Missing numbers are marked invalid, not given a value."""
+        self.assertEqual(self.column('points'), [900, 900, None, 100, 50])
+        self.assertEqual(self.column('wins'), [30, 30, None, 5, None])
+        self.assertEqual(self.column('team'), [0, 0, 1, 2, 3])
+
+    def testNumpy(self):
+        if numpy is None:
+            self.skipTest("numpy is not installed")
+        table = self.exporter.to_numpy()
+        self.assertEqual(table['points'].sum(), 900 + 900 + 100 + 50)
+        self.assertEqual(table['wins'].count(), 3)
+        self.assertEqual(list(table['name'][table['league'] == u'master']),
+                         [u'HuK', u'Flåsh', u'Mvp'])
+
+    def testArrow(self):
+        if pyarrow is None:
+            self.skipTest("pyarrow is not installed")
+        batch = self.exporter.to_arrow()
+        self.assertEqual(batch.num_rows, 5)
+        points = batch.column(batch.schema.get_field_index('points'))
+        self.assertEqual(points.null_count, 1)
+        self.assertEqual(points.to_pylist(), [900, 900, None, 100, 50])
+
+    def testParquet(self):
+        if pyarrow is None:
+            self.skipTest("pyarrow is not installed")
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'teams.parquet')
+            self.exporter.write_parquet(path)
+            table = pyarrow.parquet.read_table(path)
+            self.assertEqual(table.num_rows, 5)
+            self.assertEqual(table.column('wins').to_pylist(),
+                             [30, 30, None, 5, None])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
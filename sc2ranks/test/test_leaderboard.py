@@ -0,0 +1,109 @@
+import unittest
+
+from sc2ranks.core import Sc2RanksResponse
+from sc2ranks.leaderboard import Leaderboard, LeaderboardIndex, team_id
+
+
+def team(name, points, league='master', region='eu'):
+    return Sc2RanksResponse({'points': points, 'league': league,
+        'members': [{'region': region, 'name': name, 'bnet_id': len(name)}]})
+
+
+class FakeClient(object):
+
+    def __init__(self, divisions):
+        self.divisions = divisions
+
+    def fetch_custom_division_characters(self, division_id, region='all',
+                                         league='all', bracket=1, is_random=False):
+        return self.divisions.get(division_id)
+
+
+class LeaderboardTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.board = Leaderboard()
+        for name, points in [('a', 500), ('bb', 800), ('ccc', 500), ('dddd', 100)]:
+            self.board.add(team(name, points))
+
+    def testRank(self):
+        """Teams are ranked by points, equal points share a rank."""
+        self.assertEqual([t.members[0].name for t in self.board.top(2)],
+                         ['bb', 'a'])
+        self.assertEqual(self.board.rank_of(team('bb', 0)), 1)
+        self.assertEqual(self.board.rank_of(team('ccc', 0)), 2)
+        self.assertEqual(self.board.rank_of(team('a', 0)), 2)
+        self.assertEqual(self.board.rank_of(team('dddd', 0)), 4)
+        self.assertEqual(self.board.rank_of(team('unknown', 0)), None)
+        self.assertEqual(self.board.rank(900), 1)
+        self.assertEqual(self.board.rank(50), 5)
+
+    def testPercentile(self):
+        self.assertEqual(self.board.percentile(800), 100.0)
+        self.assertEqual(self.board.percentile(500), 75.0)
+        self.assertEqual(self.board.percentile(100), 25.0)
+        self.assertEqual(self.board.percentile(0), 0.0)
+        self.assertEqual(Leaderboard().percentile(10), None)
+
+    def testUpdate(self):
+        """Adding a team again moves it, removing takes it off the board."""
+        self.board.add(team('dddd', 1000))
+        self.assertEqual(len(self.board), 4)
+        self.assertEqual(self.board.rank_of(team('dddd', 0)), 1)
+        self.assertTrue(self.board.remove(team('a', 0)))
+        self.assertFalse(self.board.remove(team('a', 0)))
+        self.assertEqual([t.members[0].name for t in self.board.teams()],
+                         ['dddd', 'bb', 'ccc'])
+
+
+class LeaderboardIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.client = FakeClient({
+            1: [team('a', 500), team('bb', 300, league='diamond')],
+            2: [team('a', 500), team('ccc', 700, region='us')],
+        })
+        self.index = LeaderboardIndex(self.client)
+        self.index.load_divisions([1, 2])
+
+    def testBoards(self):
+        """Teams are split by region, league and bracket."""
+        self.assertEqual(sorted(self.index.boards.keys()),
+                         [('eu', 'diamond', 1), ('eu', 'master', 1),
+                          ('us', 'master', 1)])
+        self.assertEqual(len(self.index.board('EU', 'Master', 1)), 1)
+        self.assertEqual(len(self.index.board('kr', 'master', 1)), 0)
+        self.assertTrue(self.index.find(team('ccc', 0, region='us')) is
+                        self.index.board('us', 'master'))
+
+    def testReload(self):
+        """Reloading a division updates the index incrementally."""
+        self.client.divisions[1] = [team('a', 900), team('bb', 400, league='master')]
+        self.index.load_division(1)
+        master = self.index.board('eu', 'master')
+        self.assertEqual([(t.members[0].name, t.points) for t in master.teams()],
+                         [('a', 900), ('bb', 400)])
+        self.assertFalse(('eu', 'diamond', 1) in self.index.boards)
+
+        # 'a' is still in division 2
+        self.client.divisions[1] = []
+        self.index.load_division(1)
+        self.assertEqual([t.members[0].name for t in master.teams()], ['a'])
+        self.index.remove_division(2)
+        self.assertEqual(self.index.boards, {})
+
+    def testFailedFetch(self):
+        """A failed fetch keeps the data loaded before."""
+        self.client.divisions[1] = None
+        self.assertEqual(self.index.load_division(1), None)
+        self.assertEqual(len(self.index.board('eu', 'diamond')), 1)
+
+    def testTeamId(self):
+        self.assertEqual(team_id(team('Name', 0, region='EU')),
+                         ((u'eu', u'name', 4),))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.deadlines import Deadline
+from sc2ranks.limits import (AdaptiveConcurrency, RateLimiter, TokenBucket,
+                             is_throttled)
+from sc2ranks.test.fakes import FetchTestCase
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def testRate(self):
+        """Tokens beyond the burst are handed out at the given rate."""
+        bucket = TokenBucket(rate=100, burst=2)
+        start = time.time()
+        for i in range(7):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.045)
+
+    def testPause(self):
+        """A paused bucket hands out nothing until the pause is over."""
+        bucket = TokenBucket(rate=1000)
+        bucket.pause(0.05)
+        self.assertTrue(bucket.acquire() >= 0.04)
+
+    def testDeadline(self):
+        """No waiting for a token which comes after the deadline."""
+        bucket = TokenBucket(rate=0.5)
+        bucket.acquire()
+        start = time.time()
+        self.assertEqual(bucket.acquire(Deadline(0.2)), None)
+        self.assertTrue(time.time() - start < 0.1)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def testNonBlocking(self):
+        concurrency = AdaptiveConcurrency(initial=1)
+        self.assertTrue(concurrency.acquire(blocking=False))
+        start = time.time()
+        self.assertFalse(concurrency.acquire(blocking=False))
+        self.assertTrue(time.time() - start < 0.05)
+
+    def testAIMD(self):
+        """Successes raise the limit slowly, congestion halves it."""
+        concurrency = AdaptiveConcurrency(initial=4, maximum=8)
+        for i in range(8):
+            concurrency.acquire()
+            concurrency.release()
+        self.assertTrue(5 < concurrency.limit < 6)
+        concurrency.acquire()
+        concurrency.release(congested=True)
+        self.assertTrue(2.5 < concurrency.limit < 3)
+        # congestion right after a decrease does not count again
+        concurrency.acquire()
+        concurrency.release(congested=True)
+        self.assertTrue(2.5 < concurrency.limit < 3)
+
+    def testLimit(self):
+        """No more requests than the limit are in flight."""
+        concurrency = AdaptiveConcurrency(initial=2, maximum=2)
+        running = []
+
+        def request():
+            concurrency.acquire()
+            running.append(concurrency.in_flight)
+            time.sleep(0.02)
+            concurrency.release()
+        threads = [threading.Thread(target=request) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(running), 2)
+
+    def testDeadline(self):
+        """Waiting for a slot ends with the deadline."""
+        concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+        concurrency.acquire()
+        start = time.time()
+        self.assertFalse(concurrency.acquire(Deadline(0.05)))
+        self.assertTrue(time.time() - start < 0.5)
+        concurrency.cancel()
+        self.assertTrue(concurrency.acquire(Deadline(0.05)))
+
+
+class RateLimiterTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        self.responses = []
+        core.fetch = lambda url, *args, **kwargs: self.responses.pop(0)
+
+    def testThrottled(self):
+        """Throttled responses are recognized by status or error message."""
+        self.assertTrue(is_throttled(429))
+        self.assertTrue(is_throttled(200, {'error': 'Rate limit exceeded'}))
+        self.assertFalse(is_throttled(200, {'error': 'no_characters'}))
+        self.assertFalse(is_throttled(500))
+
+    def testRetry(self):
+        """Throttled and failed requests are retried with backoff."""
+        limiter = RateLimiter(backoff=0.01)
+        client = Sc2Ranks('key', limiter=limiter)
+        body = json.dumps({'name': 'Kapitulation', 'bnet_id': 316741})
+        self.responses.extend([(503, {}, 'Busy'), (502, {}, 'Bad gateway'),
+                               (200, {}, body)])
+        response = client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertEqual(response.bnet_id, 316741)
+        self.assertEqual(limiter.stats['retries'], 2)
+        self.assertEqual(limiter.stats['throttled'], 1)
+        self.assertEqual(limiter.concurrency.in_flight, 0)
+
+    def testRetryAfter(self):
+        """Retry-After is respected and retries are limited."""
+        limiter = RateLimiter(rate=100, retries=1)
+        client = Sc2Ranks('key', limiter=limiter)
+        self.responses.extend([(429, {'retry-after': '0.05'}, '{}')] * 2)
+        start = time.time()
+        self.assertEqual(client.api_fetch('base/char/eu/Kapitulation!316741'), {})
+        self.assertTrue(time.time() - start >= 0.05)
+        self.assertEqual(limiter.stats['retries'], 1)
+        self.assertEqual(self.responses, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from sc2ranks import core
+from sc2ranks.core import Sc2Ranks, MAX_CHARS
+from sc2ranks.test.fakes import FakeMassAPI, FetchTestCase
+
+
+class MassFetchTest(FetchTestCase):
+
+    def characters(self, count):
+        return [('eu', 'Player%d' % i, i) for i in range(count)]
+
+    def testSequential(self):
+        """Batches are fetched one after another by default."""
+        core.fetch = api = FakeMassAPI()
+        characters = self.characters(MAX_CHARS + 10)
+        result = list(Sc2Ranks('key').fetch_mass_base_characters(characters))
+        self.assertEqual([r.bnet_id for r in result], range(MAX_CHARS + 10))
+        self.assertEqual(api.max_running, 1)
+
+    def testParallelKeepsOrder(self):
+        """Parallel batches are fetched concurrently and yielded in order."""
+        core.fetch = api = FakeMassAPI(delay=0.05)
+        characters = self.characters(MAX_CHARS * 8)
+        client = Sc2Ranks('key', mass_workers=4)
+        try:
+            result = list(client.fetch_mass_characters_team(characters))
+        finally:
+            client.close()
+        self.assertEqual([r.bnet_id for r in result], range(MAX_CHARS * 8))
+        self.assertTrue(1 < api.max_running <= 4)
+
+    def testNoEmptyTrailingBatch(self):
+        """A roster of exactly MAX_CHARS characters is one request."""
+        core.fetch = api = FakeMassAPI()
+        result = list(Sc2Ranks('key').fetch_mass_base_characters(self.characters(MAX_CHARS)))
+        self.assertEqual(len(result), MAX_CHARS)
+        self.assertEqual(len(api.requests), 1)
+        self.assertEqual(list(Sc2Ranks('key').fetch_mass_base_characters([])), [])
+        self.assertEqual(len(api.requests), 1)
+
+    def testDuplicates(self):
+        """Duplicates are requested once but answered for every occurrence."""
+        core.fetch = api = FakeMassAPI()
+        characters = [('eu', 'A', 1), ('EU', 'a', 1), ('us', 'B', 2), ('eu', 'A', '1')]
+        result = list(Sc2Ranks('key').fetch_mass_base_characters(characters))
+        self.assertEqual([r.name for r in result], ['A', 'A', 'B', 'A'])
+        self.assertTrue(result[0] is result[1])
+        self.assertEqual(api.requests, [
+            'characters%5B0%5D%5Bregion%5D=eu&characters%5B0%5D%5Bname%5D=A&characters%5B0%5D%5Bbnet_id%5D=1&'
+            'characters%5B1%5D%5Bregion%5D=us&characters%5B1%5D%5Bname%5D=B&characters%5B1%5D%5Bbnet_id%5D=2'])
+
+    def testEncoding(self):
+        """Names are URL encoded and the team parameters come first."""
+        core.fetch = api = FakeMassAPI()
+        characters = [('eu', u'K\xe4se&Co', 1)]
+        result = list(Sc2Ranks('key').fetch_mass_characters_team(characters, bracket='2v2'))
+        self.assertEqual(api.requests, [
+            'team%5Bbracket%5D=2&team%5Bis_random%5D=0&characters%5B0%5D%5Bregion%5D=eu&'
+            'characters%5B0%5D%5Bname%5D=K%C3%A4se%26Co&characters%5B0%5D%5Bbnet_id%5D=1'])
+        self.assertEqual(len(result), 1)
+
+    def testMissingCharacters(self):
+        """Characters the API does not know are skipped."""
+        core.fetch = FakeMassAPI(missing=['Player3'])
+        result = list(Sc2Ranks('key').fetch_mass_base_characters(self.characters(5)))
+        self.assertEqual([r.bnet_id for r in result], [0, 1, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
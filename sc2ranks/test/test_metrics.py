@@ -0,0 +1,105 @@
+import json
+import logging
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.cache import ResponseCache
+from sc2ranks.metrics import Metrics, REQUEST, DECODE, WRAP, ERROR, CACHE
+from sc2ranks.test.test_streaming import FakePool
+from sc2ranks.test.fakes import FetchTestCase
+
+CHARACTER = {'name': 'Kapitulation', 'bnet_id': 316741, 'portrait': {'row': 2}}
+
+
+class MetricsTest(unittest.TestCase):
+
+    def testHistogram(self):
+        """Latencies are counted in buckets, percentiles use their bounds."""
+        metrics = Metrics()
+        for latency in (0.005, 0.005, 0.2, 20.0):
+            metrics.record('base/char', REQUEST, latency=latency, bytes=10, status=200)
+        endpoint = metrics.endpoint('base/char')
+        self.assertEqual(endpoint.requests, 4)
+        self.assertEqual(endpoint.bytes, 40)
+        self.assertEqual(endpoint.latency_percentile(50), 0.01)
+        self.assertEqual(endpoint.latency_percentile(75), 0.25)
+        self.assertEqual(endpoint.latency_percentile(99), None)
+        self.assertEqual(metrics.snapshot()['base/char']['latency_histogram']['+Inf'], 1)
+
+    def testHooks(self):
+        """Hooks get every event, failing hooks do not break recording."""
+        events = []
+
+        def failing(endpoint, event, values):
+            raise RuntimeError()
+        metrics = Metrics()
+        metrics.add_hook(failing)
+        metrics.add_hook(lambda *args: events.append(args))
+        logging.disable(logging.ERROR)
+        try:
+            metrics.record('search', CACHE, hit=True)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(events, [('search', CACHE, {'hit': True})])
+        self.assertEqual(metrics.snapshot()['search']['cache_hits'], 1)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+
+class ClientMetricsTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        self.responses = []
+        core.fetch = lambda url, *args, **kwargs: self.responses.pop(0)
+
+    def testRequests(self):
+        """Requests, decoding and wrapping are recorded per endpoint."""
+        events = []
+        client = Sc2Ranks('key')
+        client.metrics.add_hook(lambda endpoint, event, values: events.append((endpoint, event)))
+        body = json.dumps(CHARACTER)
+        self.responses.append((200, {}, body))
+        client.fetch_base_character('eu', 'Kapitulation', 316741)
+        self.assertEqual(events, [('base/char', REQUEST), ('base/char', DECODE),
+                                  ('base/char', WRAP)])
+        snapshot = client.metrics.snapshot()['base/char']
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertEqual(snapshot['bytes'], len(body))
+        self.assertEqual(snapshot['errors'], 0)
+
+    def testErrors(self):
+        """API errors, undecodable bodies and connection problems count as errors."""
+        client = Sc2Ranks('key')
+        self.responses.extend([(200, {}, '{"error": "no_characters"}'),
+                               (200, {}, '<html>'), None])
+        logging.disable(logging.ERROR)
+        try:
+            for i in range(3):
+                self.assertEqual(client.search_for_character('eu', 'Nobody'), None)
+        finally:
+            logging.disable(logging.NOTSET)
+        snapshot = client.metrics.snapshot()['search']
+        self.assertEqual(snapshot['errors'], 3)
+        self.assertEqual(snapshot['requests'], 2)
+
+    def testCacheLookups(self):
+        """Cache hits and misses are counted."""
+        client = Sc2Ranks('key', cache=ResponseCache())
+        self.responses.append((200, {}, json.dumps(CHARACTER)))
+        for i in range(3):
+            client.fetch_base_character('eu', 'Kapitulation', 316741)
+        snapshot = client.metrics.snapshot()['base/char']
+        self.assertEqual((snapshot['cache_hits'], snapshot['cache_misses']), (2, 1))
+        self.assertEqual(snapshot['requests'], 1)
+
+    def testStreaming(self):
+        """Streamed requests are recorded once they are done."""
+        client = Sc2Ranks('key')
+        client.pool = FakePool(json.dumps([CHARACTER] * 3))
+        self.assertEqual(len(list(client.iter_custom_division_characters(1))), 3)
+        self.assertEqual(client.metrics.snapshot()['clist']['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.names import NameIndex
+from sc2ranks.test.fakes import FakeMassAPI, FetchTestCase
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.index = NameIndex()
+        for region, name, bnet_id in [('eu', 'HuK', 1), ('us', 'HuK', 2),
+                                      ('eu', 'Hunter', 3), ('eu', 'TheHuK', 4),
+                                      ('kr', u'Flåsh', 5)]:
+            self.index.add(region, name, bnet_id)
+
+    def names(self, *args, **kwargs):
+        return [(c['region'], c['name']) for c in self.index.find(*args, **kwargs)]
+
+    def testSearchTypes(self):
+        """All search types are answered case-insensitively."""
+        self.assertEqual(self.names('huk'), [('eu', 'HuK'), ('us', 'HuK')])
+        self.assertEqual(self.names('HU', 'starts'),
+                         [('eu', 'HuK'), ('us', 'HuK'), ('eu', 'Hunter')])
+        self.assertEqual(self.names('uK', 'ends'),
+                         [('eu', 'HuK'), ('us', 'HuK'), ('eu', 'TheHuK')])
+        self.assertEqual(self.names('ehu', 'contains'), [('eu', 'TheHuK')])
+        self.assertEqual(self.names('hehuk', 'contains'), [('eu', 'TheHuK')])
+        self.assertEqual(self.names('u', 'contains'),
+                         [('eu', 'HuK'), ('us', 'HuK'), ('eu', 'Hunter'),
+                          ('eu', 'TheHuK')])
+        self.assertEqual(self.names(u'LÅS', 'contains'), [('kr', u'Flåsh')])
+        self.assertEqual(self.names('nothere', 'contains'), [])
+        self.assertRaises(ValueError, self.index.find, 'x', 'fuzzy')
+
+    def testRegion(self):
+        self.assertEqual(self.names('huk', region='US'), [('us', 'HuK')])
+
+    def testAddData(self):
+        """Characters are found in search results and team members."""
+        index = NameIndex()
+        added = index.add_data({'total': 1, 'characters': [
+            {'region': 'eu', 'name': 'A', 'bnet_id': 1}]})
+        added += index.add_data([{'points': 1, 'members': [
+            {'region': 'eu', 'name': 'B', 'bnet_id': 2},
+            {'region': 'eu', 'name': 'A', 'bnet_id': 1}]}])
+        self.assertEqual(added, 2)
+        self.assertEqual(len(index), 2)
+
+    def testSearch(self):
+        """Searches are paged like the API's and a miss returns None."""
+        for i in range(15):
+            self.index.add('eu', 'Page%02d' % i, i)
+        result = self.index.search('eu', 'page', 'starts', offset=10)
+        self.assertEqual(result.total, 15)
+        self.assertEqual([c['name'] for c in result.characters],
+                         ['Page%02d' % i for i in range(10, 15)])
+        self.assertEqual(self.index.search('eu', 'nobody'), None)
+        self.assertEqual(self.index.stats, {'hits': 1, 'misses': 1})
+
+
+class ClientNamesTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        self.index = NameIndex()
+        self.client = Sc2Ranks('key', names=self.index)
+
+    def testFeedAndFallback(self):
+        """Responses feed the index, searches only miss to the API."""
+        requests = []
+
+        def fetch(url, *args, **kwargs):
+            requests.append(url)
+            # like the API, without the region of the characters
+            return 200, {}, json.dumps({'total': 1, 'characters': [
+                {'name': 'Remote', 'bnet_id': 7}]})
+        core.fetch = fetch
+        self.assertEqual(self.client.search_for_character('eu', 'remote').total, 1)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(len(self.index), 1)
+        self.client.search_for_character('EU', 'Remote')
+        self.assertEqual(len(requests), 1)
+        result = self.client.search_for_character('eu', 'rem', 'starts')
+        self.assertEqual(result.characters[0]['bnet_id'], 7)
+        self.assertEqual(result.characters[0]['region'], 'eu')
+        self.assertEqual(len(requests), 1)
+        # searches in all regions do not tell the region
+        self.client.search_for_character('all', 'another')
+        self.assertEqual(len(self.index), 1)
+
+    def testMass(self):
+        core.fetch = FakeMassAPI()
+        list(self.client.fetch_mass_base_characters([('eu', 'Mass', 1)]))
+        self.assertEqual(self.index.find('mass')[0]['bnet_id'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import time
+import threading
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.names import NameIndex
+from sc2ranks.test.fakes import FetchTestCase
+
+
+class FakeSearchAPI(object):
+    """Answers searches with `total` numbered characters, 10 per page."""
+
+    def __init__(self, total, delay=0.0):
+        self.total = total
+        self.delay = delay
+        self.offsets = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url, params=None, pool=None, headers=None, timeout=None):
+        offset = int(url.split('?')[0].split('/')[-1].split('.')[0])
+        self.lock.acquire()
+        self.offsets.append(offset)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.lock.release()
+        time.sleep(self.delay)
+        characters = [{'region': 'eu', 'name': 'Name%d' % i, 'bnet_id': i}
+                      for i in range(offset, min(offset + 10, self.total))]
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+        return 200, {}, json.dumps({'total': self.total, 'characters': characters})
+
+
+class SearchPagingTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        self.client = Sc2Ranks('key')
+
+    def tearDown(self):
+        self.client.close()
+        FetchTestCase.tearDown(self)
+
+    def testAllPages(self):
+        """All pages are walked in order and paging stops at the total."""
+        core.fetch = api = FakeSearchAPI(35)
+        results = list(self.client.iter_search_for_character('eu', 'name', 'starts'))
+        self.assertEqual([c['bnet_id'] for c in results], range(35))
+        self.assertEqual(sorted(api.offsets), [0, 10, 20, 30])
+
+    def testLimit(self):
+        core.fetch = api = FakeSearchAPI(100)
+        results = list(self.client.iter_search_for_character('eu', 'name',
+                'starts', limit=15, prefetch=0))
+        self.assertEqual([c['bnet_id'] for c in results], range(15))
+        self.assertEqual(api.offsets, [0, 10])
+
+    def testPrefetch(self):
+        """Later pages are fetched in parallel while the first is consumed."""
+        core.fetch = api = FakeSearchAPI(50, delay=0.1)
+        started = time.time()
+        results = list(self.client.iter_search_for_character('eu', 'name',
+                'starts', prefetch=4))
+        self.assertEqual(len(results), 50)
+        self.assertTrue(time.time() - started < 0.4)
+        self.assertTrue(api.max_running > 1)
+
+    def testPoolGrows(self):
+        """A larger prefetch than the first one gets its workers."""
+        core.fetch = FakeSearchAPI(30, delay=0.05)
+        list(self.client.iter_search_for_character('eu', 'name', prefetch=1))
+        core.fetch = api = FakeSearchAPI(50, delay=0.1)
+        list(self.client.iter_search_for_character('eu', 'name', prefetch=4))
+        self.assertEqual(self.client._search_pool.workers, 4)
+        self.assertTrue(api.max_running > 2)
+
+    def testNameIndex(self):
+        """Pages come from the API even if the index knows some names."""
+        self.client.close()
+        self.client = Sc2Ranks('key', names=NameIndex())
+        core.fetch = api = FakeSearchAPI(25)
+        self.assertEqual(self.client.search_for_character('eu', 'name', 'starts').total, 25)
+        results = list(self.client.iter_search_for_character('eu', 'name', 'starts'))
+        self.assertEqual([c['bnet_id'] for c in results], range(25))
+        self.assertEqual(sorted(api.offsets), [0, 0, 10, 20])
+        self.assertEqual(len(self.client.names), 25)
+
+    def testClose(self):
+        """Concurrent searches share one pool, which close stops."""
+        core.fetch = FakeSearchAPI(30, delay=0.05)
+        threads = [threading.Thread(target=lambda: list(
+                       self.client.iter_search_for_character('eu', 'name')))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool = self.client._search_pool
+        self.assertEqual(len(pool._threads), 2)
+        self.client.close()
+        self.assertEqual(self.client._search_pool, None)
+        self.assertEqual([t for t in pool._threads if t.isAlive()], [])
+
+    def testFailedPage(self):
+        """A failed first page yields nothing."""
+        core.fetch = lambda url, *args, **kwargs: (200, {}, json.dumps({'error': 'oops'}))
+        self.assertEqual(list(self.client.iter_search_for_character('eu', 'x')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
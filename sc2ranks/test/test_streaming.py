@@ -0,0 +1,98 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from sc2ranks import Sc2Ranks
+from sc2ranks.streaming import JSONStream
+
+TEAMS = [{'points': 1234, 'league': 'diamond', 'division_rank': i,
+          'members': [{'name': u'Pl\xe4yer%d' % i, 'bnet_id': i}]}
+         for i in range(50)]
+
+
+class ChunkedFile(object):
+    """A file which returns at most `size` bytes per read, like a socket."""
+
+    def __init__(self, data, size):
+        self.f = StringIO(data)
+        self.size = size
+        self.reads = 0
+        self.closed = False
+
+    def read(self, amt=None):
+        self.reads += 1
+        if amt is None:
+            return self.f.read()
+        return self.f.read(min(amt, self.size))
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(object):
+
+    def __init__(self, body, size=7):
+        self.body = body
+        self.size = size
+
+    def urlopen(self, url, body=None, headers=None):
+        self.response = ChunkedFile(self.body, self.size)
+        return self.response
+
+
+class JSONStreamTest(unittest.TestCase):
+
+    def testElementsAcrossChunks(self):
+        """Elements split over many small reads are decoded correctly."""
+        body = json.dumps(TEAMS, indent=1)
+        for size in (1, 3, 7, 64, 100000):
+            self.assertEqual(list(JSONStream(ChunkedFile(body, size), chunk_size=size)), TEAMS)
+
+    def testNumbersAtChunkBoundary(self):
+        """A number is not cut off where a chunk ends."""
+        body = '[1234567, 89, true, null, "a\\"b"]'
+        self.assertEqual(list(JSONStream(ChunkedFile(body, 4), chunk_size=4)),
+                         [1234567, 89, True, None, 'a"b'])
+
+    def testIncremental(self):
+        """The first element is available before the body is read."""
+        f = ChunkedFile(json.dumps(TEAMS), 16)
+        first = iter(JSONStream(f, chunk_size=16)).next()
+        self.assertEqual(first, TEAMS[0])
+        self.assertTrue(f.f.tell() < len(json.dumps(TEAMS)) / 10)
+
+    def testDocument(self):
+        """Documents which are not arrays are decoded as a whole."""
+        stream = JSONStream(ChunkedFile('  {"error": "no_characters"}', 5), chunk_size=5)
+        self.assertFalse(stream.is_array)
+        self.assertEqual(stream.document(), {'error': 'no_characters'})
+        self.assertEqual(list(JSONStream(StringIO('[]'))), [])
+
+    def testMalformed(self):
+        """Malformed arrays raise ValueError."""
+        for body in ('[1 2]', '[1,', '[{"a": 1'):
+            self.assertRaises(ValueError, list, JSONStream(StringIO(body)))
+
+
+class StreamingClientTest(unittest.TestCase):
+
+    def testDivisionTeams(self):
+        """Division teams are yielded as responses."""
+        client = Sc2Ranks('key')
+        client.pool = FakePool(json.dumps(TEAMS))
+        teams = list(client.iter_custom_division_characters(5404, bracket=3))
+        self.assertEqual([t.division_rank for t in teams], range(50))
+        self.assertEqual(teams[1].members[0].name, u'Pl\xe4yer1')
+        self.assertTrue(client.pool.response.closed)
+
+    def testErrorResponse(self):
+        """Error responses yield nothing."""
+        client = Sc2Ranks('key')
+        client.pool = FakePool('{"error": "no_characters"}')
+        self.assertEqual(list(client.iter_custom_division_characters(1)), [])
+        client.pool = FakePool('[{"a": 1}, {"b"')
+        self.assertEqual(list(client.api_stream('clist/1/all/all/1/0')), [{'a': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
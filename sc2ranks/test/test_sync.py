@@ -0,0 +1,67 @@
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.sync import SyncEngine, ADDED, CHANGED, REMOVED, content_hash
+from sc2ranks.test.fakes import FakeMassAPI, FetchTestCase
+
+
+def character(bnet_id, updated_at='2011-01-01', points=0):
+    return {'region': 'eu', 'name': 'Player%d' % bnet_id, 'bnet_id': bnet_id,
+            'updated_at': updated_at, 'achievement_points': points}
+
+
+TRACKED = [('eu', 'Player%d' % i, i) for i in range(4)]
+
+
+class SyncEngineTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        core.fetch = self.api = FakeMassAPI(
+            characters=dict((i, character(i)) for i in range(4)))
+        self.engine = SyncEngine(Sc2Ranks('key'), batch_size=3)
+
+    def events(self):
+        return sorted((e.kind, e.key[2]) for e in self.engine.sync(TRACKED))
+
+    def testChanges(self):
+        """Only added, changed and removed characters are emitted."""
+        self.assertEqual(self.events(), [(ADDED, i) for i in range(4)])
+        self.assertEqual(len(self.api.requests), 2)
+        self.assertEqual(self.events(), [])
+
+        self.api.characters[0] = character(0, '2011-01-02', points=10)
+        # touched, but nothing changed
+        self.api.characters[1] = character(1, '2011-01-02')
+        del self.api.characters[2]
+        self.assertEqual(self.events(), [(CHANGED, 0), (REMOVED, 2)])
+        self.assertEqual(self.events(), [])
+        self.assertEqual(self.engine.stats[ADDED], 4)
+        self.assertEqual(self.engine.stats[CHANGED], 1)
+        self.assertEqual(self.engine.stats[REMOVED], 1)
+
+    def testUnconsumedEvent(self):
+        """An event is emitted again until it has been consumed."""
+        events = self.engine.sync(TRACKED)
+        events.next()
+        events.close()
+        self.assertEqual(len(self.events()), 4)
+
+    def testFailedBatch(self):
+        """An empty batch is a failure, not a removal of all characters."""
+        self.events()
+        core.fetch = lambda url, *args, **kwargs: (500, {}, '')
+        self.assertEqual(self.events(), [])
+        self.assertEqual(self.engine.stats['failed'], 2)
+        core.fetch = self.api
+        self.assertEqual(self.events(), [])
+
+    def testContentHash(self):
+        self.assertEqual(content_hash(character(1, '2011')),
+                         content_hash(character(1, '2012')))
+        self.assertNotEqual(content_hash(character(1)),
+                            content_hash(character(1, points=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+
+from sc2ranks import Sc2Ranks
+from sc2ranks.core import fetch, fetch_json
+from sc2ranks.transport import (ConnectionPool, MemoryTransport,
+                                RecordReplayTransport, request_key)
+
+BODY = '{"total": 1, "characters": [{"bnet_id": 316741, "name": "Kapitulation"}]}'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = BODY
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            if 'corrupt' in self.path:
+                body = body[:10] + '\xff' * 20 + body[30:]
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/api/search.json' % self.server.server_address[1]
+        self.pool = ConnectionPool(maxsize=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        unittest.TestCase.tearDown(self)
+
+    def testGzipDecompression(self):
+        """Gzip-encoded bodies are decompressed transparently."""
+        response = self.pool.urlopen(self.url)
+        self.assertEqual(response.getheader('content-encoding'), 'gzip')
+        self.assertEqual(response.read(), BODY)
+
+    def testPartialReads(self):
+        """The body can be read in small pieces."""
+        response = self.pool.urlopen(self.url)
+        chunks = []
+        chunk = response.read(7)
+        while chunk:
+            chunks.append(chunk)
+            chunk = response.read(7)
+        self.assertEqual(''.join(chunks), BODY)
+
+    def testConnectionReuse(self):
+        """Sequential requests share one keep-alive connection."""
+        for i in range(5):
+            self.assertEqual(fetch_json(self.url, pool=self.pool)['total'], 1)
+        self.assertEqual(self.pool.stats, {'requests': 5, 'connections': 1, 'reused': 4})
+        self.assertEqual(self.pool.reuse_ratio, 0.8)
+
+    def testPost(self):
+        """A body turns the request into a form POST."""
+        response = self.pool.urlopen(self.url, 'a=1&b=2')
+        self.assertEqual(response.read(), 'a=1&b=2')
+
+    def testCorruptGzip(self):
+        """A body which does not decompress is a failed request."""
+        url = self.url.replace('search', 'corrupt')
+        self.assertRaises(IOError, self.pool.urlopen(url).read)
+        self.assertEqual(fetch(url, pool=self.pool), None)
+        self.assertEqual(fetch_json(self.url, pool=self.pool)['total'], 1)
+
+    def testConnectionError(self):
+        """Connection problems are reported as None by fetch_json."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.close()
+        self.assertEqual(fetch_json(self.url, pool=self.pool), None)
+
+
+class MemoryTransportTest(unittest.TestCase):
+
+    def testRequestKey(self):
+        """Requests are identified by their API path, without the app key."""
+        self.assertEqual(
+            request_key('http://sc2ranks.com/api/base/char/eu/Name!1.json?appKey=k'),
+            ('base/char/eu/Name!1', None))
+        self.assertEqual(request_key('http://sc2ranks.com/api/mass/base/char.json?appKey=k', 'a=1'),
+                         ('mass/base/char', 'a=1'))
+
+    def testClient(self):
+        """The client can be used with canned responses."""
+        transport = MemoryTransport()
+        transport.add('base/char/eu/Kapitulation!316741',
+                      {'name': 'Kapitulation', 'bnet_id': 316741})
+        client = Sc2Ranks('key', transport=transport)
+        self.assertEqual(client.fetch_base_character('eu', 'Kapitulation', 316741).bnet_id, 316741)
+        self.assertEqual(transport.requests, [('base/char/eu/Kapitulation!316741', None)])
+        # unknown requests fail like connection problems
+        self.assertRaises(IOError, transport.urlopen, 'http://sc2ranks.com/api/search.json')
+
+
+class RecordReplayTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.path = tempfile.mkdtemp()
+        self.source = MemoryTransport()
+        self.source.add('search/exact/eu/Kapitulation/0', BODY,
+                        headers={'ETag': '"1"', 'Content-Encoding': 'gzip'})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        unittest.TestCase.tearDown(self)
+
+    def testRecordAndReplay(self):
+        """Recorded responses are played back without the source."""
+        client = Sc2Ranks('key', transport=RecordReplayTransport(
+            self.path, mode='record', transport=self.source))
+        recorded = client.search_for_character('eu', 'Kapitulation')
+        self.assertEqual(len(self.source.requests), 1)
+
+        transport = RecordReplayTransport(self.path, mode='replay')
+        client = Sc2Ranks('other key', transport=transport)
+        self.assertEqual(client.search_for_character('eu', 'Kapitulation'), recorded)
+        response = transport.urlopen('http://sc2ranks.com/api/search/exact/eu/Kapitulation/0.json')
+        self.assertEqual(response.headers, {'etag': '"1"'})
+        self.assertRaises(IOError, transport.urlopen, 'http://sc2ranks.com/api/search.json')
+
+    def testAuto(self):
+        """In auto mode, only requests without a fixture are sent."""
+        transport = RecordReplayTransport(self.path, transport=self.source)
+        url = 'http://sc2ranks.com/api/search/exact/eu/Kapitulation/0.json?appKey=key'
+        for i in range(3):
+            self.assertEqual(transport.urlopen(url).read(), BODY)
+        self.assertEqual(len(self.source.requests), 1)
+        self.assertRaises(ValueError, RecordReplayTransport, self.path, mode='live')
+
+
+if __name__ == '__main__':
+    unittest.main()
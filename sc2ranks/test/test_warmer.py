@@ -0,0 +1,90 @@
+import time
+import unittest
+
+from sc2ranks import core, Sc2Ranks
+from sc2ranks.warmer import CacheWarmer, default_base_key, default_team_key
+from sc2ranks.test.fakes import FakeMassAPI, FetchTestCase
+
+
+class CacheWarmerTest(FetchTestCase):
+
+    def setUp(self):
+        FetchTestCase.setUp(self)
+        core.fetch = self.api = FakeMassAPI(missing=['Missing'])
+        self.stored = []
+        self.warmer = CacheWarmer(Sc2Ranks('key'), self.store, ttl=60,
+                                  brackets=(1, 2))
+
+    def store(self, mapping, ttl):
+        self.stored.append((mapping, ttl))
+
+    def testRefresh(self):
+        """A batch is fetched per endpoint and stored under its keys."""
+        count = self.warmer.refresh([('eu', 'Player', 1), ('us', 'Missing', 2)])
+        self.assertEqual(count, 3)
+        self.assertEqual(len(self.api.requests), 3)
+        mapping, ttl = self.stored[0]
+        self.assertEqual(ttl, 60)
+        self.assertEqual(sorted(mapping.keys()),
+                         sorted([default_base_key('eu', 1, 'Player'),
+                                 default_team_key('eu', 1, 'Player', 1),
+                                 default_team_key('eu', 1, 'Player', 2)]))
+        self.assertEqual(mapping[default_base_key('eu', 1, 'Player')].name,
+                         'Player')
+        self.assertEqual(self.warmer.stats,
+                         {'refreshed': 3, 'missing': 3, 'batches': 1, 'errors': 0})
+
+    def testKeysUseRequestedCharacter(self):
+        """Keys are built from the character as tracked, not as returned."""
+        warmer = CacheWarmer(Sc2Ranks('key'), self.store, brackets=(),
+                             base_key=lambda *args: args)
+        warmer.refresh([('EU', 'Player', '1')])
+        self.assertEqual(self.stored[0][0].keys(), [('EU', '1', 'Player')])
+
+    def testBatches(self):
+        """Duplicates are dropped and batches hold at most batch_size."""
+        self.warmer.batch_size = 2
+        batches = self.warmer.batches([('eu', 'A', 1), ('EU', 'a', 1),
+                                       ('eu', 'B', 2), ('eu', 'C', 3)])
+        self.assertEqual(batches, [[('eu', 'A', 1), ('eu', 'B', 2)],
+                                   [('eu', 'C', 3)]])
+
+    def testSpread(self):
+        """The batches of a round are spread over the period."""
+        warmer = CacheWarmer(Sc2Ranks('key'), self.store, period=0.3,
+                             brackets=(), batch_size=1)
+        sent = []
+        refresh = warmer.refresh
+        warmer.refresh = lambda batch: (sent.append(time.time()), refresh(batch))
+        started = time.time()
+        warmer.run_once([('eu', 'Player%d' % i, i) for i in range(3)])
+        self.assertEqual(len(sent), 3)
+        self.assertTrue(sent[0] - started < 0.05)
+        self.assertTrue(0.15 < sent[2] - started < 0.3)
+
+    def testErrors(self):
+        """A failed batch is counted and the round goes on."""
+        warmer = CacheWarmer(Sc2Ranks('key'), self.store, brackets=(),
+                             batch_size=1)
+        warmer.refresh = lambda batch: 1 / 0
+        warmer.run_once([('eu', 'A', 1), ('eu', 'B', 2)], spread=False)
+        self.assertEqual(warmer.stats['errors'], 2)
+
+    def testStop(self):
+        """A running warmer stops between batches."""
+        rounds = []
+
+        def characters():
+            rounds.append(1)
+            return [('eu', 'Player%d' % i, i) for i in range(3)]
+        warmer = CacheWarmer(Sc2Ranks('key'), self.store, period=10,
+                             brackets=(), batch_size=1)
+        warmer.start(characters)
+        time.sleep(0.1)
+        warmer.stop(timeout=1)
+        self.assertEqual(len(rounds), 1)
+        self.assertEqual(warmer.stats['batches'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
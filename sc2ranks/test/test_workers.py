@@ -0,0 +1,193 @@
+import threading
+import time
+import unittest
+
+from sc2ranks import core, AsyncSc2Ranks, Sc2Ranks
+from sc2ranks.deadlines import Deadline
+from sc2ranks.workers import WorkerPool, SingleFlight, TimeoutError
+from sc2ranks.test.fakes import FetchTestCase
+
+
+class FakeClient(object):
+    """Stands in for `Sc2Ranks` and records how many calls run at once."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def fetch_base_character(self, region, name, bnet_id):
+        self.lock.acquire()
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+        return (region, name, bnet_id)
+
+    def fetch_mass_base_characters(self, characters):
+        for character in characters:
+            yield character
+
+    def fetch_character_teams(self, region, name, bnet_id, bracket, is_random=False):
+        raise ValueError(name)
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def testResultAndException(self):
+        """Futures return results and re-raise exceptions."""
+        pool = WorkerPool(workers=2)
+        self.assertEqual(pool.submit(sum, [1, 2, 3]).result(), 6)
+        future = pool.submit(int, 'x')
+        self.assertRaises(ValueError, future.result)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        pool.shutdown()
+
+    def testTimeout(self):
+        """`result` gives up after the timeout."""
+        pool = WorkerPool(workers=1)
+        future = pool.submit(time.sleep, 0.2)
+        self.assertRaises(TimeoutError, future.result, 0.01)
+        future.result()
+        pool.shutdown()
+
+    def testDoneCallback(self):
+        """Callbacks run once the call is done."""
+        pool = WorkerPool(workers=1)
+        done = []
+        future = pool.submit(sum, [1, 2])
+        future.add_done_callback(lambda f: done.append(f.result()))
+        future.result()
+        pool.shutdown()
+        self.assertEqual(done, [3])
+
+
+class AsyncSc2RanksTest(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.fake = FakeClient()
+        self.client = AsyncSc2Ranks(None, concurrency=3, client=self.fake)
+
+    def tearDown(self):
+        self.client.workers.shutdown()
+        unittest.TestCase.tearDown(self)
+
+    def testConcurrencyCap(self):
+        """No more than `concurrency` calls run at the same time."""
+        futures = [self.client.fetch_base_character('eu', 'Name%d' % i, i)
+                   for i in range(10)]
+        results = [f.result() for f in futures]
+        self.assertEqual(results, [('eu', 'Name%d' % i, i) for i in range(10)])
+        self.assertEqual(self.fake.max_running, 3)
+
+    def testMassResolvesToList(self):
+        """Mass methods resolve to lists."""
+        characters = [('eu', 'A', 1), ('us', 'B', 2)]
+        future = self.client.fetch_mass_base_characters(characters)
+        self.assertEqual(future.result(), characters)
+
+    def testErrorsPropagate(self):
+        """Exceptions raised by the client surface from `result`."""
+        future = self.client.fetch_character_teams('eu', 'Name', 1, '1v1')
+        self.assertRaises(ValueError, future.result)
+
+    def testClose(self):
+        """Only a client created by the instance is closed."""
+        closed = []
+
+        class Transport(object):
+            def close(self):
+                closed.append(self)
+        shared = Sc2Ranks('key', transport=Transport())
+        AsyncSc2Ranks(None, client=shared).close()
+        self.assertEqual(closed, [])
+        owned = AsyncSc2Ranks('key')
+        owned.client.transport = Transport()
+        owned.close()
+        self.assertEqual(closed, [owned.client.transport])
+
+
+class SingleFlightTest(FetchTestCase):
+
+    def run_concurrently(self, fn, count=10):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn()))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def testCoalescing(self):
+        """Concurrent calls for one key run once and share the result."""
+        flights = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return 42
+        results = self.run_concurrently(lambda: flights.do('key', slow))
+        self.assertEqual(results, [42] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.stats, {'calls': 10, 'coalesced': 9})
+        # once the call is done, the next one runs again
+        flights.do('key', slow)
+        self.assertEqual(len(calls), 2)
+
+    def testExceptionsAreShared(self):
+        """Waiting callers get the exception of the call."""
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError()
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except ValueError:
+                return 'raised'
+        self.assertEqual(self.run_concurrently(call, 3), ['raised'] * 3)
+
+    def testDeadline(self):
+        """A caller joining a call waits for it only until its deadline."""
+        flights = SingleFlight()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.3)
+            return 42
+        leader = threading.Thread(target=flights.do, args=('key', slow))
+        leader.start()
+        started.wait()
+        self.assertRaises(TimeoutError, flights.do, 'key', slow,
+                          deadline=Deadline(0.05))
+        leader.join()
+        self.assertEqual(flights.do('key', lambda: 1, deadline=Deadline(1)), 1)
+
+    def testClientCoalescing(self):
+        """Threads asking the client for the same character share a request."""
+        urls = []
+
+        def fetch(url, params=None, pool=None, headers=None, timeout=None):
+            urls.append(url)
+            time.sleep(0.1)
+            return 200, {}, '{"name": "Kapitulation", "bnet_id": 316741}'
+        core.fetch = fetch
+        client = Sc2Ranks('key')
+        results = self.run_concurrently(
+            lambda: client.fetch_base_character('eu', 'Kapitulation', 316741))
+        self.assertEqual([r.bnet_id for r in results], [316741] * 10)
+        self.assertEqual(len(urls), 1)
+        self.assertEqual(client.flights.stats['coalesced'], 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
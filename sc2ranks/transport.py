@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Transports used by the sc2ranks client to send its requests.
+
+A transport is any object with an `urlopen(url, body=None, headers=None)`
+method, which sends a GET request (or a POST request if a `body` is given) and
+returns a file-like response with `status`, `headers` (a dict with lowercase
+names), `read(amt=None)` and `close()`. Connection problems are raised as
+`IOError`. If the client has a deadline, `urlopen` is also passed a `timeout`
+in seconds. Transports may also have a `close()` method to release their
+resources.
+
+`ConnectionPool` is the default HTTP transport. Its connections are kept alive
+(HTTP/1.1) and pooled per host, so a client doing many API calls does not pay
+for a TCP handshake on every request. Responses are requested gzip-compressed
+and decompressed while they are read.
+
+`MemoryTransport` answers requests with canned responses and
+`RecordReplayTransport` saves real responses to fixture files and plays them
+back, so the client can be used without network access.
+"""
+
+import os
+import hashlib
+import httplib
+import logging
+import socket
+import threading
+import urllib
+import urlparse
+import zlib
+
+from decoders import json
+
+DEFAULT_POOL_SIZE = 10
+CHUNK_SIZE = 16 * 1024
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    A pool of keep-alive HTTP connections, grouped by host.
+
+    At most `maxsize` idle connections are kept per host. More connections
+    may be opened when many threads use the pool at once, but those are closed
+    instead of being returned once the pool for their host is full.
+
+    `stats` counts the requests made, the connections opened and how many
+    requests were sent over an already open (reused) connection.
+
+    **connect_timeout:** Seconds to wait for a connection to be established.
+    **Default:** None (the socket default)
+
+    **read_timeout:** Seconds to wait for the response, and for every read of
+    its body. **Default:** None (the socket default)
+    """
+
+    def __init__(self, maxsize=DEFAULT_POOL_SIZE, connect_timeout=None,
+                 read_timeout=None):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def urlopen(self, url, body=None, headers=None, timeout=None):
+        """
+        Sends a request and returns a `PooledResponse`.
+
+        The request is a POST if a `body` is given and a GET otherwise. Any
+        connection problem, including a timeout, is raised as an `IOError`.
+
+        **timeout:** The seconds left for the request. The connect and read
+        timeouts of the pool are shortened to it.
+        """
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        key = (scheme, netloc)
+        selector = path or '/'
+        if query:
+            selector = '%s?%s' % (selector, query)
+
+        request_headers = {'Accept-Encoding': 'gzip'}
+        if body:
+            method = 'POST'
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        else:
+            method = 'GET'
+            body = None
+        if headers:
+            request_headers.update(headers)
+
+        timeouts = (_shortest(self.connect_timeout, timeout),
+                    _shortest(self.read_timeout, timeout))
+        conn, reused = self._get_connection(key)
+        try:
+            response = self._send(conn, method, selector, body,
+                                  request_headers, timeouts)
+        except (httplib.HTTPException, socket.error), exc:
+            conn.close()
+            if not reused or isinstance(exc, socket.timeout):
+                raise IOError("HTTP request to %s failed: %s" % (url, exc))
+            # the server may have dropped an idle keep-alive connection, retry
+            # once over a fresh one
+            LOG.debug("Reused connection to %s failed, reconnecting", netloc)
+            conn, reused = self._new_connection(key), False
+            try:
+                response = self._send(conn, method, selector, body,
+                                      request_headers, timeouts)
+            except (httplib.HTTPException, socket.error), exc:
+                conn.close()
+                raise IOError("HTTP request to %s failed: %s" % (url, exc))
+
+        self._count('requests')
+        if reused:
+            self._count('reused')
+        return PooledResponse(self, key, conn, response)
+
+    def close(self):
+        """Closes all idle connections."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    @property
+    def reuse_ratio(self):
+        """The fraction of requests which were sent over a reused connection."""
+        if not self.stats['requests']:
+            return 0.0
+        return float(self.stats['reused']) / self.stats['requests']
+
+    def _send(self, conn, method, selector, body, headers, timeouts):
+        connect_timeout, read_timeout = timeouts
+        if conn.sock is None:
+            conn.timeout = connect_timeout
+            conn.connect()
+        conn.sock.settimeout(read_timeout)
+        conn.request(method, selector, body, headers)
+        return conn.getresponse()
+
+    def _get_connection(self, key):
+        self._lock.acquire()
+        try:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        finally:
+            self._lock.release()
+        return self._new_connection(key), False
+
+    def _new_connection(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc)
+        else:
+            conn = httplib.HTTPConnection(netloc)
+        self._count('connections')
+        return conn
+
+    def _put_connection(self, key, conn):
+        self._lock.acquire()
+        try:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.maxsize:
+                connections.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def _count(self, name):
+        self._lock.acquire()
+        try:
+            self.stats[name] += 1
+        finally:
+            self._lock.release()
+
+
+def _shortest(*timeouts):
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    if not timeouts:
+        return None
+    return min(timeouts)
+
+
+class PooledResponse(object):
+    """
+    File-like response of a `ConnectionPool` request.
+
+    The body is decompressed while it is read. `bytes_read` counts the
+    bytes received, before decompression. Once the body has been read
+    completely, the connection is handed back to the pool. Closing the
+    response early closes its connection.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self.status = response.status
+        self.reason = response.reason
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._buffer = ''
+        self._eof = False
+        self.bytes_read = 0
+        if (response.getheader('content-encoding') or '').lower() == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    @property
+    def headers(self):
+        """The response headers as a dict with lowercase names."""
+        return dict(self._response.getheaders())
+
+    def read(self, amt=None):
+        """Reads at most `amt` bytes of the body, or all of it."""
+        if amt is None:
+            chunks = [self._buffer]
+            self._buffer = ''
+            chunk = self._read_chunk()
+            while chunk:
+                chunks.append(chunk)
+                chunk = self._read_chunk()
+            return ''.join(chunks)
+
+        while len(self._buffer) < amt:
+            chunk = self._read_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._eof = True
+
+    def _read_chunk(self):
+        while not self._eof:
+            try:
+                data = self._response.read(CHUNK_SIZE)
+            except (httplib.HTTPException, socket.error), exc:
+                self.close()
+                raise IOError("Reading the response failed: %s" % exc)
+            try:
+                if not data:
+                    self._eof = True
+                    if self._decompressor is not None:
+                        data = self._decompressor.flush()
+                    self._release()
+                    return data
+                self.bytes_read += len(data)
+                if self._decompressor is not None:
+                    data = self._decompressor.decompress(data)
+            except zlib.error, exc:
+                self.close()
+                raise IOError("Decompressing the response failed: %s" % exc)
+            # the gzip header alone decompresses to nothing, keep reading
+            if data:
+                return data
+        return ''
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._response.will_close:
+            conn.close()
+        else:
+            self._pool._put_connection(self._key, conn)
+
+
+def request_key(url, body=None):
+    """
+    Returns the key `MemoryTransport` and `RecordReplayTransport` identify a
+    request by: a `(path, body)` tuple, where `path` is the API path of `url`
+    (for example 'base/char/eu/Name!123') with the query string, except for
+    the appKey parameter, so fixtures do not depend on the key.
+    """
+    path, query = urlparse.urlsplit(url)[2:4]
+    if path.startswith('/api/'):
+        path = path[len('/api/'):]
+    if path.endswith('.json'):
+        path = path[:-len('.json')]
+    query = [(name, value) for name, value in urlparse.parse_qsl(query)
+             if name != 'appKey']
+    if query:
+        path = '%s?%s' % (path, urllib.urlencode(query))
+    return urllib.unquote(path), body or None
+
+
+class MemoryResponse(object):
+    """A file-like response with a body held in memory."""
+
+    def __init__(self, status, headers, body, reason=''):
+        self.status = status
+        self.reason = reason
+        self.headers = dict((name.lower(), value)
+                            for name, value in (headers or {}).iteritems())
+        self.bytes_read = len(body)
+        self._body = body
+        self._pos = 0
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def read(self, amt=None):
+        if amt is None:
+            end = len(self._body)
+        else:
+            end = min(self._pos + amt, len(self._body))
+        data = self._body[self._pos:end]
+        self._pos = end
+        return data
+
+    def close(self):
+        self._pos = len(self._body)
+
+
+class MemoryTransport(object):
+    """
+    A transport answering requests with responses added with `add`.
+
+    Requests without a response raise an `IOError`, like a connection
+    problem would. `requests` lists the keys (see `request_key`) of all
+    requests made.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def add(self, path, body, status=200, headers=None, params=None):
+        """
+        Adds the response for a request of the API `path`, for example
+        'base/char/eu/Name!123', with the POST body `params`.
+
+        **body:** The response body. Anything but a string is encoded as JSON.
+        """
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        self.responses[(path, params or None)] = (status, headers or {}, body)
+
+    def urlopen(self, url, body=None, headers=None, timeout=None):
+        key = request_key(url, body)
+        self._lock.acquire()
+        try:
+            self.requests.append(key)
+        finally:
+            self._lock.release()
+        try:
+            status, response_headers, data = self.responses[key]
+        except KeyError:
+            raise IOError("No response for %s" % (key,))
+        return MemoryResponse(status, response_headers, data)
+
+    def close(self):
+        pass
+
+
+class RecordReplayTransport(object):
+    """
+    A transport which saves responses to fixture files and plays them back.
+
+    Each request is stored as a JSON file in the directory `path`, named by a
+    hash of its `request_key`, with the status, headers and body of the
+    response.
+
+    **mode:** 'replay' answers requests from the fixtures only and raises an
+    `IOError` for requests without one. 'record' sends every request through
+    `transport` and saves the response. 'auto' replays the requests which have
+    a fixture and records the others. **Default:** 'auto'
+
+    **transport:** The transport to record from. **Default:** a new
+    `ConnectionPool`
+    """
+
+    MODES = ('replay', 'record', 'auto')
+    # the recorded body is stored decompressed and in one piece
+    SKIPPED_HEADERS = ('content-encoding', 'content-length',
+                       'transfer-encoding', 'connection', 'set-cookie')
+
+    def __init__(self, path, mode='auto', transport=None):
+        if mode not in self.MODES:
+            raise ValueError("Unknown mode %r, use one of %s" % (
+                mode, ', '.join(self.MODES)))
+        self.path = path
+        self.mode = mode
+        self._transport = transport
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = ConnectionPool()
+        return self._transport
+
+    def fixture_path(self, url, body=None):
+        """Returns the path of the fixture file of a request."""
+        key = request_key(url, body)
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.path, '%s.json' % digest)
+
+    def urlopen(self, url, body=None, headers=None, timeout=None):
+        filename = self.fixture_path(url, body)
+        if self.mode != 'record' and os.path.exists(filename):
+            return self._replay(filename)
+        if self.mode == 'replay':
+            raise IOError("No fixture for %s" % (request_key(url, body),))
+        return self._record(filename, url, body, headers, timeout)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def _replay(self, filename):
+        f = open(filename)
+        try:
+            fixture = json.load(f)
+        finally:
+            f.close()
+        return MemoryResponse(fixture['status'], fixture['headers'],
+                fixture['body'].encode('utf-8'))
+
+    def _record(self, filename, url, body, headers, timeout):
+        if timeout is None:
+            response = self.transport.urlopen(url, body, headers)
+        else:
+            response = self.transport.urlopen(url, body, headers, timeout=timeout)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        response_headers = dict(
+            (name, value) for name, value in response.headers.iteritems()
+            if name not in self.SKIPPED_HEADERS)
+        path, params = request_key(url, body)
+        fixture = {
+            'path': path,
+            'params': params,
+            'status': response.status,
+            'headers': response_headers,
+            'body': data.decode('utf-8'),
+        }
+        LOG.debug("Recording %s to %s", path, filename)
+        f = open(filename, 'w')
+        try:
+            json.dump(fixture, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        return MemoryResponse(response.status, response_headers, data)
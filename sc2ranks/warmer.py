@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps cached characters fresh ahead of their expiry.
+
+A `CacheWarmer` fetches the tracked characters with the mass endpoints and
+stores the responses under the keys the readers of the cache look up, so
+they find warm data instead of waiting for sc2ranks.com. The refresh of all
+characters is spread evenly over `period` seconds, which should be somewhat
+shorter than the time entries stay in the cache:
+
+    warmer = CacheWarmer(client, cache.set_many, ttl=CACHE_TIME,
+                         brackets=(1, 2))
+    warmer.run(lambda: tracked_characters())
+
+The cache is only written through `store(mapping, ttl)`, which is the
+signature of Django's `cache.set_many`.
+"""
+
+import time
+import logging
+import threading
+
+from core import MAX_CHARS, character_key
+
+LOG = logging.getLogger(__name__)
+
+BASE = 'base'
+
+
+def default_base_key(region, bnet_id, name):
+    return u'%s/%s/%s!%s' % (BASE, region.lower(), name, bnet_id)
+
+
+def default_team_key(region, bnet_id, name, bracket):
+    return u'teams%s/%s/%s!%s' % (bracket, region.lower(), name, bnet_id)
+
+
+class CacheWarmer(object):
+    """
+    Refreshes the cached data of characters in batches.
+
+    **store:** Called as `store(mapping, ttl)` with the fetched responses by
+    cache key.
+
+    **ttl:** Seconds the stored entries live. **Default:** 4 hours
+
+    **period:** Seconds over which the refresh of all characters is spread.
+    **Default:** 3/4 of `ttl`, so every entry is refreshed before it expires
+
+    **brackets:** The team brackets to refresh, e.g. `(1, 2)`.
+    **Default:** (1,)
+
+    **base_character:** Whether to refresh the base character data.
+    **Default:** True
+
+    **base_key**, **team_key:** Build the cache key of a character's base
+    data, called with `(region, bnet_id, name)`, and of its teams, called
+    with `(region, bnet_id, name, bracket)`. The teams are those of the mass
+    endpoint, which come without their members, so `team_key` must not name
+    an entry other readers expect `char/teams` data in.
+
+    **batch_size:** Characters per batch. **Default:** `MAX_CHARS`, the most
+    one mass request takes
+
+    `stats` counts the characters refreshed, those the API did not return,
+    the batches sent and the batches which failed.
+    """
+
+    def __init__(self, client, store, ttl=60 * 60 * 4, period=None, brackets=(1,),
+                 base_character=True, base_key=default_base_key,
+                 team_key=default_team_key, batch_size=MAX_CHARS):
+        self.client = client
+        self.store = store
+        self.ttl = ttl
+        self.period = period if period is not None else ttl * 0.75
+        self.brackets = tuple(brackets)
+        self.base_character = base_character
+        self.base_key = base_key
+        self.team_key = team_key
+        self.batch_size = batch_size
+        self.stats = {'refreshed': 0, 'missing': 0, 'batches': 0, 'errors': 0}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self, characters):
+        """
+        Fetches a batch of `(region, name, bnet_id)` characters and stores
+        them. Returns the number of entries stored.
+        """
+        characters = list(characters)
+        if not characters:
+            return 0
+        self.stats['batches'] += 1
+        stored = {}
+        missing = 0
+        if self.base_character:
+            responses = self.client.fetch_mass_base_characters(characters)
+            found = self._found(responses, characters, self.base_key)
+            stored.update(found)
+            missing += len(characters) - len(found)
+        for bracket in self.brackets:
+            responses = self.client.fetch_mass_characters_team(characters,
+                    '%dv%d' % (bracket, bracket))
+            found = self._found(responses, characters, self.team_key, bracket)
+            stored.update(found)
+            missing += len(characters) - len(found)
+        if stored:
+            self.store(stored, self.ttl)
+        self.stats['refreshed'] += len(stored)
+        self.stats['missing'] += missing
+        return len(stored)
+
+    def run_once(self, characters, spread=True):
+        """
+        Refreshes every character once. With `spread`, the batches are sent
+        evenly spaced over `period` seconds, otherwise right after each other.
+        Returns early if the warmer is stopped.
+        """
+        batches = self.batches(characters)
+        if not batches:
+            return
+        started = time.time()
+        interval = float(self.period) / len(batches) if spread else 0
+        LOG.info("Refreshing %d batches, one every %.1fs", len(batches), interval)
+        for num, batch in enumerate(batches):
+            delay = started + num * interval - time.time()
+            if delay > 0:
+                self._stopped.wait(delay)
+            if self._stopped.isSet():
+                return
+            try:
+                self.refresh(batch)
+            except Exception:
+                # the next round retries them
+                self.stats['errors'] += 1
+                LOG.exception("Refreshing a batch of %d characters failed",
+                        len(batch))
+
+    def run(self, characters):
+        """
+        Refreshes the characters over and over until `stop()` is called.
+        `characters` may be a callable returning them, which is called again
+        for every round, so changes to the tracked characters are picked up.
+        """
+        while not self._stopped.isSet():
+            started = time.time()
+            if callable(characters):
+                current = characters()
+            else:
+                current = characters
+            self.run_once(current)
+            # wait for the rest of the period if there was nothing to spread
+            delay = started + self.period - time.time()
+            if delay > 0:
+                self._stopped.wait(delay)
+
+    def start(self, characters):
+        """Runs the warmer on a daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, args=(characters,),
+                                        name='sc2ranks-warmer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def batches(self, characters):
+        """Returns the unique characters in batches of `batch_size`."""
+        unique = []
+        seen = set()
+        for character in characters:
+            key = character_key(character)
+            if key not in seen:
+                seen.add(key)
+                unique.append(tuple(character))
+        return [unique[i:i + self.batch_size]
+                for i in range(0, len(unique), self.batch_size)]
+
+    def _found(self, responses, characters, key, *args):
+        """Returns the responses by cache key of the requested characters."""
+        requested = dict((character_key(c), c) for c in characters)
+        found = {}
+        for response in responses:
+            try:
+                character = requested.get(character_key(response))
+            except (TypeError, ValueError):
+                LOG.warning("Unexpected character in mass response: %r",
+                            response)
+                continue
+            if character is not None:
+                region, name, bnet_id = character
+                found[key(region, bnet_id, name, *args)] = response
+        return found
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+A small thread pool returning futures.
+
+This is used to run API calls concurrently. It only offers what the client
+needs: `WorkerPool.submit` returns a `Future` whose `result` blocks until the
+call has finished. `SingleFlight` lets concurrent identical calls share one
+execution.
+"""
+
+import sys
+import threading
+import logging
+import Queue
+
+LOG = logging.getLogger(__name__)
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+    """The result of a call which was submitted to a `WorkerPool`."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        """Returns `True` if the call has finished."""
+        return self._event.isSet()
+
+    def result(self, timeout=None):
+        """
+        Waits for the call to finish and returns its result.
+
+        If the call raised an exception, it is raised again here. If the call
+        did not finish within `timeout` seconds, `TimeoutError` is raised.
+        """
+        self._event.wait(timeout)
+        if not self._event.isSet():
+            raise TimeoutError("The call did not finish in time")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Waits for the call to finish and returns what it raised, if any."""
+        self._event.wait(timeout)
+        if not self._event.isSet():
+            raise TimeoutError("The call did not finish in time")
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Calls `fn` with this future once it is done. If it is done already,
+        `fn` is called right away.
+        """
+        self._lock.acquire()
+        try:
+            if not self._event.isSet():
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._lock.release()
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Sets the `sys.exc_info()` tuple of the exception the call raised."""
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                LOG.exception("Future callback %r failed", fn)
+
+
+class WorkerPool(object):
+    """
+    Runs submitted calls on at most `workers` threads.
+
+    The threads are started on first use and are daemon threads, so an unused
+    or forgotten pool does not keep the interpreter alive.
+    """
+
+    def __init__(self, workers=4):
+        if workers < 1:
+            raise ValueError("A WorkerPool needs at least one worker")
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules `fn(*args, **kwargs)` and returns its `Future`."""
+        if self._shutdown:
+            raise RuntimeError("Cannot submit to a WorkerPool after shutdown")
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        self._start_workers()
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker threads once the calls submitted so far are done.
+        """
+        self._lock.acquire()
+        try:
+            self._shutdown = True
+            threads = list(self._threads)
+        finally:
+            self._lock.release()
+        for thread in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start_workers(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            try:
+                result = fn(*args, **kwargs)
+            except:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key.
+
+    While a call for a key is running, other threads calling `do` with that
+    key wait for it and get its result (or exception) instead of running the
+    call themselves. `stats` counts the calls and how many were coalesced.
+    """
+
+    def __init__(self):
+        self.stats = {'calls': 0, 'coalesced': 0}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Returns `fn(*args, **kwargs)`, shared with concurrent callers.
+
+        The keyword argument `deadline`, a `sc2ranks.deadlines.Deadline`, is
+        not passed on to `fn`. A caller joining a running call waits for it
+        only until then and gets a `TimeoutError` afterwards.
+        """
+        deadline = kwargs.pop('deadline', None)
+        self._lock.acquire()
+        try:
+            self.stats['calls'] += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+            else:
+                self._calls[key] = leader = Future()
+        finally:
+            self._lock.release()
+        if future is not None:
+            if deadline is None:
+                return future.result()
+            return future.result(timeout=deadline.remaining())
+
+        try:
+            result = fn(*args, **kwargs)
+        except:
+            exc_info = sys.exc_info()
+            self._forget(key)
+            leader.set_exception(exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self._forget(key)
+        leader.set_result(result)
+        return result
+
+    def _forget(self, key):
+        self._lock.acquire()
+        try:
+            del self._calls[key]
+        finally:
+            self._lock.release()
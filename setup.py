@@ -12,7 +12,7 @@ if sys.hexversion < 0x02060000:
 
 setup(name='sc2ranks',
       version='0.4',
-      packages=find_packages(),
+      packages=find_packages(exclude=['management', 'management.*']),
       test_suite = 'sc2ranks.test',
       install_requires = [] + pre26requirements
       )